@@ -0,0 +1,151 @@
+import os
+
+# Credentials and connections, from the environment or, when OPENAI_API_KEY or
+# MONGO_DB_URI is unset, from the uncommitted checker/config.py
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+MONGO_DB_URI = os.getenv("MONGO_DB_URI")
+MONGO_DB_DATABASE_NAME = os.getenv("MONGO_DB_DATABASE_NAME")
+MONGO_DB_COLLECTION_NAME = os.getenv("MONGO_DB_COLLECTION_NAME")
+
+# OpenAI request scheduling. Chat completions and embeddings have separate
+# quotas on the OpenAI side, so each gets its own limits.
+OPENAI_CHAT_MAX_CONCURRENCY = int(os.getenv("OPENAI_CHAT_MAX_CONCURRENCY", "16"))
+OPENAI_CHAT_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_CHAT_REQUESTS_PER_MINUTE", "500"))
+OPENAI_CHAT_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_CHAT_TOKENS_PER_MINUTE", "200000"))
+
+OPENAI_EMBEDDING_MAX_CONCURRENCY = int(os.getenv("OPENAI_EMBEDDING_MAX_CONCURRENCY", "16"))
+OPENAI_EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_EMBEDDING_REQUESTS_PER_MINUTE", "3000"))
+OPENAI_EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("OPENAI_EMBEDDING_TOKENS_PER_MINUTE", "1000000"))
+
+# HTTP connection pool shared by all OpenAI requests
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+
+# Retries for 429 and 5xx responses
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "6"))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv("OPENAI_RETRY_BASE_DELAY", "0.5"))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv("OPENAI_RETRY_MAX_DELAY", "30"))
+
+# Embedding micro-batching: pending chunks are coalesced into one request
+# until the batch is full or the wait expires
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "256"))
+EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "10"))
+
+# Content-addressed cache for embeddings and contextual summaries
+AI_CACHE_ENABLED = os.getenv("AI_CACHE_ENABLED", "true").lower() == "true"
+AI_CACHE_PATH = os.getenv("AI_CACHE_PATH", "./.ai_cache.sqlite3")
+AI_CACHE_MAX_BYTES = int(os.getenv("AI_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+AI_CACHE_MEMORY_ITEMS = int(os.getenv("AI_CACHE_MEMORY_ITEMS", "10000"))
+
+# Buffered MongoDB writes: items are flushed with unordered insert_many
+# once a batch is full or the flush interval expires
+MONGO_BULK_BATCH_SIZE = int(os.getenv("MONGO_BULK_BATCH_SIZE", "500"))
+MONGO_BULK_FLUSH_INTERVAL_MS = float(os.getenv("MONGO_BULK_FLUSH_INTERVAL_MS", "200"))
+MONGO_MAX_PENDING_BATCHES = int(os.getenv("MONGO_MAX_PENDING_BATCHES", "4"))
+MONGO_WRITE_THREADS = int(os.getenv("MONGO_WRITE_THREADS", "4"))
+
+# Uploads are streamed to disk and rejected with 413 once they exceed this
+# many bytes, 0 for no limit
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(512 * 1024 ** 2)))
+
+# Batch uploads: several files or zip archives in one request, each file
+# becoming an ingestion job limited by UPLOAD_MAX_BYTES on its own. The request
+# body is limited by BATCH_UPLOAD_MAX_BYTES, the files spooled from it, with
+# archives decompressed, by BATCH_UPLOAD_MAX_SPOOLED_BYTES together
+BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "1000"))
+BATCH_UPLOAD_MAX_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_BYTES", str(4 * 1024 ** 3)))
+BATCH_UPLOAD_MAX_SPOOLED_BYTES = int(os.getenv("BATCH_UPLOAD_MAX_SPOOLED_BYTES", str(8 * 1024 ** 3)))
+
+# MongoDB connection pool, opened when the app starts
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+
+# Background ingestion jobs
+INGESTION_WORKERS = int(os.getenv("INGESTION_WORKERS", "2"))
+INGESTION_JOBS_DIR = os.getenv("INGESTION_JOBS_DIR", "./ingestion-jobs")
+INGESTION_JOBS_COLLECTION_NAME = os.getenv("INGESTION_JOBS_COLLECTION_NAME", "ingestion_jobs")
+INGESTION_PROGRESS_INTERVAL_SECONDS = float(os.getenv("INGESTION_PROGRESS_INTERVAL_SECONDS", "2"))
+# Jobs are claimed from MongoDB by the processes of the host holding their file.
+# A running job whose heartbeat is older than the lease is taken over, idle
+# workers look for jobs every poll interval and when a job is submitted
+INGESTION_JOB_LEASE_SECONDS = float(os.getenv("INGESTION_JOB_LEASE_SECONDS", "60"))
+INGESTION_JOB_POLL_SECONDS = float(os.getenv("INGESTION_JOB_POLL_SECONDS", "5"))
+
+# PDF text extraction runs in a process pool, sharded by page ranges
+PDF_EXTRACTION_PROCESSES = int(os.getenv("PDF_EXTRACTION_PROCESSES", str(os.cpu_count() or 1)))
+PDF_MIN_PAGES_PER_SHARD = int(os.getenv("PDF_MIN_PAGES_PER_SHARD", "20"))
+
+# Streaming ingestion: chunks flow through a bounded queue to a fixed number
+# of chunk workers per document
+INGESTION_CHUNK_WORKERS = int(os.getenv("INGESTION_CHUNK_WORKERS", "8"))
+INGESTION_QUEUE_SIZE = int(os.getenv("INGESTION_QUEUE_SIZE", "16"))
+
+# Granularity of tabular (CSV/XLSX) items:
+#   row    - one item per row, each row contextualized and embedded on its own
+#   chunk  - one item per chunk of rows, contextualized and embedded once
+#   hybrid - one item per row, embedded per row but contextualized once per chunk
+CSV_GRANULARITY = os.getenv("CSV_GRANULARITY", "row")
+XLSX_GRANULARITY = os.getenv("XLSX_GRANULARITY", "chunk")
+
+# Data rows per chunk for each granularity, the header is added on top
+ROWS_PER_CHUNK = {
+    "row": int(os.getenv("ROWS_PER_CHUNK_ROW", "24")),
+    "chunk": int(os.getenv("ROWS_PER_CHUNK_CHUNK", "10")),
+    "hybrid": int(os.getenv("ROWS_PER_CHUNK_HYBRID", "25")),
+}
+
+# XLSX sheets are streamed in blocks of about this many rows, rounded down to
+# whole chunks, and each block is rendered to chunk texts at once
+XLSX_READ_BLOCK_ROWS = int(os.getenv("XLSX_READ_BLOCK_ROWS", "5000"))
+
+# Token-budgeted PDF chunking and context assembly
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+PDF_CHUNK_MAX_TOKENS = int(os.getenv("PDF_CHUNK_MAX_TOKENS", "1000"))
+PDF_CHUNK_OVERLAP_TOKENS = int(os.getenv("PDF_CHUNK_OVERLAP_TOKENS", "100"))
+PDF_CONTEXT_MAX_TOKENS = int(os.getenv("PDF_CONTEXT_MAX_TOKENS", "3000"))
+
+# Batch contextualization: chunks that share a context are contextualized
+# together in one chat completion returning JSON
+CONTEXT_BATCHING_ENABLED = os.getenv("CONTEXT_BATCHING_ENABLED", "true").lower() == "true"
+CONTEXT_BATCH_MAX_CHUNKS = int(os.getenv("CONTEXT_BATCH_MAX_CHUNKS", "8"))
+CONTEXT_BATCH_MAX_TOKENS = int(os.getenv("CONTEXT_BATCH_MAX_TOKENS", "8000"))
+CONTEXT_BATCH_MAX_WAIT_MS = float(os.getenv("CONTEXT_BATCH_MAX_WAIT_MS", "20"))
+
+# In-process vector search: normalized float32 vectors memory-mapped from
+# VECTOR_INDEX_DIR, scored in blocks of VECTOR_INDEX_BLOCK_ROWS rows
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR", "./vector-index")
+VECTOR_INDEX_DIMENSIONS = int(os.getenv("VECTOR_INDEX_DIMENSIONS", "1536"))
+VECTOR_INDEX_BLOCK_ROWS = int(os.getenv("VECTOR_INDEX_BLOCK_ROWS", "65536"))
+# Removed and replaced rows are dropped by copying the live rows to a new file
+# once they reach this share of the index and at least this many rows
+VECTOR_INDEX_COMPACT_RATIO = float(os.getenv("VECTOR_INDEX_COMPACT_RATIO", "0.25"))
+VECTOR_INDEX_COMPACT_MIN_ROWS = int(os.getenv("VECTOR_INDEX_COMPACT_MIN_ROWS", "10000"))
+# Every process keeps its own index. Writes are logged in a collection, kept for
+# VECTOR_INDEX_CHANGES_TTL_SECONDS, which the other processes poll every
+# VECTOR_INDEX_SYNC_INTERVAL_SECONDS to update their index from MongoDB
+VECTOR_INDEX_CHANGES_COLLECTION_NAME = os.getenv("VECTOR_INDEX_CHANGES_COLLECTION_NAME", "vector_index_changes")
+VECTOR_INDEX_SYNC_INTERVAL_SECONDS = float(os.getenv("VECTOR_INDEX_SYNC_INTERVAL_SECONDS", "1"))
+VECTOR_INDEX_CHANGES_TTL_SECONDS = int(os.getenv("VECTOR_INDEX_CHANGES_TTL_SECONDS", "3600"))
+
+# How vector_embeddings are stored in MongoDB: "list" (array of doubles),
+# "float32" or "float16" (packed binary) or "int8" (binary with a scale factor)
+EMBEDDING_STORAGE_FORMAT = os.getenv("EMBEDDING_STORAGE_FORMAT", "list")
+
+# Vector store snapshots: item metadata and text in Parquet or Arrow plus a
+# contiguous float32 embedding block, exported to and imported from SNAPSHOTS_DIR
+# in batches of SNAPSHOT_BATCH_SIZE items
+SNAPSHOTS_DIR = os.getenv("SNAPSHOTS_DIR", "./snapshots")
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "parquet")
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "5000"))
+
+# Per-document manifest: one record per ingested document
+DOCUMENTS_COLLECTION_NAME = os.getenv("DOCUMENTS_COLLECTION_NAME", "documents")
+
+# Logging: LOG_LEVEL gates messages, LOG_FORMAT is "text" or "json" (one object per line)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# Per-upload traces of pipeline stage timings, stored on the ingestion job
+INGESTION_TRACING_ENABLED = os.getenv("INGESTION_TRACING_ENABLED", "false").lower() == "true"
+TRACE_MAX_SPANS = int(os.getenv("TRACE_MAX_SPANS", "500"))
@@ -1,12 +1,88 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.routes import upload, delete
+from app.routes import upload, delete, jobs, search, files, snapshots, metrics, health
+from app.services.job_queue import job_queue
+from app.services.pdf_extractor import shutdown_process_pool
+from app.services.vector_index import vector_index
+from app.services.index_sync import index_sync
+from app.services.ai_helpers import open_ai_clients, close_ai_clients, warm_up_openai
+from app.services.mongo_helpers import (
+    iter_vector_store_batches, ensure_indexes, backfill_document_manifests, run_in_mongo_executor,
+    connect_mongo, close_mongo, ping_mongo,
+)
+from app.services.tokenizer import load_encoding
+from app.services.logs import start_log_listener, stop_log_listener, get_logger
+from app.services.uploads import UploadLimitMiddleware
 
-app = FastAPI()
+logger = get_logger(__name__)
+
+# Seconds to wait for the first OpenAI connection, startup goes on without it
+OPENAI_WARM_UP_TIMEOUT = 10
+
+background_tasks = set()
+
+def start_background_task(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the log listener thread and opens the MongoDB and OpenAI connection pools in the
+    serving process, after any fork, and warms the pools before /ready reports the app
+    ready. They are closed on shutdown.
+    """
+    app.state.ready = False
+    start_log_listener()
+    await run_in_mongo_executor(connect_mongo)
+    open_ai_clients()
+    await run_in_mongo_executor(ping_mongo)
+    try:
+        await asyncio.wait_for(warm_up_openai(), OPENAI_WARM_UP_TIMEOUT)
+    except Exception as e:
+        logger.warning("Could not warm up the OpenAI connection pool: %s", e)
+
+    # Off the event loop, tiktoken may download its encoding file
+    await asyncio.to_thread(load_encoding)
+    await run_in_mongo_executor(ensure_indexes)
+    # One-off, for documents ingested before manifests existed
+    start_background_task(run_in_mongo_executor(backfill_document_manifests))
+    await job_queue.start()
+    # Before the rebuild, changes other processes make while it runs are replayed on it
+    await index_sync.start()
+    # Built in the background, /api/search answers 503 until it is ready
+    start_background_task(asyncio.to_thread(vector_index.rebuild, iter_vector_store_batches))
+    app.state.ready = True
+
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        await job_queue.stop()
+        await index_sync.stop()
+        shutdown_process_pool()
+        await close_ai_clients()
+        close_mongo()
+        stop_log_listener()
+
+app = FastAPI(lifespan=lifespan)
 
 # Include the routes
 app.include_router(upload.router, prefix="/api")
 app.include_router(delete.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
+app.include_router(search.router, prefix="/api")
+app.include_router(files.router, prefix="/api")
+app.include_router(snapshots.router, prefix="/api")
+# Scraped by Prometheus and probed by the orchestrator at the conventional paths
+app.include_router(metrics.router)
+app.include_router(health.router)
+
+# Upload bodies are limited as they are received, with or without a Content-Length
+app.add_middleware(UploadLimitMiddleware)
 
 @app.get("/")
 def read_root():
-    return {"message": "Welcome to the API"}
\ No newline at end of file
+    return {"message": "Welcome to the API"}
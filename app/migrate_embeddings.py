@@ -0,0 +1,54 @@
+"""
+Converts the embeddings stored in the vector store collection to another storage format.
+
+    python -m app.migrate_embeddings --format float32
+"""
+import argparse
+from pymongo import UpdateOne
+from app.services import mongo_helpers
+from app.services.embedding_codec import STORAGE_FORMATS, encode_embedding_fields, decode_embedding
+
+
+def migrate_embeddings(storage_format: str, batch_size: int = 1000, input_str: str = None) -> int:
+    """
+    Rewrites every item not yet in `storage_format` with unordered bulk updates of
+    `batch_size` items. `input_str` limits the migration to one document_name or document_id.
+    """
+    query = {"vector_encoding": {"$exists": True}} if storage_format == "list" else {"vector_encoding": {"$ne": storage_format}}
+    if input_str:
+        query["$or"] = [{"document_name": input_str}, {"document_id": input_str}]
+
+    # Fields of the old format that the new one doesn't use
+    unset = {"vector_encoding": "", "vector_scale": ""} if storage_format == "list" else {} if storage_format == "int8" else {"vector_scale": ""}
+
+    collection = mongo_helpers.collection
+    projection = {"_id": 1, "vector_embeddings": 1, "vector_encoding": 1, "vector_scale": 1}
+    converted = 0
+    operations = []
+    for document in collection.find(query, projection, batch_size=batch_size).sort("_id", 1):
+        update = {"$set": encode_embedding_fields(decode_embedding(document), storage_format)}
+        if unset:
+            update["$unset"] = unset
+        operations.append(UpdateOne({"_id": document["_id"]}, update))
+
+        if len(operations) >= batch_size:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            print(f"Converted {converted} items to {storage_format}.")
+
+    if operations:
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+
+    print(f"Migration complete, converted {converted} items to {storage_format}.")
+    return converted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert stored vector embeddings to another storage format.")
+    parser.add_argument("--format", required=True, choices=STORAGE_FORMATS)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--document", help="Only migrate this document_name or document_id")
+    args = parser.parse_args()
+
+    mongo_helpers.connect_mongo()
+    migrate_embeddings(args.format, batch_size=args.batch_size, input_str=args.document)
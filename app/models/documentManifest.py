@@ -0,0 +1,12 @@
+from pydantic import BaseModel
+
+class DocumentManifest(BaseModel):
+    document_id : str
+    document_name : str
+    file_type : str
+    content_hash : str  # sha256 of the uploaded file
+    size_bytes : int
+    chunk_count : int = 0
+    status : str = "ingesting"  # ingesting, ready or failed
+    created_at : float
+    updated_at : float
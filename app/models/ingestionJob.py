@@ -0,0 +1,25 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class IngestionJob(BaseModel):
+    job_id : str
+    document_name : str
+    file_type : str
+    file_path : str
+    granularity : Optional[str] = None  # CSV/XLSX only, defaults to the configured granularity
+    rows_per_chunk : Optional[int] = None
+    update : bool = False  # Diff against the stored document with the same name instead of adding a new one
+    content_hash : Optional[str] = None  # sha256 of the file, computed while it was uploaded
+    size_bytes : Optional[int] = None
+    batch_id : Optional[str] = None  # Set for files uploaded together through /api/upload-batch
+    status : str = "queued"  # queued, running, completed or failed
+    host : Optional[str] = None  # Host whose INGESTION_JOBS_DIR holds the file, only its processes run the job
+    owner : Optional[str] = None  # Process running the job
+    heartbeat_at : Optional[float] = None  # Refreshed by the owner while the job runs
+    chunks_total : int = 0
+    chunks_completed : int = 0
+    prompt_tokens : int = 0  # Prompt tokens billed for contextualization
+    error : Optional[str] = None
+    trace : Optional[dict] = None  # Stage timings, when INGESTION_TRACING_ENABLED
+    created_at : float
+    updated_at : float
@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class SearchRequest(BaseModel):
+    query : str
+    top_k : int = 10
+    document_name : Optional[str] = None
+    document_id : Optional[str] = None
@@ -0,0 +1,6 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class SnapshotRequest(BaseModel):
+    input_str : Optional[str] = None  # A document_name or document_id, the whole vector store when omitted
+    format : Optional[str] = None  # "parquet" or "arrow", SNAPSHOT_FORMAT when omitted
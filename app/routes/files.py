@@ -0,0 +1,16 @@
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+from app.services.mongo_helpers import run_in_mongo_executor, get_document_manifests
+
+router = APIRouter()
+
+@router.get("/documents")
+async def list_documents(status: Optional[str] = None):
+    """
+    Lists the document manifests, optionally only those with the given status.
+    """
+    try:
+        documents = await run_in_mongo_executor(get_document_manifests, status)
+        return {"documents": documents}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing documents: {str(e)}")
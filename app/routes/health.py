@@ -0,0 +1,40 @@
+import asyncio
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+from app.services.job_queue import job_queue
+from app.services.vector_index import vector_index
+from app.services.mongo_helpers import run_in_mongo_executor, ping_mongo
+
+router = APIRouter()
+
+# Seconds a readiness probe waits for MongoDB
+MONGO_PING_TIMEOUT = 2
+
+@router.get("/health")
+async def health():
+    """
+    Liveness: the process is up and serving requests.
+    """
+    return {"status": "ok"}
+
+@router.get("/ready")
+async def ready(request: Request):
+    """
+    Readiness: the app has started, with its connection pools open and its ingestion workers
+    running, and MongoDB answers. Answers 503 otherwise. The search index may still be
+    building, search reports that itself.
+    """
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "starting"})
+
+    try:
+        await asyncio.wait_for(run_in_mongo_executor(ping_mongo), MONGO_PING_TIMEOUT)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "mongo": str(e) or type(e).__name__})
+
+    return {
+        "status": "ready",
+        "search_index_ready": vector_index.ready,
+        "ingestion_jobs_queued": job_queue.queued_count,
+        "ingestion_jobs_running": len(job_queue.progress),
+    }
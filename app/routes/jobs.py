@@ -0,0 +1,41 @@
+from fastapi import APIRouter, HTTPException
+from app.services.job_queue import job_queue
+
+router = APIRouter()
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    try:
+        job = await job_queue.get_status(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching job {job_id}: {str(e)}")
+
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+@router.get("/batches/{batch_id}")
+async def get_batch_status(batch_id: str):
+    try:
+        batch = await job_queue.get_batch_status(batch_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching batch {batch_id}: {str(e)}")
+
+    if batch is None:
+        raise HTTPException(status_code=404, detail=f"Batch {batch_id} not found")
+    return batch
+
+@router.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """
+    Cancels a queued or running job and deletes it, or deletes a finished one. Chunks the job
+    already stored are kept, uploading the file again resumes the document.
+    """
+    try:
+        job = await job_queue.delete(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting job {job_id}: {str(e)}")
+
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return {"message": f"Deleted {job['status']} job {job_id} for {job['document_name']}"}
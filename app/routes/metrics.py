@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.services.metrics import render_metrics
+
+router = APIRouter()
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Ingestion, OpenAI, cache and MongoDB metrics in the Prometheus text format.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,41 @@
+import asyncio
+from fastapi import APIRouter, HTTPException
+from app.models.searchRequest import SearchRequest
+from app.services.ai_helpers import get_embeddings
+from app.services.mongo_helpers import get_items_by_ids
+from app.services.vector_index import vector_index
+
+router = APIRouter()
+
+MAX_TOP_K = 100
+# Searches again when matches turn out to be deleted, at most this many times
+SEARCH_ATTEMPTS = 3
+
+@router.post("/search")
+async def search(request: SearchRequest):
+    if not 1 <= request.top_k <= MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {MAX_TOP_K}")
+    if not vector_index.ready:
+        raise HTTPException(status_code=503, detail="The search index is still being built")
+
+    try:
+        query_embedding = await get_embeddings(chunk=request.query)
+        for _ in range(SEARCH_ATTEMPTS):
+            matches = (await asyncio.to_thread(
+                vector_index.search, [query_embedding], request.top_k, request.document_name, request.document_id
+            ))[0]
+            items = await asyncio.to_thread(get_items_by_ids, [item_id for item_id, _ in matches])
+            missing = [item_id for item_id, _ in matches if item_id not in items]
+            if not missing:
+                break
+            # Deleted by another process since the index last synced, dropped so they don't take the place of other matches
+            await asyncio.to_thread(vector_index.remove_items, missing)
+
+        results = [
+            {**items[item_id], "score": score}
+            for item_id, score in matches if item_id in items
+        ]
+        return {"results": results}
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching for '{request.query}': {str(e)}")
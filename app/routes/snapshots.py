@@ -0,0 +1,84 @@
+import os
+from uuid import uuid4
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse, JSONResponse
+from app.models.snapshotRequest import SnapshotRequest
+from app.services.snapshots import (
+    SNAPSHOT_FORMATS, MANIFEST_FILE, export_snapshot, import_snapshot, snapshot_path,
+    is_snapshot_busy, start_snapshot_operation, get_snapshot_status, list_snapshots,
+)
+from app.config import SNAPSHOT_FORMAT
+
+router = APIRouter()
+
+def get_snapshot_path(snapshot_id: str) -> str:
+    try:
+        return snapshot_path(snapshot_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/snapshots", status_code=202)
+async def create_snapshot(request: SnapshotRequest):
+    """
+    Exports the vector store, or the chunks of one document_name or document_id, to a new
+    snapshot in SNAPSHOTS_DIR. Returns its id right away, progress is reported by
+    /api/snapshots/{snapshot_id} and the files are downloaded from /api/snapshots/{snapshot_id}/files/{file_name}.
+    """
+    snapshot_format = request.format or SNAPSHOT_FORMAT
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(SNAPSHOT_FORMATS)}")
+
+    snapshot_id = str(uuid4())
+    start_snapshot_operation(snapshot_id, "export", export_snapshot, get_snapshot_path(snapshot_id), request.input_str, snapshot_format)
+    return JSONResponse(status_code=202, content={
+        "message": "Snapshot export started",
+        "snapshot_id": snapshot_id,
+        "status_url": f"/api/snapshots/{snapshot_id}"
+    })
+
+@router.post("/snapshots/{snapshot_id}/import", status_code=202)
+async def load_snapshot(snapshot_id: str):
+    """
+    Bulk-loads a complete snapshot from SNAPSHOTS_DIR into the vector store, for example
+    one copied there from another deployment. Items are upserted by id.
+    """
+    path = get_snapshot_path(snapshot_id)
+    if is_snapshot_busy(snapshot_id):
+        raise HTTPException(status_code=409, detail=f"Snapshot {snapshot_id} is busy")
+    if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        raise HTTPException(status_code=404, detail=f"Snapshot {snapshot_id} not found")
+
+    start_snapshot_operation(snapshot_id, "import", import_snapshot, path)
+    return JSONResponse(status_code=202, content={
+        "message": "Snapshot import started",
+        "snapshot_id": snapshot_id,
+        "status_url": f"/api/snapshots/{snapshot_id}"
+    })
+
+@router.get("/snapshots")
+async def get_snapshots():
+    try:
+        return {"snapshots": list_snapshots()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing snapshots: {str(e)}")
+
+@router.get("/snapshots/{snapshot_id}")
+async def get_snapshot(snapshot_id: str):
+    get_snapshot_path(snapshot_id)
+    try:
+        snapshot = get_snapshot_status(snapshot_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching snapshot {snapshot_id}: {str(e)}")
+
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail=f"Snapshot {snapshot_id} not found")
+    return snapshot
+
+@router.get("/snapshots/{snapshot_id}/files/{file_name}")
+async def download_snapshot_file(snapshot_id: str, file_name: str):
+    # Only the files of a complete snapshot are served
+    path = get_snapshot_path(snapshot_id)
+    snapshot = get_snapshot_status(snapshot_id)
+    if snapshot is None or not snapshot["complete"] or file_name not in (MANIFEST_FILE, snapshot["embeddings_file"], snapshot["items_file"]):
+        raise HTTPException(status_code=404, detail=f"File {file_name} of snapshot {snapshot_id} not found")
+    return FileResponse(os.path.join(path, file_name), filename=file_name)
@@ -1,15 +1,21 @@
-import io
-import pandas as pd
-from fastapi import APIRouter, UploadFile, HTTPException
+import asyncio
+import os
+import zipfile
+from typing import List, Optional
+from fastapi import APIRouter, UploadFile, HTTPException, Form
 from fastapi.responses import JSONResponse
-from app.services.pdf_processor import process_pdf
-from app.services.csv_processor import process_csv
-from app.services.xlsx_processor import process_xlsx
-from app.services.mongo_helpers import check_if_document_name_exists
+from app.services.ingestion import SUPPORTED_FILE_TYPES
+from app.services.tabular import check_granularity
+from app.services.job_queue import job_queue, new_job_id
+from app.services.uploads import UploadTooLarge, spool_upload, spool_archive_member, get_archive_members
+from app.services.mongo_helpers import check_if_document_name_exists, check_if_ingestion_job_pending, run_in_mongo_executor
+from app.services.logs import get_logger
+from app.config import UPLOAD_MAX_BYTES, BATCH_UPLOAD_MAX_FILES, BATCH_UPLOAD_MAX_SPOOLED_BYTES
 from fastapi import File
 from pydantic import BaseModel
 
 router = APIRouter()
+logger = get_logger(__name__)
 
 class FileCheckRequest(BaseModel):
     file_name: str
@@ -19,7 +25,7 @@ async def check_file_exists(request: FileCheckRequest):
     file_name = request.file_name
 
     try:
-        if check_if_document_name_exists(file_name):
+        if await run_in_mongo_executor(check_if_document_name_exists, file_name):
             return JSONResponse(status_code=200, content={"resposne": True})
         else:
             return JSONResponse(status_code=200, content={"resposne": False})
@@ -29,43 +35,172 @@ async def check_file_exists(request: FileCheckRequest):
 
 
 
-@router.post("/upload-file/")
-async def upload_file(file: UploadFile = File(...)):
+@router.post("/upload-file/", status_code=202)
+async def upload_file(file: UploadFile = File(...), granularity: Optional[str] = Form(None), rows_per_chunk: Optional[int] = Form(None), update: bool = Form(False)):
     """
-    This endpoint handles PDF, CSV, and XLSX files and processes them accordingly.
+    This endpoint accepts PDF, CSV, and XLSX files and queues them for ingestion.
+    It returns a job id right away, progress is reported by /api/jobs/{job_id}.
+    CSV and XLSX uploads may set `granularity` (row, chunk or hybrid) and `rows_per_chunk`.
+    With `update`, the file replaces the stored document with the same name: only new or
+    changed chunks are contextualized and embedded, and vanished chunks are deleted.
+    Files larger than UPLOAD_MAX_BYTES are rejected with 413.
     """
-    print("Received a file upload request")
 
     # Determine file type from content type or extension
     file_extension = file.filename.split('.')[-1].lower()
 
     # Check for supported file types
-    if file_extension not in ['pdf', 'csv', 'xlsx']:
+    if file_extension not in SUPPORTED_FILE_TYPES:
         raise HTTPException(status_code=400, detail="Only PDF, CSV, or XLSX files are supported")
 
+    if granularity is not None or rows_per_chunk is not None:
+        if file_extension not in ['csv', 'xlsx']:
+            raise HTTPException(status_code=400, detail="granularity and rows_per_chunk only apply to CSV or XLSX files")
+        if rows_per_chunk is not None and rows_per_chunk < 1:
+            raise HTTPException(status_code=400, detail="rows_per_chunk must be at least 1")
+        try:
+            check_granularity(granularity or "row", rows_per_chunk)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # The form parser has written the file to a temporary file already, limited with the
+    # request by UploadLimitMiddleware; one just over the limit is rejected before it is copied
+    if UPLOAD_MAX_BYTES and (getattr(file, "size", None) or 0) > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=str(UploadTooLarge(UPLOAD_MAX_BYTES)))
+
+    # Extract document name and check for duplicates
+    document_name = file.filename if file.filename else "unknown"
     try:
-        # Extract document name and check for duplicates
-        document_name = file.filename if file.filename else "unknown"
-        if check_if_document_name_exists(document_name):
+        if await run_in_mongo_executor(check_if_ingestion_job_pending, document_name):
+            raise HTTPException(status_code=400, detail=f"Document with name '{document_name}' is already being ingested")
+        if not update and await run_in_mongo_executor(check_if_document_name_exists, document_name):
             raise HTTPException(status_code=400, detail=f"Document with name '{document_name}' already exists")
 
-        # Read the file content
-        file_stream = io.BytesIO(await file.read())
+        # Keep the file on disk until its job has run, hashed while it is copied there
+        job_id = new_job_id()
+        file_path = job_queue.job_file_path(job_id, file_extension)
+        content_hash, size_bytes = await asyncio.to_thread(spool_upload, file.file, file_path)
+
+        job = await job_queue.submit(
+            document_name, file_extension, file_path, job_id, granularity=granularity, rows_per_chunk=rows_per_chunk, update=update,
+            content_hash=content_hash, size_bytes=size_bytes
+        )
+        logger.info("Queued %s %s as job %s", file_extension.upper(), document_name, job.job_id, extra={"update": update})
+
+        return JSONResponse(status_code=202, content={
+            "message": f"{file_extension.upper()} file was accepted for processing",
+            "job_id": job.job_id,
+            "status_url": f"/api/jobs/{job.job_id}"
+        })
+
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error queueing {file_extension.upper()} file: {str(e)}")
 
-        # Process the file based on its type
-        if file_extension == "pdf":
-            print(f"Processing PDF: {document_name}")
-            await process_pdf(file_stream, document_name)
 
-        elif file_extension == "csv":
-            print(f"Processing CSV: {document_name}")
-            await process_csv(file_stream, document_name)
 
-        elif file_extension == "xlsx":
-            print(f"Processing XLSX: {document_name}")
-            await process_xlsx(file_stream, document_name)
+@router.post("/upload-batch/", status_code=202)
+async def upload_batch(files: List[UploadFile] = File(...), granularity: Optional[str] = Form(None), rows_per_chunk: Optional[int] = Form(None), update: bool = Form(False)):
+    """
+    Queues several PDF, CSV and XLSX files at once, uploaded as files or inside zip archives.
+    Every file becomes an ingestion job of the batch, run by the same workers as single
+    uploads, so the documents of a batch overlap and share the OpenAI request and token
+    budgets instead of waiting for one request per file.
+
+    Returns a result per file: "queued" with its job id, or "rejected" with the reason, which
+    doesn't affect the other files. Once the files spooled to disk, archive members
+    decompressed, add up to BATCH_UPLOAD_MAX_SPOOLED_BYTES, the rest of the batch is rejected.
+    Progress is reported by /api/batches/{batch_id}.
+    `granularity` and `rows_per_chunk` apply to the CSV and XLSX files of the batch.
+    """
+    if rows_per_chunk is not None and rows_per_chunk < 1:
+        raise HTTPException(status_code=400, detail="rows_per_chunk must be at least 1")
+    if granularity is not None:
+        try:
+            check_granularity(granularity, rows_per_chunk)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    batch_id = new_job_id()
+    results = []
+    document_names = set()
+    # Bytes the batch may still write to disk, None for no limit
+    spool_budget = {"remaining": BATCH_UPLOAD_MAX_SPOOLED_BYTES or None}
+
+    async def queue_file(document_name, spool):
+        # `spool` copies the file to the given path, up to the given number of bytes, and returns its hash and size
+        if len(results) >= BATCH_UPLOAD_MAX_FILES:
+            return {"file_name": document_name, "status": "rejected", "error": f"Batches are limited to {BATCH_UPLOAD_MAX_FILES} files"}
+        remaining = spool_budget["remaining"]
+        if remaining is not None and remaining <= 0:
+            return {"file_name": document_name, "status": "rejected", "error": f"Batches are limited to {BATCH_UPLOAD_MAX_SPOOLED_BYTES} bytes of files"}
+        file_extension = document_name.split('.')[-1].lower()
+        if file_extension not in SUPPORTED_FILE_TYPES:
+            return {"file_name": document_name, "status": "rejected", "error": "Only PDF, CSV, or XLSX files are supported"}
+        if document_name in document_names:
+            return {"file_name": document_name, "status": "rejected", "error": "Appears more than once in the batch"}
+        if await run_in_mongo_executor(check_if_ingestion_job_pending, document_name):
+            return {"file_name": document_name, "status": "rejected", "error": f"Document with name '{document_name}' is already being ingested"}
+        if not update and await run_in_mongo_executor(check_if_document_name_exists, document_name):
+            return {"file_name": document_name, "status": "rejected", "error": f"Document with name '{document_name}' already exists"}
+
+        # The file's own limit, or what is left of the batch's when that is lower
+        limited_by_batch = remaining is not None and (not UPLOAD_MAX_BYTES or remaining < UPLOAD_MAX_BYTES)
+        max_bytes = remaining if limited_by_batch else UPLOAD_MAX_BYTES
+
+        job_id = new_job_id()
+        file_path = job_queue.job_file_path(job_id, file_extension)
+        try:
+            content_hash, size_bytes = await asyncio.to_thread(spool, file_path, max_bytes)
+        except UploadTooLarge as e:
+            if limited_by_batch:
+                # The batch's budget ran out, not the file's own limit: an archive decompressing
+                # to more than it declared is cut off here along with the rest of the batch
+                spool_budget["remaining"] = 0
+                return {"file_name": document_name, "status": "rejected", "error": f"Batches are limited to {BATCH_UPLOAD_MAX_SPOOLED_BYTES} bytes of files"}
+            return {"file_name": document_name, "status": "rejected", "error": str(e)}
+        if remaining is not None:
+            spool_budget["remaining"] = remaining - size_bytes
+        document_names.add(document_name)
+
+        tabular = file_extension in ['csv', 'xlsx']
+        job = await job_queue.submit(
+            document_name, file_extension, file_path, job_id,
+            granularity=granularity if tabular else None, rows_per_chunk=rows_per_chunk if tabular else None, update=update,
+            content_hash=content_hash, size_bytes=size_bytes, batch_id=batch_id
+        )
+        return {"file_name": document_name, "status": "queued", "job_id": job.job_id}
 
-        return JSONResponse(status_code=200, content={"message": f"{file_extension.upper()} file was uploaded and processed successfully"})
+    try:
+        for file in files:
+            file_name = file.filename or "unknown"
+            if not file_name.lower().endswith(".zip"):
+                results.append(await queue_file(file_name, lambda file_path, max_bytes, source=file.file: spool_upload(source, file_path, max_bytes)))
+                continue
+
+            try:
+                archive = await asyncio.to_thread(zipfile.ZipFile, file.file)
+            except zipfile.BadZipFile:
+                results.append({"file_name": file_name, "status": "rejected", "error": "Not a valid zip archive"})
+                continue
+            with archive:
+                for member in get_archive_members(archive):
+                    results.append(await queue_file(
+                        os.path.basename(member.filename),
+                        lambda file_path, max_bytes, member=member: spool_archive_member(archive, member, file_path, max_bytes)
+                    ))
 
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing {file_extension.upper()} file: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error queueing batch after {len(results)} files: {str(e)}")
+
+    queued = sum(1 for result in results if result["status"] == "queued")
+    logger.info("Queued batch %s with %d of %d files.", batch_id, queued, len(results), extra={"batch_id": batch_id, "update": update})
+    return JSONResponse(status_code=202, content={
+        "message": f"{queued} of {len(results)} files were accepted for processing",
+        "batch_id": batch_id,
+        "status_url": f"/api/batches/{batch_id}",
+        "files": results
+    })
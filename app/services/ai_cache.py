@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+from app.services.logs import get_logger
+from app.services.metrics import AI_CACHE_LOOKUPS
+
+logger = get_logger(__name__)
+
+
+def make_cache_key(*parts) -> str:
+    """
+    Hashes the parts that determine an AI result (model, prompt template, inputs).
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = str(part).encode("utf-8")
+        # Length prefix so ("ab", "c") and ("a", "bc") hash differently
+        digest.update(len(encoded).to_bytes(8, "little"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def encode_embedding(embedding: List[float]) -> bytes:
+    return array("f", embedding).tobytes()
+
+
+def decode_embedding(value: bytes) -> List[float]:
+    embedding = array("f")
+    embedding.frombytes(value)
+    return embedding.tolist()
+
+
+class AICache:
+    """
+    Two-tier byte cache: an in-memory LRU in front of a SQLite file. The file is
+    trimmed back under `max_bytes` by evicting the least recently used entries.
+    """
+
+    def __init__(self, path: str, max_bytes: int, memory_items: int):
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+        self.connection.commit()
+        self.total_bytes = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+
+    def _remember(self, key: str, value: bytes):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+            return row[0]
+
+    def _disk_set(self, key: str, value: bytes):
+        with self.lock:
+            previous = self.connection.execute("SELECT size FROM cache WHERE key = ?", (key,)).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time())
+            )
+            self.total_bytes += len(value) - (previous[0] if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        # Trim to 90% so every insert near the limit doesn't trigger another eviction
+        target = int(self.max_bytes * 0.9)
+        rows = self.connection.execute("SELECT key, size FROM cache ORDER BY accessed_at")
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.connection.executemany("DELETE FROM cache WHERE key = ?", evicted)
+        logger.info("AI cache: evicted %d entries", len(evicted))
+
+    async def get(self, key: str) -> Optional[bytes]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            self.memory_hits += 1
+            AI_CACHE_LOOKUPS.inc(result="memory_hit")
+            return value
+
+        value = await asyncio.to_thread(self._disk_get, key)
+        if value is None:
+            self.misses += 1
+            AI_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        self.hits += 1
+        AI_CACHE_LOOKUPS.inc(result="disk_hit")
+        self._remember(key, value)
+        return value
+
+    async def set(self, key: str, value: bytes):
+        self._remember(key, value)
+        await asyncio.to_thread(self._disk_set, key, value)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "memory_hits": self.memory_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_items": len(self.memory),
+            "disk_bytes": self.total_bytes,
+        }
@@ -1,45 +1,336 @@
-from openai import OpenAI
+import asyncio
+import base64
+import json
+import httpx
+import numpy as np
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
 from typing import List
-from checker.config import OPENAI_API_KEY
-client = OpenAI(api_key=OPENAI_API_KEY)
+from app.config import (
+    OPENAI_CHAT_MAX_CONCURRENCY, OPENAI_CHAT_REQUESTS_PER_MINUTE, OPENAI_CHAT_TOKENS_PER_MINUTE,
+    OPENAI_EMBEDDING_MAX_CONCURRENCY, OPENAI_EMBEDDING_REQUESTS_PER_MINUTE, OPENAI_EMBEDDING_TOKENS_PER_MINUTE,
+    OPENAI_MAX_RETRIES, OPENAI_RETRY_BASE_DELAY, OPENAI_RETRY_MAX_DELAY,
+    EMBEDDING_BATCH_MAX_SIZE, EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_BATCH_MAX_WAIT_MS,
+    AI_CACHE_ENABLED, AI_CACHE_PATH, AI_CACHE_MAX_BYTES, AI_CACHE_MEMORY_ITEMS,
+    CONTEXT_BATCHING_ENABLED, CONTEXT_BATCH_MAX_CHUNKS, CONTEXT_BATCH_MAX_TOKENS, CONTEXT_BATCH_MAX_WAIT_MS,
+    OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE_CONNECTIONS, OPENAI_API_KEY,
+)
+from app.services.rate_limiter import RequestScheduler
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.context_batcher import ContextBatcher
+from app.services.ai_cache import AICache, make_cache_key, encode_embedding, decode_embedding
+from app.services.tokenizer import count_tokens
+from app.services.logs import get_logger
+from app.services.metrics import OPENAI_TOKENS
+from app.services.tracing import stage_timer
 
+logger = get_logger(__name__)
 
+# Created by open_ai_clients when the app starts, or on first use outside of it, so importing
+# this module opens no connection or file a forked worker could inherit
+client = None
+ai_cache = None
 
-async def get_sheet_description(first_5_row : str):
+CHAT_MODEL = "gpt-4o-mini"
+EMBEDDING_MODEL = "text-embedding-ada-002"
 
-    prompt = f"Please describe this table, here the first 5 rows : {first_5_row}"
+SHEET_DESCRIPTION_PROMPT = "Please describe this table, here the first 5 rows : {first_5_row}"
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
+CONTEXTUAL_CHUNK_PROMPT = """<context>{context}</context>
+    <chunk>{chunk}</chunk>
+    Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else.Inlcude key words that will help the Food Safety and Quality Professional Search for the chunk efficiently"""
+
+CONTEXTUAL_CHUNKS_PROMPT = """<context>{context}</context>
+    <chunks>
+{chunks}
+    </chunks>
+    For each chunk, please give a short succinct context to situate it within the overall document for the purposes of improving search retrieval of the chunk. Inlcude key words that will help the Food Safety and Quality Professional Search for the chunk efficiently.
+    Answer only with a JSON object of the form {{"contexts": [{{"id": <chunk id>, "context": "<succinct context>"}}]}} containing one entry for every chunk id."""
+
+CHUNK_IN_BATCH_TEMPLATE = '<chunk id="{id}">{chunk}</chunk>'
+
+# Rough completion size used when reserving tokens for chat requests
+COMPLETION_TOKEN_ESTIMATE = 200
+
+
+def open_ai_clients():
+    """
+    Creates the OpenAI client, pooling up to OPENAI_MAX_CONNECTIONS connections, and the AI
+    cache when it is enabled. Safe to call more than once.
+    """
+    global client, ai_cache
+    if client is None:
+        api_key = OPENAI_API_KEY
+        if api_key is None:
+            from checker.config import OPENAI_API_KEY as api_key
+        limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS, max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS)
+        # Retries are handled by the schedulers so that backoff is shared across requests
+        client = AsyncOpenAI(api_key=api_key, max_retries=0, http_client=DefaultAsyncHttpxClient(limits=limits))
+    if ai_cache is None and AI_CACHE_ENABLED:
+        ai_cache = AICache(AI_CACHE_PATH, AI_CACHE_MAX_BYTES, AI_CACHE_MEMORY_ITEMS)
+
+
+async def close_ai_clients():
+    global client, ai_cache
+    if client is not None:
+        await client.close()
+        client = None
+    if ai_cache is not None:
+        ai_cache.close()
+        ai_cache = None
+
+
+def get_openai_client() -> AsyncOpenAI:
+    if client is None:
+        open_ai_clients()
+    return client
+
+
+def get_ai_cache():
+    # None when the cache is disabled
+    if ai_cache is None and AI_CACHE_ENABLED:
+        open_ai_clients()
+    return ai_cache
+
+
+async def warm_up_openai():
+    """
+    Opens a pooled connection to the API before the first ingestion needs one. Listing the
+    models is not billed.
+    """
+    await get_openai_client().models.list()
+
+
+def is_retryable_openai_error(error: Exception) -> bool:
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+
+def get_openai_retry_after(error: Exception):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    return count_tokens(text)
+
+
+chat_scheduler = RequestScheduler(
+    name="openai-chat",
+    max_concurrency=OPENAI_CHAT_MAX_CONCURRENCY,
+    requests_per_minute=OPENAI_CHAT_REQUESTS_PER_MINUTE,
+    tokens_per_minute=OPENAI_CHAT_TOKENS_PER_MINUTE,
+    is_retryable=is_retryable_openai_error,
+    get_retry_after=get_openai_retry_after,
+    max_retries=OPENAI_MAX_RETRIES,
+    base_delay=OPENAI_RETRY_BASE_DELAY,
+    max_delay=OPENAI_RETRY_MAX_DELAY,
+)
+
+embedding_scheduler = RequestScheduler(
+    name="openai-embeddings",
+    max_concurrency=OPENAI_EMBEDDING_MAX_CONCURRENCY,
+    requests_per_minute=OPENAI_EMBEDDING_REQUESTS_PER_MINUTE,
+    tokens_per_minute=OPENAI_EMBEDDING_TOKENS_PER_MINUTE,
+    is_retryable=is_retryable_openai_error,
+    get_retry_after=get_openai_retry_after,
+    max_retries=OPENAI_MAX_RETRIES,
+    base_delay=OPENAI_RETRY_BASE_DELAY,
+    max_delay=OPENAI_RETRY_MAX_DELAY,
+)
+
+
+async def get_chat_completion(prompt: str, usage: dict = None, json_response: bool = False, expected_completions: int = 1) -> str:
+    """
+    `usage`, when given, accumulates the prompt tokens billed for the request.
+    """
+    extra_args = {"response_format": {"type": "json_object"}} if json_response else {}
+    completion = await chat_scheduler.run(
+        lambda: get_openai_client().chat.completions.create(
+            model=CHAT_MODEL,
+            messages=[
+                {"role": "user", "content": prompt}
+            ],
+            **extra_args
+        ),
+        estimated_tokens=estimate_tokens(prompt) + COMPLETION_TOKEN_ESTIMATE * expected_completions
     )
 
+    if completion.usage is not None:
+        OPENAI_TOKENS.inc(completion.usage.prompt_tokens, api=chat_scheduler.name, kind="prompt")
+        OPENAI_TOKENS.inc(completion.usage.completion_tokens, api=chat_scheduler.name, kind="completion")
+        if usage is not None:
+            usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + completion.usage.prompt_tokens
+
     return completion.choices[0].message.content
 
 
 
-async def get_contextual_chunk(context , chunk)->str:
+async def get_cached_chat_completion(template: str, usage: dict = None, **values) -> str:
+    """
+    Chat completion keyed on the model, the prompt template and its inputs.
+    """
+    prompt = template.format(**values)
+    cache = get_ai_cache()
+    if cache is None:
+        return await get_chat_completion(prompt, usage=usage)
+
+    key = make_cache_key(CHAT_MODEL, template, *(values[name] for name in sorted(values)))
+    cached = await cache.get(key)
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    content = await get_chat_completion(prompt, usage=usage)
+    await cache.set(key, content.encode("utf-8"))
+    return content
 
-    prompt = f"""<context>{context}</context>
-    <chunk>{chunk}</chunk>
-    Please give a short succinct context to situate this chunk within the overall document for the purposes of improving search retrieval of the chunk. Answer only with the succinct context and nothing else.Inlcude key words that will help the Food Safety and Quality Professional Search for the chunk efficiently"""
 
-    completion = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": prompt}
-        ]
+
+async def get_sheet_description(first_5_row : str, usage: dict = None):
+
+    return await get_cached_chat_completion(SHEET_DESCRIPTION_PROMPT, usage=usage, first_5_row=first_5_row)
+
+
+
+def parse_contextual_chunks(content: str, count: int) -> dict:
+    """
+    Reads the {"contexts": [{"id", "context"}]} answer of a batch, keeping only well-formed
+    entries for known chunk ids.
+    """
+    try:
+        entries = json.loads(content).get("contexts", [])
+    except (ValueError, AttributeError):
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    contexts = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("context"), str) or not entry["context"].strip():
+            continue
+        try:
+            chunk_id = int(entry.get("id"))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= chunk_id < count:
+            contexts[chunk_id] = entry["context"].strip()
+    return contexts
+
+
+async def get_contextual_chunks(context, chunks: List[str], usage: dict = None) -> List[str]:
+    """
+    Contextualizes several chunks that share `context` with a single request. Chunks missing
+    from the answer, or with a malformed entry, are contextualized one by one instead.
+    """
+    if len(chunks) == 1:
+        return [await get_chat_completion(CONTEXTUAL_CHUNK_PROMPT.format(context=context, chunk=chunks[0]), usage=usage)]
+
+    chunks_text = "\n".join(CHUNK_IN_BATCH_TEMPLATE.format(id=i, chunk=chunk) for i, chunk in enumerate(chunks))
+    content = await get_chat_completion(
+        CONTEXTUAL_CHUNKS_PROMPT.format(context=context, chunks=chunks_text),
+        usage=usage,
+        json_response=True,
+        expected_completions=len(chunks)
     )
+    contexts = parse_contextual_chunks(content, len(chunks))
 
-    return completion.choices[0].message.content
+    missing = [i for i in range(len(chunks)) if i not in contexts]
+    if missing:
+        logger.warning("Batch contextualization returned %d/%d contexts, retrying the rest one by one.", len(chunks) - len(missing), len(chunks))
+        fallbacks = await asyncio.gather(*[
+            get_chat_completion(CONTEXTUAL_CHUNK_PROMPT.format(context=context, chunk=chunks[i]), usage=usage)
+            for i in missing
+        ])
+        contexts.update(zip(missing, fallbacks))
+
+    return [contexts[i] for i in range(len(chunks))]
+
+
+context_batcher = ContextBatcher(
+    send_batch=get_contextual_chunks,
+    estimate_tokens=estimate_tokens,
+    max_batch_size=CONTEXT_BATCH_MAX_CHUNKS,
+    max_batch_tokens=CONTEXT_BATCH_MAX_TOKENS,
+    max_wait_ms=CONTEXT_BATCH_MAX_WAIT_MS,
+) if CONTEXT_BATCHING_ENABLED else None
+
+
+async def get_contextual_chunk(context , chunk, usage: dict = None)->str:
+
+    with stage_timer("contextualize"):
+        return await contextualize_chunk(context, chunk, usage)
+
+
+async def contextualize_chunk(context, chunk, usage: dict = None) -> str:
+    if context_batcher is None:
+        return await get_cached_chat_completion(CONTEXTUAL_CHUNK_PROMPT, usage=usage, context=context, chunk=chunk)
+
+    # Chunks sharing a context are coalesced into batched requests
+    context, chunk = str(context), str(chunk)
+    key = make_cache_key(CHAT_MODEL, CONTEXTUAL_CHUNKS_PROMPT, context, chunk)
+    cache = get_ai_cache()
+    if cache is not None:
+        cached = await cache.get(key)
+        if cached is not None:
+            return cached.decode("utf-8")
+
+    content = await context_batcher.contextualize(context, chunk, usage)
+    if cache is not None:
+        await cache.set(key, content.encode("utf-8"))
+    return content
+
+def decode_base64_embedding(value: str) -> List[float]:
+    return np.frombuffer(base64.b64decode(value), dtype="<f4").tolist()
+
+async def create_embeddings(chunks: List[str], estimated_tokens: int) -> List[List[float]]:
+    """
+    Embeds a list of chunks in a single request, returning vectors in input order.
+
+    Vectors are requested as base64 and decoded with numpy: the SDK parsing a full batch
+    of JSON floats would hold the event loop for seconds.
+    """
+    response = await embedding_scheduler.run(
+        lambda: get_openai_client().embeddings.create(
+            model=EMBEDDING_MODEL,
+            input=chunks,
+            encoding_format="base64"
+        ),
+        estimated_tokens=estimated_tokens
+    )
+    if response.usage is not None:
+        OPENAI_TOKENS.inc(response.usage.prompt_tokens, api=embedding_scheduler.name, kind="prompt")
+    return [decode_base64_embedding(item.embedding) for item in sorted(response.data, key=lambda item: item.index)]
+
+
+embedding_batcher = EmbeddingBatcher(
+    send_batch=create_embeddings,
+    estimate_tokens=estimate_tokens,
+    max_batch_size=EMBEDDING_BATCH_MAX_SIZE,
+    max_batch_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+    max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS,
+)
 
 async def get_embeddings(chunk)->List[float]:
 
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=chunk,
-        encoding_format="float"
-        )
-    return response.data[0].embedding
\ No newline at end of file
+    with stage_timer("embed"):
+        return await embed_chunk(str(chunk))
+
+
+async def embed_chunk(chunk: str) -> List[float]:
+    cache = get_ai_cache()
+    if cache is None:
+        return await embedding_batcher.embed(chunk)
+
+    key = make_cache_key(EMBEDDING_MODEL, chunk)
+    cached = await cache.get(key)
+    if cached is not None:
+        return decode_embedding(cached)
+
+    embedding = await embedding_batcher.embed(chunk)
+    await cache.set(key, encode_embedding(embedding))
+    return embedding
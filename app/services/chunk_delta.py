@@ -0,0 +1,95 @@
+import hashlib
+from app.services.chunk_ids import make_chunk_id
+
+
+def hash_chunk_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ChunkDelta:
+    """
+    The chunks already stored for a document, used to skip the chunks of an ingestion that
+    don't need to be contextualized and embedded again.
+
+    By default a chunk is stored when its positional id is, which resumes an interrupted
+    ingestion of the same file. With `by_content`, processors first `plan` the new version of
+    the document: each of its chunks keeps a stored chunk with the same text, wherever that
+    chunk was, and only the rest get new ids, ids no stored chunk has. Stored chunks left
+    unclaimed have vanished from the document.
+
+    `stored_chunks` maps ids to (content hash, page_number). `id_namespace` is the document id
+    new chunk ids are derived from.
+    """
+
+    def __init__(self, stored_chunks: dict, id_namespace: str, by_content: bool = False):
+        self.stored_chunks = stored_chunks
+        self.id_namespace = id_namespace
+        self.by_content = by_content
+        self.planned = None  # position -> id of the stored chunk it keeps
+        self.moved = {}  # id of a kept chunk -> its new page_number
+
+    def plan(self, chunks):
+        """
+        Matches (position, text) pairs of the new version, in document order, to stored
+        chunks. Chunks still at their own positional id are matched first, so a stored chunk
+        is never claimed by one position and overwritten by another.
+        """
+        planned = {}
+        unmatched = []
+        for position, text in chunks:
+            text_hash = hash_chunk_text(text)
+            chunk_id = make_chunk_id(self.id_namespace, *position)
+            if self.stored_chunks.get(chunk_id, (None, None))[0] == text_hash:
+                planned[position] = chunk_id
+            else:
+                unmatched.append((position, text_hash))
+
+        claimed = set(planned.values())
+        ids_by_hash = {}
+        for chunk_id, (text_hash, _) in self.stored_chunks.items():
+            if chunk_id not in claimed:
+                ids_by_hash.setdefault(text_hash, []).append(chunk_id)
+        new_positions = []
+        for position, text_hash in unmatched:
+            ids = ids_by_hash.get(text_hash)
+            if ids:
+                planned[position] = ids.pop()
+            else:
+                new_positions.append(position)
+
+        # A new chunk's positional id may belong to a stored chunk, kept at another position or
+        # about to vanish, it gets the next id no stored chunk has instead
+        for position in new_positions:
+            chunk_id = make_chunk_id(self.id_namespace, *position)
+            suffix = 0
+            while chunk_id in self.stored_chunks:
+                suffix += 1
+                chunk_id = make_chunk_id(self.id_namespace, *position, suffix)
+            planned[position] = chunk_id
+        self.planned = planned
+
+    def chunk_id(self, position) -> str:
+        if self.planned is not None and position in self.planned:
+            return self.planned[position]
+        return make_chunk_id(self.id_namespace, *position)
+
+    def is_stored(self, position, page_number: str) -> bool:
+        """
+        Whether the chunk at `position` is already stored. A kept chunk whose page changed is
+        recorded in `moved`.
+        """
+        if self.planned is not None:
+            chunk_id = self.planned.get(position)
+        else:
+            chunk_id = make_chunk_id(self.id_namespace, *position)
+        if chunk_id not in self.stored_chunks:
+            return False
+        if self.stored_chunks[chunk_id][1] != page_number:
+            self.moved[chunk_id] = page_number
+        return True
+
+    def vanished_ids(self) -> list:
+        if self.planned is None:
+            return []
+        kept = set(self.planned.values())
+        return [chunk_id for chunk_id in self.stored_chunks if chunk_id not in kept]
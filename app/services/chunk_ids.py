@@ -0,0 +1,20 @@
+import json
+from uuid import UUID, NAMESPACE_URL, uuid5
+
+DOCUMENT_NAMESPACE = uuid5(NAMESPACE_URL, "niagara-file-backend/documents")
+
+
+def make_document_id(document_name: str, content_hash: str, layout: str) -> str:
+    """
+    Derives the document id from its name, content and chunking settings (`layout`), so an
+    ingestion that is retried with the same file and settings writes to the same document.
+    """
+    return str(uuid5(DOCUMENT_NAMESPACE, f"{document_name}\n{content_hash}\n{layout}"))
+
+
+def make_chunk_id(document_id: str, *position) -> str:
+    """
+    Derives a chunk id from its document id and its position in the document, e.g. the page
+    and the chunk number on that page.
+    """
+    return str(uuid5(UUID(str(document_id)), json.dumps(position)))
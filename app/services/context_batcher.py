@@ -0,0 +1,73 @@
+import asyncio
+from typing import Awaitable, Callable, List
+
+
+class ContextBatcher:
+    """
+    Groups contextualization requests that share the same context, so the context is sent
+    once for several chunks.
+
+    Each call to `contextualize` queues its chunk under its context and waits on a future.
+    A group is sent with `send_batch(context, chunks, usage)` when it reaches
+    `max_batch_size` chunks or `max_batch_tokens` tokens, or `max_wait_ms` after its first
+    chunk was queued. The prompt tokens of the batch are split between the callers' `usage`
+    dicts.
+    """
+
+    def __init__(self, send_batch: Callable[[str, List[str], dict], Awaitable[List[str]]],
+                 estimate_tokens: Callable[[str], int], max_batch_size=8, max_batch_tokens=8000, max_wait_ms=20.0):
+        self.send_batch = send_batch
+        self.estimate_tokens = estimate_tokens
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+        self.groups = {}  # context -> {"items": [(chunk, usage, future)], "tokens": int, "handle": TimerHandle}
+        self.in_flight = set()
+
+    async def contextualize(self, context: str, chunk: str, usage: dict = None) -> str:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tokens = self.estimate_tokens(chunk)
+
+        group = self.groups.get(context)
+        if group is not None and group["tokens"] + tokens > self.max_batch_tokens:
+            self.flush(context)
+            group = None
+        if group is None:
+            group = {"items": [], "tokens": 0, "handle": loop.call_later(self.max_wait, self.flush, context)}
+            self.groups[context] = group
+
+        group["items"].append((chunk, usage, future))
+        group["tokens"] += tokens
+        if len(group["items"]) >= self.max_batch_size:
+            self.flush(context)
+
+        return await future
+
+    def flush(self, context: str):
+        group = self.groups.pop(context, None)
+        if group is None:
+            return
+        group["handle"].cancel()
+
+        task = asyncio.ensure_future(self._send(context, group["items"]))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    async def _send(self, context, items):
+        batch_usage = {}
+        try:
+            results = await self.send_batch(context, [chunk for chunk, _, _ in items], batch_usage)
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        prompt_tokens = batch_usage.get("prompt_tokens", 0)
+        for position, ((_, usage, future), result) in enumerate(zip(items, results)):
+            if usage is not None:
+                share = prompt_tokens // len(items) + (1 if position < prompt_tokens % len(items) else 0)
+                usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + share
+            if not future.done():
+                future.set_result(result)
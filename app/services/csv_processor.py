@@ -1,66 +1,157 @@
+import asyncio
 import csv
+import io
+import time
 from uuid import uuid4
-import asyncio
-from app.services.mongo_helpers import upload_item_to_mongodb
+from app.services.mongo_helpers import create_bulk_writer
+from app.services.chunk_delta import ChunkDelta
 from app.models.vectorStoreItem import VectorStoreItem
-from app.services.ai_helpers import get_contextual_chunk, get_embeddings, get_sheet_description
+from app.services.ai_helpers import get_sheet_description
+from app.services.tracing import stage_timer, record_stage
+from app.services.pipeline import iterate_in_thread, run_bounded_pipeline
+from app.services.tabular import build_tabular_items, check_granularity, get_tabular_item_texts
+from app.config import CSV_GRANULARITY, INGESTION_CHUNK_WORKERS, INGESTION_QUEUE_SIZE
+
+
+def iter_csv_chunks(file_stream, rows_per_chunk):
+    """
+    Reads the CSV incrementally and yields (chunk_num, header, rows) with up to
+    `rows_per_chunk` data rows each. Only one chunk is held in memory at a time.
+    """
+    text_stream = io.TextIOWrapper(file_stream, encoding='utf-8', newline='')
+    try:
+        reader = csv.reader(text_stream)
+        header = next(reader, None)
+        if header is None:
+            return
+
+        rows = []
+        chunk_num = 0
+        started = time.perf_counter()
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= rows_per_chunk:
+                record_stage("parse", time.perf_counter() - started)
+                yield chunk_num, header, rows
+                rows = []
+                chunk_num += 1
+                started = time.perf_counter()
+        if rows:
+            record_stage("parse", time.perf_counter() - started)
+            yield chunk_num, header, rows
+    finally:
+        # Leave closing the underlying file to the caller
+        text_stream.detach()
+
 
+def plan_csv_delta(file_stream, rows_per_chunk, granularity, delta):
+    # Diffing by content needs every item's text up front, the file is read again afterwards
+    delta.plan(
+        ((chunk_num, item_num), text)
+        for chunk_num, header, rows in iter_csv_chunks(file_stream, rows_per_chunk)
+        for item_num, text in enumerate(get_tabular_item_texts(header, rows, granularity))
+    )
+    file_stream.seek(0)
 
-async def process_csv(file_stream, document_name=""):
+
+async def process_csv(file_stream, document_name="", progress=None, granularity=None, rows_per_chunk=None, document_id=None, delta=None):
+    """
+    Streams the CSV through the chunk pipeline. An item's position is its chunk and its number
+    in that chunk; chunks whose items `delta` reports as stored are skipped. Returns the number
+    of items stored for the document.
+    """
+    if progress is None:
+        progress = {"completed": 0, "total": 0}
+    granularity = granularity or CSV_GRANULARITY
+    rows_per_chunk = check_granularity(granularity, rows_per_chunk)
     try:
-        reader = csv.reader(file_stream.decode('utf-8').splitlines())
-        document_id = uuid4()
-        rows = list(reader)
-        header = rows[0]  # The header row
-        total_rows = len(rows)
-        
-        # Chunks are created by taking 25 consecutive rows, including the header each time.
-        chunks = [rows[i:i + 25] for i in range(0, total_rows, 25)]
-        tasks = []
-
-        # Context is constant for the entire CSV, function is left empty as per the requirement.
-        context = get_context(rows)
-
-        for chunk_num, chunk in enumerate(chunks):
-            # Re-adding the header for each chunk
-            chunk_with_header = [header] + chunk[1:]
-
-            # Create tasks for contextual chunks and embeddings
-            contextual_chunks_task = asyncio.gather(*[get_contextual_chunk(context=context, chunk=row) for row in chunk_with_header])
-            embeddings_task = asyncio.gather(*[get_embeddings(chunk=row) for row in chunk_with_header])
-
-            tasks.append((contextual_chunks_task, embeddings_task, chunk_num, chunk_with_header, document_id, document_name))
-
-        for contextual_chunks_task, embeddings_task, chunk_num, chunk_with_header, document_id, document_name in tasks:
-            contextual_chunks = await contextual_chunks_task
-            embeddings = await embeddings_task
-
-            vector_store_items = [
-                VectorStoreItem(
-                    id=str(uuid4()),
-                    original_text=str(row),
-                    contextual_text=contextual_chunk,
-                    document_id=str(document_id),
-                    page_number=str(chunk_num),  # Using chunk number as page equivalent
-                    vector_embeddings=embedding,
-                    document_name=document_name
-                )
-                for row, contextual_chunk, embedding in zip(chunk_with_header, contextual_chunks, embeddings)
-            ]
-
-            for item in vector_store_items:
-                await upload_item_to_mongodb(item)
+        if isinstance(file_stream, (bytes, bytearray)):
+            file_stream = io.BytesIO(file_stream)
+
+        document_id = str(document_id or uuid4())
+        delta = delta or ChunkDelta({}, document_id)
+        if delta.by_content:
+            await asyncio.to_thread(plan_csv_delta, file_stream, rows_per_chunk, granularity, delta)
+        skipped = {"count": 0}
+        chunks = iterate_in_thread(iter_csv_chunks(file_stream, rows_per_chunk))
+
+        # The first chunk is read up front for the context, which is constant for the entire CSV.
+        # It is requested by the first chunk that isn't stored, an unchanged file needs none.
+        first_chunk = await anext(chunks, None)
+        if first_chunk is None:
+            return 0
+        _, header, first_rows = first_chunk
+        context = None
+
+        async def request_context():
+            with stage_timer("context"):
+                return await get_context(header, first_rows)
+
+        async def get_shared_context():
+            nonlocal context
+            if context is None:
+                context = asyncio.ensure_future(request_context())
+            return await context
+
+        async def all_chunks():
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+
+        async with create_bulk_writer() as writer:
+
+            async def handle_chunk(chunk):
+                chunk_num, header, rows = chunk
+                positions = [(chunk_num, item_num) for item_num in range(len(get_tabular_item_texts(header, rows, granularity)))]
+                if all([delta.is_stored(position, str(chunk_num)) for position in positions]):
+                    skipped["count"] += len(positions)
+                    progress["total"] += len(positions)
+                    progress["completed"] += len(positions)
+                    return
+                item_ids = [delta.chunk_id(position) for position in positions]
+
+                # The header is re-added to each chunk
+                items = await build_tabular_items(await get_shared_context(), header, rows, granularity, usage=progress)
+                progress["total"] += len(items)
+
+                vector_store_items = [
+                    VectorStoreItem(
+                        id=item_id,
+                        original_text=original_text,
+                        contextual_text=contextual_chunk,
+                        document_id=document_id,
+                        page_number=str(chunk_num),  # Using chunk number as page equivalent
+                        vector_embeddings=embedding,
+                        document_name=document_name
+                    )
+                    for item_id, (original_text, contextual_chunk, embedding) in zip(item_ids, items)
+                ]
+
+                for item in vector_store_items:
+                    await writer.add(item)
+                progress["completed"] += len(vector_store_items)
+
+            try:
+                await run_bounded_pipeline(all_chunks(), handle_chunk, workers=INGESTION_CHUNK_WORKERS, queue_size=INGESTION_QUEUE_SIZE)
+            finally:
+                # Still pending when an ingestion is aborted
+                if context is not None:
+                    context.cancel()
+                    await asyncio.gather(context, return_exceptions=True)
+                # Detaches the reader from the file now, the job closes the file once this returns
+                await chunks.aclose()
+
+        return writer.inserted_count + skipped["count"]
 
     except Exception as e:
         raise Exception(f"Error processing CSV: {str(e)}")
 
-def get_context(rows):
+def get_context(header, rows):
     """
     Generates a description of the CSV by extracting the first 5 rows and column names.
     """
-    # Extract the first 5 rows from the CSV (including the header)
-    header = rows[0]
-    first_5_rows = rows[1:6]  # Skipping the header and getting the first 5 rows
+    # Extract the first 5 rows from the CSV (excluding the header)
+    first_5_rows = rows[:5]
 
     # Convert the header and the first 5 rows to a string
     first_5_row_with_col_names_str_format = "\n".join([",".join(header)] + [",".join(row) for row in first_5_rows])
@@ -0,0 +1,72 @@
+import asyncio
+from typing import Awaitable, Callable, List
+
+
+class EmbeddingBatcher:
+    """
+    Coalesces embedding requests from concurrent callers into batched API calls.
+
+    Each call to `embed` queues its text and waits on a future. The queue is sent as one
+    request when it reaches `max_batch_size` items or `max_batch_tokens` tokens, or
+    `max_wait_ms` after the first item was queued, and the vectors are handed back to
+    the callers in order.
+    """
+
+    def __init__(self, send_batch: Callable[[List[str], int], Awaitable[List[List[float]]]],
+                 estimate_tokens: Callable[[str], int], max_batch_size=256, max_batch_tokens=100000, max_wait_ms=10.0):
+        self.send_batch = send_batch
+        self.estimate_tokens = estimate_tokens
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait_ms / 1000
+        self.pending = []
+        self.pending_tokens = 0
+        self.flush_handle = None
+        self.in_flight = set()
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        tokens = self.estimate_tokens(text)
+
+        if self.pending and self.pending_tokens + tokens > self.max_batch_tokens:
+            self.flush()
+
+        self.pending.append((text, future))
+        self.pending_tokens += tokens
+
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.max_wait, self.flush)
+
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+
+        batch, tokens = self.pending, self.pending_tokens
+        self.pending, self.pending_tokens = [], 0
+
+        task = asyncio.ensure_future(self._send(batch, tokens))
+        self.in_flight.add(task)
+        task.add_done_callback(self.in_flight.discard)
+
+    async def _send(self, batch, tokens):
+        try:
+            embeddings = await self.send_batch([text for text, _ in batch], tokens)
+            if len(embeddings) != len(batch):
+                raise ValueError(f"Expected {len(batch)} embeddings, got {len(embeddings)}")
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
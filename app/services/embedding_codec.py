@@ -0,0 +1,62 @@
+import numpy as np
+from bson.binary import Binary
+
+STORAGE_FORMATS = ("list", "float32", "float16", "int8")
+
+BINARY_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "int8": np.int8,
+}
+
+
+def encode_embedding_fields(embedding, storage_format: str) -> dict:
+    """
+    Returns the MongoDB fields storing `embedding` in `storage_format`.
+
+    Binary formats add `vector_encoding`, and int8 also adds `vector_scale`, the factor
+    that maps the quantized values back to floats.
+    """
+    if storage_format == "list":
+        return {"vector_embeddings": [float(value) for value in embedding]}
+    if storage_format not in BINARY_DTYPES:
+        raise ValueError(f"Unknown embedding storage format '{storage_format}', expected one of {', '.join(STORAGE_FORMATS)}")
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    fields = {"vector_encoding": storage_format}
+    if storage_format == "int8":
+        scale = float(np.abs(vector).max()) / 127 if len(vector) else 0.0
+        scale = scale or 1.0
+        vector = np.round(vector / scale).astype(np.int8)
+        fields["vector_scale"] = scale
+    else:
+        vector = vector.astype(BINARY_DTYPES[storage_format])
+
+    fields["vector_embeddings"] = Binary(vector.tobytes())
+    return fields
+
+
+def decode_embedding(document: dict) -> np.ndarray:
+    """
+    Reads `vector_embeddings` from a MongoDB document in any storage format as float32.
+    """
+    encoding = document.get("vector_encoding")
+    if encoding is None:
+        return np.asarray(document["vector_embeddings"], dtype=np.float32)
+
+    vector = np.frombuffer(bytes(document["vector_embeddings"]), dtype=BINARY_DTYPES[encoding]).astype(np.float32)
+    if encoding == "int8":
+        vector *= document["vector_scale"]
+    return vector
+
+
+def encode_document(document: dict, storage_format: str) -> dict:
+    encoded = {key: value for key, value in document.items() if key not in ("vector_encoding", "vector_scale")}
+    encoded.update(encode_embedding_fields(document["vector_embeddings"], storage_format))
+    return encoded
+
+
+def decode_document(document: dict) -> dict:
+    decoded = {key: value for key, value in document.items() if key not in ("vector_encoding", "vector_scale")}
+    decoded["vector_embeddings"] = decode_embedding(document)
+    return decoded
@@ -0,0 +1,66 @@
+import asyncio
+from datetime import timedelta
+from app.services.logs import get_logger
+from app.services.mongo_helpers import run_in_mongo_executor, get_mongo_time, get_index_changes, apply_index_change
+from app.config import VECTOR_INDEX_SYNC_INTERVAL_SECONDS
+
+logger = get_logger(__name__)
+
+# A change stamped before the newest one read may only become visible later, changes
+# are read again for this long after it and skipped when they were applied already
+CHANGE_GRACE_SECONDS = 5
+
+
+class IndexSync:
+    """
+    Keeps this process's vector index in step with the writes of the other processes
+    (uvicorn workers, replicas), which only update their own index and log the changed
+    items. The log is polled every `interval` seconds and every change is applied from the
+    current state of its items in MongoDB.
+
+    Started before the index is rebuilt, so changes logged while it loads are replayed on it.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.since = None
+        self.applied = {}  # _id -> created_at of the changes applied within the grace window
+        self.task = None
+
+    async def start(self):
+        self.since = await run_in_mongo_executor(get_mongo_time) - timedelta(seconds=CHANGE_GRACE_SECONDS)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error("Error syncing the vector index: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def poll(self) -> int:
+        changes = await run_in_mongo_executor(get_index_changes, self.since)
+        applied_count = 0
+        for change in changes:
+            if change["_id"] in self.applied:
+                continue
+            await run_in_mongo_executor(apply_index_change, change)
+            self.applied[change["_id"]] = change["created_at"]
+            applied_count += 1
+
+        if changes:
+            self.since = max(self.since, changes[-1]["created_at"] - timedelta(seconds=CHANGE_GRACE_SECONDS))
+            self.applied = {change_id: created_at for change_id, created_at in self.applied.items() if created_at >= self.since}
+        if applied_count:
+            logger.debug("Applied %d vector index changes from other processes.", applied_count)
+        return applied_count
+
+
+index_sync = IndexSync(VECTOR_INDEX_SYNC_INTERVAL_SECONDS)
@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import importlib
+import time
+from app.models.documentManifest import DocumentManifest
+from app.services.chunk_ids import make_document_id
+from app.services.chunk_delta import ChunkDelta
+from app.services.tabular import check_granularity
+from app.services.mongo_helpers import (
+    run_in_mongo_executor, create_document_manifest, get_document_manifest, get_latest_document_manifest,
+    update_document_manifest, delete_failed_documents, get_stored_chunks, update_chunk_page_numbers, delete_items_by_ids,
+)
+from app.services.logs import get_logger
+from app.services.metrics import DOCUMENTS_INGESTED, CHUNKS_INGESTED
+from app.services.tokenizer import get_tokenizer_name
+from app.config import CSV_GRANULARITY, XLSX_GRANULARITY, PDF_CHUNK_MAX_TOKENS, PDF_CHUNK_OVERLAP_TOKENS
+
+SUPPORTED_FILE_TYPES = ['pdf', 'csv', 'xlsx']
+
+# Processors are imported on first use, with pandas, openpyxl and PyPDF2, not at startup
+PROCESSORS = {
+    'pdf': ("app.services.pdf_processor", "process_pdf"),
+    'csv': ("app.services.csv_processor", "process_csv"),
+    'xlsx': ("app.services.xlsx_processor", "process_xlsx"),
+}
+
+logger = get_logger(__name__)
+
+
+def hash_stream(file_stream, block_size=1024 * 1024):
+    """
+    Returns the sha256 hex digest and size of a seekable stream, leaving it rewound.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    file_stream.seek(0)
+    for block in iter(lambda: file_stream.read(block_size), b""):
+        digest.update(block)
+        size += len(block)
+    file_stream.seek(0)
+    return digest.hexdigest(), size
+
+
+def get_processor(file_extension):
+    module_name, function_name = PROCESSORS[file_extension]
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def get_chunk_layout(file_extension, granularity=None, rows_per_chunk=None) -> str:
+    """
+    Describes the settings that decide where chunks start and end. Chunk ids are only
+    reused between ingestions with the same layout.
+    """
+    if file_extension == "pdf":
+        return f"pdf:{get_tokenizer_name()}:{PDF_CHUNK_MAX_TOKENS}:{PDF_CHUNK_OVERLAP_TOKENS}"
+    granularity = granularity or (CSV_GRANULARITY if file_extension == "csv" else XLSX_GRANULARITY)
+    return f"{file_extension}:{granularity}:{check_granularity(granularity, rows_per_chunk)}"
+
+
+async def ingest_file(file_extension, file_stream, document_name, progress=None, granularity=None, rows_per_chunk=None, update=False, content_hash=None, size_bytes=None):
+    """
+    Runs the processor for `file_extension`. `progress` is a {"completed", "total"} dict
+    the processor keeps updated with chunk counts. `granularity` and `rows_per_chunk`
+    only apply to CSV and XLSX files.
+
+    The document's manifest is created before processing starts and marked ready with its
+    chunk count when it finishes. Returns the manifest.
+
+    The document id is derived from the file's name, content and chunking settings, and chunk
+    ids from their position, so ingesting a file whose earlier ingestion failed or was
+    interrupted resumes it: chunks that were already stored are skipped.
+
+    With `update`, the file is a new version of the stored document with the same name. Its
+    chunks are diffed against the stored ones by content hash: unchanged chunks are kept with
+    their vectors, only new or changed chunks are contextualized and embedded, and chunks that
+    vanished are deleted. The document keeps its id.
+
+    `content_hash` and `size_bytes` are the sha256 and size of the file when they were
+    computed as it was uploaded, otherwise the file is read once to compute them.
+    """
+    if file_extension not in SUPPORTED_FILE_TYPES:
+        raise ValueError(f"Unsupported file type: {file_extension}")
+    if progress is None:
+        progress = {"completed": 0, "total": 0}
+
+    if content_hash is None or size_bytes is None:
+        content_hash, size_bytes = await asyncio.to_thread(hash_stream, file_stream)
+    version_id = make_document_id(document_name, content_hash, get_chunk_layout(file_extension, granularity, rows_per_chunk))
+    current = await run_in_mongo_executor(get_latest_document_manifest, document_name) if update else None
+
+    if current is not None:
+        document_id = current["document_id"]
+        await run_in_mongo_executor(delete_failed_documents, document_name, document_id)
+        manifest = DocumentManifest(**current)
+        manifest.content_hash = content_hash
+        manifest.size_bytes = size_bytes
+        manifest.status = "ingesting"
+        await run_in_mongo_executor(update_document_manifest, document_id, {"content_hash": content_hash, "size_bytes": size_bytes, "status": "ingesting"})
+        delta = ChunkDelta(await run_in_mongo_executor(get_stored_chunks, document_id), version_id, by_content=True)
+        logger.info("Updating %s, %d chunks are stored for the previous version.", document_name, len(delta.stored_chunks))
+
+    else:
+        document_id = version_id
+        await run_in_mongo_executor(delete_failed_documents, document_name, document_id)
+        existing = await run_in_mongo_executor(get_document_manifest, document_id)
+        if existing is not None:
+            manifest = DocumentManifest(**existing)
+            manifest.status = "ingesting"
+            await run_in_mongo_executor(update_document_manifest, document_id, {"status": "ingesting"})
+        else:
+            now = time.time()
+            manifest = DocumentManifest(
+                document_id=document_id,
+                document_name=document_name,
+                file_type=file_extension,
+                content_hash=content_hash,
+                size_bytes=size_bytes,
+                created_at=now,
+                updated_at=now
+            )
+            await run_in_mongo_executor(create_document_manifest, manifest.dict())
+
+        delta = ChunkDelta(await run_in_mongo_executor(get_stored_chunks, document_id), document_id)
+        if delta.stored_chunks:
+            logger.info("Resuming %s, %d chunks are already stored.", document_name, len(delta.stored_chunks))
+
+    try:
+        process = await asyncio.to_thread(get_processor, file_extension)
+        logger.info("Processing %s: %s", file_extension.upper(), document_name)
+        if file_extension == "pdf":
+            chunk_count = await process(file_stream, document_name, progress=progress, document_id=document_id, delta=delta)
+        else:
+            chunk_count = await process(file_stream, document_name, progress=progress, granularity=granularity, rows_per_chunk=rows_per_chunk, document_id=document_id, delta=delta)
+
+        if delta.moved:
+            await run_in_mongo_executor(update_chunk_page_numbers, delta.moved)
+        vanished_ids = delta.vanished_ids()
+        if vanished_ids:
+            deleted_count = await run_in_mongo_executor(delete_items_by_ids, vanished_ids)
+            logger.info("Deleted %d chunks that are no longer in %s.", deleted_count, document_name)
+
+    except Exception:
+        DOCUMENTS_INGESTED.inc(file_type=file_extension, status="failed")
+        await run_in_mongo_executor(update_document_manifest, document_id, {"status": "failed"})
+        raise
+
+    DOCUMENTS_INGESTED.inc(file_type=file_extension, status="ready")
+    CHUNKS_INGESTED.inc(chunk_count, file_type=file_extension)
+
+    manifest.chunk_count = chunk_count
+    manifest.status = "ready"
+    await run_in_mongo_executor(update_document_manifest, document_id, {"status": "ready", "chunk_count": chunk_count})
+    return manifest
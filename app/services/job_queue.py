@@ -0,0 +1,289 @@
+import asyncio
+import os
+import socket
+import time
+from uuid import uuid4
+from app.models.ingestionJob import IngestionJob
+from app.services.ingestion import ingest_file
+from app.services.logs import get_logger
+from app.services.metrics import Gauge
+from app.services.tracing import Trace, current_trace
+from app.services.mongo_helpers import (
+    run_in_mongo_executor, save_ingestion_job, update_ingestion_job, get_ingestion_job, delete_ingestion_job,
+    claim_ingestion_job, count_claimable_ingestion_jobs, get_batch_ingestion_jobs, refresh_queued_ingestion_jobs,
+    get_orphaned_ingestion_jobs, recover_orphaned_ingestion_job, fail_ingesting_documents,
+)
+from app.config import (
+    INGESTION_WORKERS, INGESTION_JOBS_DIR, INGESTION_PROGRESS_INTERVAL_SECONDS, INGESTION_TRACING_ENABLED,
+    INGESTION_JOB_LEASE_SECONDS, INGESTION_JOB_POLL_SECONDS,
+)
+
+logger = get_logger(__name__)
+
+
+class JobQueue:
+    """
+    Runs ingestion jobs on a fixed pool of workers. Jobs are persisted in MongoDB and the
+    uploaded file is kept in `jobs_dir` until the job finishes. The file is local, so a job
+    is only run by the processes of the host it was uploaded to; they claim jobs from the
+    collection atomically, so each job runs once however many workers or replicas share it.
+
+    The owner of a running job refreshes its heartbeat, a job whose heartbeat is older than
+    INGESTION_JOB_LEASE_SECONDS was interrupted and is claimed again. The processes of a host
+    also refresh the heartbeat of its queued jobs. Unfinished jobs of a host that stopped
+    sending heartbeats, e.g. a pod rescheduled under a new hostname, are recovered by the
+    others: moved to this host when their file is here too (INGESTION_JOBS_DIR on shared
+    storage), otherwise marked failed so the file can be uploaded again.
+
+    Chunks stored by an interrupted or failed job are kept, and ingesting the file again
+    resumes from them. All workers share the OpenAI schedulers, which bound the total API
+    concurrency across jobs.
+    """
+
+    def __init__(self, workers: int, jobs_dir: str):
+        self.worker_count = workers
+        self.jobs_dir = jobs_dir
+        self.host = socket.gethostname()
+        self.owner = None
+        self.wakeup = None
+        self.queued_count = 0
+        self.workers = []
+        self.maintainer = None
+        self.stopping = False
+        self.progress = {}  # job_id -> live {"completed", "total"} dict of running jobs
+        self.ingestions = {}  # job_id -> task ingesting the file of a running job
+        self.abandoned = {}  # job_id -> why its ingestion was cancelled, "deleted" or "taken over"
+
+    async def start(self):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        # Set here rather than on import, every forked worker process has its own
+        self.owner = f"{self.host}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.wakeup = asyncio.Event()
+        self.queued_count = await run_in_mongo_executor(count_claimable_ingestion_jobs, self.host, time.time() - INGESTION_JOB_LEASE_SECONDS)
+
+        self.stopping = False
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        self.maintainer = asyncio.create_task(self._maintain())
+        logger.info("Started %d ingestion workers with %d queued jobs.", self.worker_count, self.queued_count, extra={"owner": self.owner})
+
+    async def stop(self):
+        self.stopping = True
+        tasks = self.workers + [self.maintainer] if self.maintainer else self.workers
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.workers = []
+        self.maintainer = None
+
+    def job_file_path(self, job_id: str, file_type: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.{file_type}")
+
+    async def submit(self, document_name: str, file_type: str, file_path: str, job_id: str, granularity=None, rows_per_chunk=None, update=False, content_hash=None, size_bytes=None, batch_id=None) -> IngestionJob:
+        now = time.time()
+        job = IngestionJob(
+            job_id=job_id,
+            document_name=document_name,
+            file_type=file_type,
+            file_path=file_path,
+            granularity=granularity,
+            rows_per_chunk=rows_per_chunk,
+            update=update,
+            content_hash=content_hash,
+            size_bytes=size_bytes,
+            batch_id=batch_id,
+            host=self.host,
+            heartbeat_at=now,
+            created_at=now,
+            updated_at=now
+        )
+        await run_in_mongo_executor(save_ingestion_job, job.dict())
+        self.queued_count += 1
+        self.wakeup.set()
+        return job
+
+    async def delete(self, job_id: str):
+        """
+        Deletes a job, cancelling it if it hasn't finished. A job running in another process
+        is stopped by its owner at its next heartbeat. Chunks it stored are kept, uploading
+        the file again resumes the document. Returns the deleted job, or None.
+        """
+        job = await run_in_mongo_executor(delete_ingestion_job, job_id)
+        if job is None or job["status"] not in ("queued", "running"):
+            return job
+
+        ingestion = self.ingestions.get(job_id)
+        if ingestion is not None:
+            self.abandoned[job_id] = "deleted"
+            ingestion.cancel()
+        elif job["status"] == "queued" and os.path.exists(job["file_path"]):
+            os.remove(job["file_path"])
+        await run_in_mongo_executor(fail_ingesting_documents, job["document_name"])
+        logger.info("Deleted %s job %s for %s", job["status"], job_id, job["document_name"], extra={"job_id": job_id})
+        return job
+
+    async def get_status(self, job_id: str):
+        job = await run_in_mongo_executor(get_ingestion_job, job_id)
+        if job is None:
+            return None
+        progress = self.progress.get(job_id)
+        if progress is not None:
+            job["chunks_total"] = progress["total"]
+            job["chunks_completed"] = progress["completed"]
+            job["prompt_tokens"] = progress.get("prompt_tokens", 0)
+        return job
+
+    async def get_batch_status(self, batch_id: str):
+        """
+        The jobs of a batch with live progress, and how many of them are in each status.
+        """
+        jobs = await run_in_mongo_executor(get_batch_ingestion_jobs, batch_id)
+        if not jobs:
+            return None
+        counts = {}
+        for job in jobs:
+            progress = self.progress.get(job["job_id"])
+            if progress is not None:
+                job["chunks_total"] = progress["total"]
+                job["chunks_completed"] = progress["completed"]
+                job["prompt_tokens"] = progress.get("prompt_tokens", 0)
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {
+            "batch_id": batch_id,
+            "counts": counts,
+            "chunks_total": sum(job["chunks_total"] for job in jobs),
+            "chunks_completed": sum(job["chunks_completed"] for job in jobs),
+            "jobs": jobs,
+        }
+
+    async def _update(self, job_id: str, **fields) -> bool:
+        # Only while this process owns the job, one that was deleted or taken over is left alone
+        fields["updated_at"] = time.time()
+        return await run_in_mongo_executor(update_ingestion_job, job_id, fields, self.owner)
+
+    async def _report_progress(self, job_id: str, progress: dict, ingestion: asyncio.Task):
+        # The heartbeat is sent every interval, the progress only when it changed
+        reported = None
+        while True:
+            await asyncio.sleep(INGESTION_PROGRESS_INTERVAL_SECONDS)
+            current = (progress["completed"], progress["total"], progress.get("prompt_tokens", 0))
+            fields = {"heartbeat_at": time.time()}
+            if current != reported:
+                fields.update(chunks_completed=current[0], chunks_total=current[1], prompt_tokens=current[2])
+                reported = current
+            if not await self._update(job_id, **fields):
+                # Deleted through the API, or claimed by another process after a missed lease
+                job = await run_in_mongo_executor(get_ingestion_job, job_id)
+                self.abandoned[job_id] = "taken over" if job is not None else "deleted"
+                ingestion.cancel()
+                return
+
+    async def _maintain(self):
+        while True:
+            try:
+                await run_in_mongo_executor(refresh_queued_ingestion_jobs, self.host)
+                await self._recover_orphaned_jobs()
+            except Exception as e:
+                logger.error("Error maintaining ingestion jobs: %s", e)
+            await asyncio.sleep(INGESTION_JOB_POLL_SECONDS)
+
+    async def _recover_orphaned_jobs(self):
+        stale_before = time.time() - INGESTION_JOB_LEASE_SECONDS
+        for job in await run_in_mongo_executor(get_orphaned_ingestion_jobs, self.host, stale_before):
+            job_id = job["job_id"]
+            if os.path.exists(job["file_path"]):
+                # The jobs directory is shared, this host runs it and resumes from its stored chunks
+                fields = {"host": self.host, "status": "queued", "owner": None, "heartbeat_at": time.time()}
+                if await run_in_mongo_executor(recover_orphaned_ingestion_job, job, stale_before, fields):
+                    logger.info("Moved job %s for %s from host %s, which stopped.", job_id, job["document_name"], job["host"], extra={"job_id": job_id})
+                    self.queued_count += 1
+                    self.wakeup.set()
+                continue
+
+            fields = {"status": "failed", "owner": None, "error": f"Host {job['host']}, which held the uploaded file, stopped. Upload the file again to resume."}
+            if await run_in_mongo_executor(recover_orphaned_ingestion_job, job, stale_before, fields):
+                await run_in_mongo_executor(fail_ingesting_documents, job["document_name"])
+                logger.warning("Job %s for %s failed, host %s stopped.", job_id, job["document_name"], job["host"], extra={"job_id": job_id})
+
+    async def _next_job(self) -> dict:
+        while True:
+            # Cleared before claiming, a job submitted meanwhile sets it again
+            self.wakeup.clear()
+            stale_before = time.time() - INGESTION_JOB_LEASE_SECONDS
+            job = await run_in_mongo_executor(claim_ingestion_job, self.host, self.owner, stale_before)
+            self.queued_count = await run_in_mongo_executor(count_claimable_ingestion_jobs, self.host, stale_before)
+            if job is not None:
+                return job
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), INGESTION_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, worker_num: int):
+        while True:
+            job = await self._next_job()
+            try:
+                await self._run(job)
+            except Exception as e:
+                logger.error("Worker %d: error running job %s: %s", worker_num, job["job_id"], e)
+
+    async def _run(self, job: dict):
+        job_id = job["job_id"]
+        if job["status"] == "running":
+            # Interrupted midway, the stored chunks are skipped when it runs again
+            logger.info("Resuming interrupted job %s for %s", job_id, job["document_name"], extra={"job_id": job_id, "previous_owner": job.get("owner")})
+
+        progress = {"completed": 0, "total": 0}
+        self.progress[job_id] = progress
+        trace = Trace(job_id) if INGESTION_TRACING_ENABLED else None
+        trace_token = current_trace.set(trace)
+        ingestion = self.ingestions[job_id] = asyncio.create_task(self._ingest(job, progress))
+        reporter = asyncio.create_task(self._report_progress(job_id, progress, ingestion))
+
+        finished = False
+        try:
+            await ingestion
+            await self._update(job_id, status="completed", chunks_completed=progress["completed"], chunks_total=progress["total"], prompt_tokens=progress.get("prompt_tokens", 0), trace=trace and trace.to_dict())
+            finished = True
+            logger.info("Job %s for %s completed.", job_id, job["document_name"], extra={"job_id": job_id, "chunks": progress["total"], "prompt_tokens": progress.get("prompt_tokens", 0)})
+        except Exception as e:
+            # The stored chunks are kept, uploading the file again resumes the document
+            await self._update(job_id, status="failed", error=str(e), chunks_completed=progress["completed"], chunks_total=progress["total"], prompt_tokens=progress.get("prompt_tokens", 0), trace=trace and trace.to_dict())
+            finished = True
+            logger.error("Job %s for %s failed: %s", job_id, job["document_name"], e, extra={"job_id": job_id})
+        except asyncio.CancelledError:
+            reason = self.abandoned.pop(job_id, None)
+            if reason is None or self.stopping:
+                # Stopped with the app: handed back so the next process on this host resumes it
+                # right away instead of after the lease. The file and stored chunks are kept.
+                await self._update(job_id, status="queued", owner=None, heartbeat_at=None)
+                raise
+            # Only this job was cancelled, the worker goes on. A job taken over still needs its file
+            finished = reason == "deleted"
+            logger.info("Job %s for %s stopped, it was %s.", job_id, job["document_name"], reason, extra={"job_id": job_id})
+        finally:
+            current_trace.reset(trace_token)
+            reporter.cancel()
+            ingestion.cancel()
+            self.progress.pop(job_id, None)
+            self.ingestions.pop(job_id, None)
+            self.abandoned.pop(job_id, None)
+            if finished and os.path.exists(job["file_path"]):
+                os.remove(job["file_path"])
+
+    async def _ingest(self, job: dict, progress: dict):
+        with open(job["file_path"], "rb") as file_stream:
+            await ingest_file(
+                job["file_type"], file_stream, job["document_name"], progress=progress,
+                granularity=job.get("granularity"), rows_per_chunk=job.get("rows_per_chunk"), update=job.get("update", False),
+                content_hash=job.get("content_hash"), size_bytes=job.get("size_bytes")
+            )
+
+
+job_queue = JobQueue(workers=INGESTION_WORKERS, jobs_dir=INGESTION_JOBS_DIR)
+
+Gauge("ingestion_jobs_queued", "Ingestion jobs of this host waiting for a worker.", function=lambda: job_queue.queued_count)
+Gauge("ingestion_jobs_running", "Ingestion jobs being processed.", function=lambda: len(job_queue.progress))
+
+
+def new_job_id() -> str:
+    return str(uuid4())
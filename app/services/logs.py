@@ -0,0 +1,97 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from app.config import LOG_LEVEL, LOG_FORMAT
+
+# Attributes every LogRecord has, anything else was passed in `extra`
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+# Set by configure_logging on import, and by start_log_listener in the serving process
+stream_handler = None
+queue_handler = None
+listener = None
+
+class StructuredFormatter(logging.Formatter):
+    """
+    Formats a record with the fields passed in `extra`, as `key=value` pairs after the
+    message or, with `as_json`, as one JSON object per line.
+    """
+
+    def __init__(self, as_json: bool = False):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES}
+        if self.as_json:
+            entry = {"time": self.formatTime(record), "level": record.levelname, "logger": record.name, "message": record.getMessage()}
+            entry.update(fields)
+            if record.exc_info:
+                entry["exception"] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str)
+
+        line = super().format(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+def configure_logging():
+    """
+    Sets up the app's loggers to write to stdout, in the calling thread until
+    start_log_listener is called. Starts no thread, so it is safe on import before a
+    server forks its workers. Safe to call more than once.
+    """
+    global stream_handler
+    if stream_handler is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(StructuredFormatter(as_json=LOG_FORMAT == "json"))
+    app_logger = logging.getLogger("app")
+    app_logger.setLevel(LOG_LEVEL)
+    app_logger.addHandler(stream_handler)
+    app_logger.propagate = False
+
+
+def start_log_listener():
+    """
+    Sends the app's log records through a queue to a background thread, so writing to
+    stdout never blocks the event loop. Called when the app starts, in the serving process:
+    a thread started before a fork doesn't run in the forked workers. Safe to call more
+    than once.
+    """
+    global queue_handler, listener
+    configure_logging()
+    if listener is not None:
+        return
+
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, stream_handler)
+    listener.start()
+    queue_handler = QueueHandler(records)
+    app_logger = logging.getLogger("app")
+    app_logger.addHandler(queue_handler)
+    app_logger.removeHandler(stream_handler)
+    atexit.register(stop_log_listener)
+
+
+def stop_log_listener():
+    # Writes the queued records and goes back to writing in the calling thread
+    global queue_handler, listener
+    if listener is None:
+        return
+    app_logger = logging.getLogger("app")
+    app_logger.addHandler(stream_handler)
+    app_logger.removeHandler(queue_handler)
+    listener.stop()
+    queue_handler = None
+    listener = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    configure_logging()
+    return logging.getLogger(name)
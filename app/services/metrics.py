@@ -0,0 +1,140 @@
+import math
+import threading
+
+# Seconds, from a cached lookup to a slow API call with retries
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+registry = []
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    """
+    A metric family with a fixed set of label names, safe to update from any thread.
+    Instances register themselves for `render_metrics`.
+    """
+
+    type_name = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}  # label values -> value
+        registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self.lock:
+            return [(self.name, tuple(zip(self.labelnames, key)), value) for key, value in self.values.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(f"{name}{format_labels(labels)} {format_value(value)}" for name, labels, value in self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. With `function`, the value is read when rendered.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = float(value)
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def _samples(self):
+        if self.function is not None:
+            return [(self.name, (), float(self.function()))]
+        return super()._samples()
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                labels = tuple(zip(self.labelnames, key))
+                samples.extend((f"{self.name}_bucket", labels + (("le", format_value(bound)),), count) for bound, count in zip(self.buckets, counts))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+def render_metrics() -> str:
+    """
+    Every registered metric in the Prometheus text exposition format.
+    """
+    return "\n".join(metric.render() for metric in registry) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "ingestion_stage_seconds", "Time spent in each ingestion stage: parse, context, contextualize, embed, mongo_write.", ["stage"]
+)
+DOCUMENTS_INGESTED = Counter("ingestion_documents_total", "Documents ingested, by file type and outcome.", ["file_type", "status"])
+CHUNKS_INGESTED = Counter("ingestion_chunks_total", "Chunks stored by finished ingestions, by file type.", ["file_type"])
+OPENAI_REQUESTS = Counter("openai_requests_total", "OpenAI requests by API and outcome, retries included.", ["api", "outcome"])
+OPENAI_RETRIES = Counter("openai_retries_total", "OpenAI requests retried after a transient error.", ["api"])
+OPENAI_TOKENS = Counter("openai_tokens_total", "Tokens billed by OpenAI, by API and kind.", ["api", "kind"])
+AI_CACHE_LOOKUPS = Counter("ai_cache_lookups_total", "AI cache lookups by result: memory_hit, disk_hit or miss.", ["result"])
+MONGO_DOCUMENTS_WRITTEN = Counter("mongo_documents_written_total", "Documents written by bulk writers.")
+MONGO_WRITE_FAILURES = Counter("mongo_write_failures_total", "Documents bulk writers failed to write.")
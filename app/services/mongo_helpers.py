@@ -1,19 +1,193 @@
-from pymongo import MongoClient
+import asyncio
+import socket
+import time
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from pymongo import MongoClient, ASCENDING, UpdateOne, ReplaceOne, ReturnDocument
 from app.models.vectorStoreItem import VectorStoreItem
-from checker.config import MONGO_DB_DATABASE_NAME, MONGO_DB_URI, MONGO_DB_COLLECTION_NAME
+from app.services.mongo_writer import BulkWriter
+from app.services.vector_index import vector_index
+from app.services.embedding_codec import encode_document, decode_document
+from app.services.chunk_delta import hash_chunk_text
+from app.config import MONGO_BULK_BATCH_SIZE, MONGO_BULK_FLUSH_INTERVAL_MS, MONGO_MAX_PENDING_BATCHES, MONGO_WRITE_THREADS, INGESTION_JOBS_COLLECTION_NAME, EMBEDDING_STORAGE_FORMAT, DOCUMENTS_COLLECTION_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, VECTOR_INDEX_CHANGES_COLLECTION_NAME, VECTOR_INDEX_CHANGES_TTL_SECONDS
+from app.config import MONGO_DB_URI, MONGO_DB_DATABASE_NAME, MONGO_DB_COLLECTION_NAME
+from app.services.logs import get_logger
 import os
 
-client = MongoClient(MONGO_DB_URI)
-db = client[MONGO_DB_DATABASE_NAME]
-collection = db[MONGO_DB_COLLECTION_NAME]
+logger = get_logger(__name__)
+
+# Set by connect_mongo when the app starts, importing this module opens no connection
+client = None
+db = None
+collection = None
+jobs_collection = None
+documents_collection = None
+index_changes_collection = None
+# Marks the vector index changes logged by this process, which it has applied already
+change_origin = None
+
+# pymongo is synchronous, writes run here instead of on the event loop
+mongo_executor = ThreadPoolExecutor(max_workers=MONGO_WRITE_THREADS, thread_name_prefix="mongo-writer")
+
+async def run_in_mongo_executor(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(mongo_executor, fn, *args)
+
+def connect_mongo():
+    """
+    Creates the client, with a pool of MONGO_MIN_POOL_SIZE to MONGO_MAX_POOL_SIZE
+    connections, and the collections. Safe to call more than once.
+    """
+    global client, db, collection, jobs_collection, documents_collection, index_changes_collection, change_origin
+    if client is not None:
+        return
+    uri, database_name, collection_name = MONGO_DB_URI, MONGO_DB_DATABASE_NAME, MONGO_DB_COLLECTION_NAME
+    if uri is None:
+        from checker.config import MONGO_DB_URI as uri, MONGO_DB_DATABASE_NAME as database_name, MONGO_DB_COLLECTION_NAME as collection_name
+    client = MongoClient(uri, maxPoolSize=MONGO_MAX_POOL_SIZE, minPoolSize=MONGO_MIN_POOL_SIZE)
+    db = client[database_name]
+    collection = db[collection_name]
+    jobs_collection = db[INGESTION_JOBS_COLLECTION_NAME]
+    documents_collection = db[DOCUMENTS_COLLECTION_NAME]
+    index_changes_collection = db[VECTOR_INDEX_CHANGES_COLLECTION_NAME]
+    change_origin = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+def close_mongo():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+def ping_mongo():
+    # Also opens the first pooled connection when the app starts
+    client.admin.command("ping")
+
+def ensure_indexes():
+    collection.create_index([("document_name", ASCENDING)])
+    collection.create_index([("document_id", ASCENDING)])
+    collection.create_index([("id", ASCENDING)])
+    documents_collection.create_index([("document_id", ASCENDING)], unique=True)
+    documents_collection.create_index([("document_name", ASCENDING)])
+    jobs_collection.create_index([("job_id", ASCENDING)], unique=True)
+    jobs_collection.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+    jobs_collection.create_index([("document_name", ASCENDING)])
+    jobs_collection.create_index([("batch_id", ASCENDING)])
+    index_changes_collection.create_index([("created_at", ASCENDING)], expireAfterSeconds=VECTOR_INDEX_CHANGES_TTL_SECONDS)
 
 def check_if_document_name_exists(document_name: str) -> bool:
-    result = collection.find_one({"document_name": document_name})
+    manifests = list(documents_collection.find({"document_name": document_name}, {"_id": 0, "status": 1}))
+    if manifests:
+        # A failed ingestion keeps its chunks so it can be resumed by uploading the file again
+        return any(manifest["status"] != "failed" for manifest in manifests)
+    # Documents ingested before the manifest existed only have chunks
+    result = collection.find_one({"document_name": document_name}, {"_id": 1})
     return result is not None
 
-async def upload_item_to_mongodb(item: VectorStoreItem):
+def create_document_manifest(manifest: dict):
+    documents_collection.insert_one(dict(manifest))
+
+def get_document_manifest(document_id: str):
+    return documents_collection.find_one({"document_id": document_id}, {"_id": 0})
+
+def update_document_manifest(document_id: str, fields: dict):
+    fields["updated_at"] = time.time()
+    documents_collection.update_one({"document_id": document_id}, {"$set": fields})
+
+def delete_failed_documents(document_name: str, keep_document_id: str) -> int:
+    """
+    Deletes earlier failed ingestions of `document_name` other than `keep_document_id`, which
+    left chunks behind for a different version of the file.
+    """
+    failed = list(documents_collection.find(
+        {"document_name": document_name, "status": "failed", "document_id": {"$ne": keep_document_id}},
+        {"_id": 0, "document_id": 1}
+    ))
+    return sum(delete_all_items_with_name_or_id(manifest["document_id"]) for manifest in failed)
+
+def get_latest_document_manifest(document_name: str):
+    manifests = documents_collection.find({"document_name": document_name}, {"_id": 0}).sort("updated_at", -1).limit(1)
+    return next(iter(manifests), None)
+
+def get_stored_chunks(document_id: str) -> dict:
+    """
+    Maps the id of every chunk stored for a document to its content hash and page number,
+    the checkpoint a resumed or updated ingestion starts from.
+    """
+    projection = {"_id": 0, "id": 1, "original_text": 1, "page_number": 1}
+    return {
+        item["id"]: (hash_chunk_text(item["original_text"]), item["page_number"])
+        for item in collection.find({"document_id": document_id}, projection)
+    }
+
+def update_chunk_page_numbers(page_numbers: dict):
+    requests = [UpdateOne({"id": item_id}, {"$set": {"page_number": page_number}}) for item_id, page_number in page_numbers.items()]
+    for start in range(0, len(requests), MONGO_BULK_BATCH_SIZE):
+        collection.bulk_write(requests[start:start + MONGO_BULK_BATCH_SIZE], ordered=False)
+
+def delete_items_by_ids(ids: list) -> int:
+    deleted_count = 0
+    for start in range(0, len(ids), MONGO_BULK_BATCH_SIZE):
+        deleted_count += collection.delete_many({"id": {"$in": ids[start:start + MONGO_BULK_BATCH_SIZE]}}).deleted_count
+    vector_index.remove_items(ids)
+    record_index_change(ids=ids)
+    return deleted_count
+
+def get_document_manifests(status: str = None) -> list:
+    query = {"status": status} if status else {}
+    return list(documents_collection.find(query, {"_id": 0}).sort("document_name", ASCENDING))
+
+def backfill_document_manifests() -> int:
+    """
+    Creates manifests for documents ingested before the manifest collection existed.
+    Their content hash and size are unknown and left empty.
+    """
+    if documents_collection.estimated_document_count() > 0:
+        return 0
+
+    now = time.time()
+    pipeline = [{"$group": {"_id": {"document_id": "$document_id", "document_name": "$document_name"}, "chunk_count": {"$sum": 1}}}]
+    manifests = [
+        {
+            "document_id": group["_id"]["document_id"],
+            "document_name": group["_id"]["document_name"],
+            "file_type": group["_id"]["document_name"].split('.')[-1].lower(),
+            "content_hash": "",
+            "size_bytes": 0,
+            "chunk_count": group["chunk_count"],
+            "status": "ready",
+            "created_at": now,
+            "updated_at": now,
+        }
+        for group in collection.aggregate(pipeline, allowDiskUse=True)
+    ]
+    if manifests:
+        documents_collection.insert_many(manifests, ordered=False)
+    logger.info("Backfilled %d document manifests.", len(manifests))
+    return len(manifests)
+
+def to_mongo_document(item: VectorStoreItem) -> dict:
     item_dict = item.dict()
-    collection.insert_one(item_dict)
+    if EMBEDDING_STORAGE_FORMAT == "list":
+        return item_dict
+    return encode_document(item_dict, EMBEDDING_STORAGE_FORMAT)
+
+def add_documents_to_vector_index(documents: list):
+    if EMBEDDING_STORAGE_FORMAT != "list":
+        documents = [decode_document(document) for document in documents]
+    vector_index.add_items(documents)
+    record_index_change(ids=[document["id"] for document in documents])
+
+def create_bulk_writer() -> BulkWriter:
+    return BulkWriter(
+        collection,
+        mongo_executor,
+        batch_size=MONGO_BULK_BATCH_SIZE,
+        flush_interval_ms=MONGO_BULK_FLUSH_INTERVAL_MS,
+        max_pending_batches=MONGO_MAX_PENDING_BATCHES,
+        on_written=add_documents_to_vector_index,
+        to_document=to_mongo_document,
+        upsert_key="id"
+    )
 
 def delete_all_items_with_name_or_id(input_str: str) -> int:
     delete_result = collection.delete_many({
@@ -22,4 +196,188 @@ def delete_all_items_with_name_or_id(input_str: str) -> int:
             {"document_id": input_str}
         ]
     })
+    documents_collection.delete_many({
+        "$or": [
+            {"document_name": input_str},
+            {"document_id": input_str}
+        ]
+    })
+    vector_index.remove_document(input_str)
+    record_index_change(input_str=input_str)
     return delete_result.deleted_count
+
+def get_mongo_time():
+    return client.admin.command("hello")["localTime"]
+
+def record_index_change(ids: list = None, input_str: str = None):
+    """
+    Logs that the items with `ids`, or of the document_name or document_id `input_str`,
+    changed, for the other processes to update their vector index. Stamped with the server's
+    clock, so the processes of every host read the log in the same time order.
+    """
+    index_changes_collection.update_one(
+        {"_id": ObjectId()},
+        {"$set": {"origin": change_origin, "ids": ids, "input_str": input_str}, "$currentDate": {"created_at": True}},
+        upsert=True
+    )
+
+def get_index_changes(since) -> list:
+    # Changes logged by the other processes since `since`, oldest first
+    return list(index_changes_collection.find({"created_at": {"$gte": since}, "origin": {"$ne": change_origin}}).sort("created_at", ASCENDING))
+
+def apply_index_change(change: dict):
+    """
+    Updates the vector index from the current state of the items a change names, rather than
+    from the change itself, so changes can be applied in any order and more than once.
+    """
+    if change.get("input_str"):
+        input_str = change["input_str"]
+        vector_index.remove_document(input_str)
+        query = {"$or": [{"document_name": input_str}, {"document_id": input_str}]}
+    else:
+        query = {"id": {"$in": change["ids"]}}
+    found = set()
+    for batch in iter_vector_store_batches(query=query):
+        vector_index.add_items(batch)
+        found.update(item["id"] for item in batch)
+    if not change.get("input_str"):
+        vector_index.remove_items([item_id for item_id in change["ids"] if item_id not in found])
+
+def iter_vector_store_batches(batch_size: int = 1000, query: dict = None):
+    """
+    Yields every item's id, document fields and decoded embedding, or those of the items
+    matching `query`, in lists of `batch_size`.
+    """
+    projection = {"_id": 0, "id": 1, "document_id": 1, "document_name": 1, "vector_embeddings": 1, "vector_encoding": 1, "vector_scale": 1}
+    batch = []
+    for item in collection.find(query or {}, projection, batch_size=batch_size):
+        batch.append(decode_document(item))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_vector_store_items(input_str: str = None, batch_size: int = 1000):
+    """
+    Yields every item, or the items of one document_name or document_id, with all its
+    fields and its decoded embedding in lists of `batch_size`, in _id order.
+    """
+    query = {"$or": [{"document_name": input_str}, {"document_id": input_str}]} if input_str else {}
+    batch = []
+    for item in collection.find(query, batch_size=batch_size).sort("_id", ASCENDING):
+        del item["_id"]
+        batch.append(decode_document(item))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def replace_vector_store_items(documents: list) -> int:
+    """
+    Upserts already encoded items by id in one unordered bulk write, so loading the same
+    items again replaces them. Returns the number of items written.
+    """
+    if not documents:
+        return 0
+    result = collection.bulk_write([ReplaceOne({"id": document["id"]}, document, upsert=True) for document in documents], ordered=False)
+    return result.matched_count + result.upserted_count
+
+def get_document_manifests_with_name_or_id(input_str: str = None) -> list:
+    if not input_str:
+        return get_document_manifests()
+    return list(documents_collection.find({"$or": [{"document_name": input_str}, {"document_id": input_str}]}, {"_id": 0}))
+
+def replace_document_manifests(manifests: list):
+    if manifests:
+        documents_collection.bulk_write([ReplaceOne({"document_id": manifest["document_id"]}, manifest, upsert=True) for manifest in manifests], ordered=False)
+
+def get_items_by_ids(ids: list) -> dict:
+    items = collection.find({"id": {"$in": ids}}, {"_id": 0, "vector_embeddings": 0, "vector_encoding": 0, "vector_scale": 0})
+    return {item["id"]: item for item in items}
+
+def save_ingestion_job(job: dict):
+    jobs_collection.replace_one({"job_id": job["job_id"]}, job, upsert=True)
+
+def update_ingestion_job(job_id: str, fields: dict, owner: str = None) -> bool:
+    # With `owner`, only updates the job while that process still holds it. Returns whether it did
+    query = {"job_id": job_id, "owner": owner} if owner else {"job_id": job_id}
+    return jobs_collection.update_one(query, {"$set": fields}).matched_count > 0
+
+def get_ingestion_job(job_id: str):
+    return jobs_collection.find_one({"job_id": job_id}, {"_id": 0})
+
+def delete_ingestion_job(job_id: str):
+    # Returns the deleted job, or None
+    return jobs_collection.find_one_and_delete({"job_id": job_id}, projection={"_id": 0})
+
+def stale_jobs_query(stale_before: float) -> dict:
+    # No heartbeat since `stale_before`, jobs queued before heartbeats were sent go by updated_at
+    return {"$or": [
+        {"heartbeat_at": {"$lt": stale_before}},
+        {"heartbeat_at": None, "updated_at": {"$lt": stale_before}},
+    ]}
+
+def claimable_jobs_query(host: str, stale_before: float) -> dict:
+    # Jobs queued on `host`, or left running by a process that stopped sending heartbeats
+    return {
+        "host": {"$in": [host, None]},
+        "$or": [
+            {"status": "queued"},
+            {"status": "running", **stale_jobs_query(stale_before)},
+        ]
+    }
+
+def claim_ingestion_job(host: str, owner: str, stale_before: float):
+    """
+    Atomically hands the oldest claimable job of `host` to `owner` and marks it running, so
+    each job is run by one process even when several share the collection. Returns the job
+    as it was before the claim, or None.
+    """
+    now = time.time()
+    return jobs_collection.find_one_and_update(
+        claimable_jobs_query(host, stale_before),
+        {"$set": {"status": "running", "owner": owner, "heartbeat_at": now, "updated_at": now}},
+        projection={"_id": 0},
+        sort=[("created_at", ASCENDING)],
+        return_document=ReturnDocument.BEFORE
+    )
+
+def count_claimable_ingestion_jobs(host: str, stale_before: float) -> int:
+    return jobs_collection.count_documents(claimable_jobs_query(host, stale_before))
+
+def refresh_queued_ingestion_jobs(host: str):
+    # The heartbeat of queued jobs, sent by every process of their host while it runs
+    jobs_collection.update_many({"host": host, "status": "queued"}, {"$set": {"heartbeat_at": time.time()}})
+
+def get_orphaned_ingestion_jobs(host: str, stale_before: float) -> list:
+    """
+    Unfinished jobs of other hosts that stopped sending heartbeats, e.g. a pod that was
+    rescheduled under a new hostname.
+    """
+    query = {"host": {"$nin": [host, None]}, "status": {"$in": ["queued", "running"]}, **stale_jobs_query(stale_before)}
+    return list(jobs_collection.find(query, {"_id": 0}).sort("created_at", ASCENDING))
+
+def recover_orphaned_ingestion_job(job: dict, stale_before: float, fields: dict) -> bool:
+    """
+    Sets `fields` on an orphaned job unless its host or owner sent a heartbeat or another
+    process recovered it since it was read. Returns whether it did.
+    """
+    query = {"job_id": job["job_id"], "host": job["host"], "status": {"$in": ["queued", "running"]}, **stale_jobs_query(stale_before)}
+    fields["updated_at"] = time.time()
+    return jobs_collection.update_one(query, {"$set": fields}).matched_count > 0
+
+def fail_ingesting_documents(document_name: str):
+    # Left "ingesting" by a job that will never finish, their chunks are kept to resume from
+    documents_collection.update_many(
+        {"document_name": document_name, "status": "ingesting"},
+        {"$set": {"status": "failed", "updated_at": time.time()}}
+    )
+
+def get_batch_ingestion_jobs(batch_id: str) -> list:
+    return list(jobs_collection.find({"batch_id": batch_id}, {"_id": 0}).sort("created_at", 1))
+
+def check_if_ingestion_job_pending(document_name: str) -> bool:
+    result = jobs_collection.find_one({"document_name": document_name, "status": {"$in": ["queued", "running"]}})
+    return result is not None
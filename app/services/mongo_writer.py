@@ -0,0 +1,131 @@
+import asyncio
+import time
+from functools import partial
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from app.services.logs import get_logger
+from app.services.metrics import MONGO_DOCUMENTS_WRITTEN, MONGO_WRITE_FAILURES
+from app.services.tracing import record_stage
+
+logger = get_logger(__name__)
+
+
+class BulkWriteFailed(Exception):
+    def __init__(self, failures):
+        self.failures = failures
+        sample = "; ".join(f"{failure['id']}: {failure['error']}" for failure in failures[:5])
+        super().__init__(f"{len(failures)} items failed to write to MongoDB ({sample})")
+
+
+class BulkWriter:
+    """
+    Buffers documents and writes them with unordered `insert_many` on a worker thread,
+    so the event loop never waits on MongoDB round trips.
+
+    A batch is flushed when it reaches `batch_size` documents or `flush_interval_ms` after
+    its first document was added. At most `max_pending_batches` writes are in flight; `add`
+    waits for a free slot, which keeps producers from outrunning the database. Failed
+    documents are collected per batch and raised from `close`. `on_written`, when given, is
+    called on the worker thread with the documents of each batch that were inserted.
+    `to_document` turns an item into the document to insert, `item.dict()` by default.
+
+    With `upsert_key`, documents replace the stored document with the same value for that
+    field instead of being inserted, so writing the same batch twice is harmless.
+    """
+
+    def __init__(self, collection, executor, batch_size=500, flush_interval_ms=200.0, max_pending_batches=4, on_written=None, to_document=None, upsert_key=None):
+        self.collection = collection
+        self.upsert_key = upsert_key
+        self.executor = executor
+        self.on_written = on_written
+        self.to_document = to_document or (lambda item: item.dict())
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.slots = asyncio.Semaphore(max_pending_batches)
+        self.buffer = []
+        self.pending = set()
+        self.flush_handle = None
+        self.inserted_count = 0
+        self.batch_count = 0
+        self.failures = []
+
+    async def add(self, item):
+        self.buffer.append(self.to_document(item))
+        if len(self.buffer) >= self.batch_size:
+            await self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.flush_interval, self._timed_flush)
+
+    def _timed_flush(self):
+        self.flush_handle = None
+        task = asyncio.ensure_future(self.flush())
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.buffer:
+            return
+
+        batch, self.buffer = self.buffer, []
+        await self.slots.acquire()
+        task = asyncio.ensure_future(self._write(batch))
+        self.pending.add(task)
+        task.add_done_callback(self.pending.discard)
+
+    async def _write(self, batch):
+        loop = asyncio.get_running_loop()
+        batch_number = self.batch_count = self.batch_count + 1
+        written = []
+        failures_before = len(self.failures)
+        start = time.perf_counter()
+        try:
+            if self.upsert_key is None:
+                result = await loop.run_in_executor(self.executor, partial(self.collection.insert_many, batch, ordered=False))
+                self.inserted_count += len(result.inserted_ids)
+            else:
+                requests = [ReplaceOne({self.upsert_key: document[self.upsert_key]}, document, upsert=True) for document in batch]
+                result = await loop.run_in_executor(self.executor, partial(self.collection.bulk_write, requests, ordered=False))
+                self.inserted_count += result.upserted_count + result.matched_count
+            written = batch
+        except BulkWriteError as e:
+            # Unordered writes keep going past errors; writeErrors index into this batch
+            self.inserted_count += e.details.get("nInserted", 0) + e.details.get("nUpserted", 0) + e.details.get("nMatched", 0)
+            failed = set()
+            for error in e.details.get("writeErrors", []):
+                failed.add(error["index"])
+                self.failures.append({"id": batch[error["index"]].get("id"), "batch": batch_number, "error": error.get("errmsg")})
+            written = [document for index, document in enumerate(batch) if index not in failed]
+        except Exception as e:
+            self.failures.extend({"id": document.get("id"), "batch": batch_number, "error": str(e)} for document in batch)
+        finally:
+            self.slots.release()
+            record_stage("mongo_write", time.perf_counter() - start, documents=len(batch))
+        MONGO_DOCUMENTS_WRITTEN.inc(len(written))
+        MONGO_WRITE_FAILURES.inc(len(self.failures) - failures_before)
+
+        if written and self.on_written is not None:
+            try:
+                await loop.run_in_executor(self.executor, self.on_written, written)
+            except Exception as e:
+                logger.error("Error in write callback for batch %d: %s", batch_number, e)
+
+    async def close(self):
+        await self.flush()
+        while self.pending:
+            await asyncio.gather(*list(self.pending))
+        if self.failures:
+            raise BulkWriteFailed(self.failures)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            await self.close()
+        except BulkWriteFailed:
+            # Don't mask the error that aborted the ingestion
+            if exc_type is None:
+                raise
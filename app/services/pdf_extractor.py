@@ -0,0 +1,83 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from app.config import PDF_EXTRACTION_PROCESSES, PDF_MIN_PAGES_PER_SHARD
+
+process_pool = None
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    # Created on first use so importing the app doesn't start workers. They are started by a
+    # forkserver (spawned where it isn't available): forking this process, which already runs
+    # the Mongo, logging and to_thread threads, could copy a lock held by one of them.
+    global process_pool
+    if process_pool is None:
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        process_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACTION_PROCESSES, mp_context=multiprocessing.get_context(start_method))
+    return process_pool
+
+
+def shutdown_process_pool():
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(cancel_futures=True)
+        process_pool = None
+
+
+def open_pdf(source):
+    # `source` is a file path or the raw PDF bytes
+    import PyPDF2  # Only needed once a PDF is ingested, keeps it out of app startup
+    if isinstance(source, (bytes, bytearray)):
+        return PyPDF2.PdfReader(io.BytesIO(source))
+    return PyPDF2.PdfReader(source)
+
+
+def count_pages(source) -> int:
+    return len(open_pdf(source).pages)
+
+
+def extract_page_range(source, start: int, end: int) -> List[str]:
+    """
+    Extracts the text of pages [start, end). Runs in a worker process.
+    """
+    reader = open_pdf(source)
+    return [reader.pages[page_num].extract_text() or "" for page_num in range(start, end)]
+
+
+def get_page_ranges(total_pages: int, shards: int, min_pages_per_shard: int):
+    pages_per_shard = max(min_pages_per_shard, -(-total_pages // max(shards, 1)))
+    return [(start, min(start + pages_per_shard, total_pages)) for start in range(0, total_pages, pages_per_shard)]
+
+
+def get_pdf_source(file_stream):
+    # Workers reopen the PDF themselves: from its path when it is on disk, else from its bytes
+    path = getattr(file_stream, "name", None)
+    if isinstance(path, str) and os.path.isfile(path):
+        return path
+    file_stream.seek(0)
+    return file_stream.read()
+
+
+async def extract_pdf_pages(file_stream) -> List[str]:
+    """
+    Returns the text of every page, extracting each page exactly once. Documents that fit
+    in a single shard are extracted on a thread, larger ones are split into page ranges
+    that are parsed in parallel in the process pool.
+    """
+    loop = asyncio.get_running_loop()
+    source = await asyncio.to_thread(get_pdf_source, file_stream)
+    total_pages = await asyncio.to_thread(count_pages, source)
+
+    page_ranges = get_page_ranges(total_pages, PDF_EXTRACTION_PROCESSES, PDF_MIN_PAGES_PER_SHARD)
+    if len(page_ranges) <= 1:
+        return await asyncio.to_thread(extract_page_range, source, 0, total_pages)
+
+    pool = get_process_pool()
+    shards = await asyncio.gather(*[
+        loop.run_in_executor(pool, extract_page_range, source, start, end)
+        for start, end in page_ranges
+    ])
+    return [text for shard in shards for text in shard]
@@ -1,87 +1,213 @@
-import PyPDF2
+import re
 from uuid import uuid4
 import asyncio
-from app.services.mongo_helpers import upload_item_to_mongodb
+from app.services.mongo_helpers import create_bulk_writer
+from app.services.chunk_delta import ChunkDelta
 from app.models.vectorStoreItem import VectorStoreItem
 from app.services.ai_helpers import get_contextual_chunk, get_embeddings
-
-async def process_pdf(file_stream, document_name=""):
-    print(f"Processing document: {document_name}")
+from app.services.pdf_extractor import extract_pdf_pages
+from app.services.tokenizer import count_tokens, take_first_tokens, take_last_tokens
+from app.services.logs import get_logger
+from app.services.tracing import stage_timer
+from app.config import PDF_CHUNK_MAX_TOKENS, PDF_CHUNK_OVERLAP_TOKENS, PDF_CONTEXT_MAX_TOKENS, CONTEXT_BATCHING_ENABLED
+
+# Sentence ends and blank lines, chunks are only cut at these
+BOUNDARY_PATTERN = re.compile(r"(?<=[.!?])[\"')\]]*\s+|\n\s*\n")
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+
+logger = get_logger(__name__)
+
+async def process_pdf(file_stream, document_name="", progress=None, document_id=None, delta=None):
+    """
+    Chunks, contextualizes and embeds every page. A chunk's position is its page and its
+    number on that page; chunks that `delta` reports as stored are skipped. Returns the number
+    of chunks stored for the document.
+    """
+    logger.info("Processing document: %s", document_name)
+    if progress is None:
+        progress = {"completed": 0, "total": 0}
+    progress.setdefault("prompt_tokens", 0)
     try:
-        reader = PyPDF2.PdfReader(file_stream)
-        print("PDF successfully read.")
-        
-        document_id = uuid4()
-        print(f"Generated document ID: {document_id}")
-        
-        total_pages = len(reader.pages)
-        print(f"Total pages in document: {total_pages}")
+        # Every page is extracted once, the context windows below reuse this list
+        with stage_timer("parse"):
+            page_texts = await extract_pdf_pages(file_stream)
+
+        document_id = str(document_id or uuid4())
+        delta = delta or ChunkDelta({}, document_id)
+
+        total_pages = len(page_texts)
+        logger.info("PDF successfully read, %d pages.", total_pages, extra={"document_id": document_id})
+
+        # Splitting pages into chunks counts towards parsing
+        pages = []
+        with stage_timer("parse"):
+            for page_num in range(total_pages):
+                text = page_texts[page_num]
+                if not text:
+                    logger.debug("No text found on page %d. Skipping.", page_num + 1)
+                    continue
+
+                spans = split_into_chunk_spans(text)
+                chunks = [text[start:end] for start, end in spans]
+                logger.debug("Page %d/%d split into %d chunks.", page_num + 1, total_pages, len(chunks))
+                progress["total"] += len(chunks)
+                pages.append((page_num, spans, chunks))
+
+        if delta.by_content:
+            delta.plan(((page_num, chunk_num), chunk) for page_num, _, chunks in pages for chunk_num, chunk in enumerate(chunks))
 
         tasks = []
-
-        for page_num in range(total_pages):
-            print(f"Processing page: {page_num + 1}/{total_pages}")
-            page = reader.pages[page_num]
-            
-            text = page.extract_text()
-            if not text:
-                print(f"No text found on page {page_num + 1}. Skipping.")
+        skipped_count = 0
+
+        for page_num, spans, chunks in pages:
+            pending = [chunk_num for chunk_num in range(len(chunks)) if not delta.is_stored((page_num, chunk_num), str(page_num))]
+            skipped_count += len(chunks) - len(pending)
+            progress["completed"] += len(chunks) - len(pending)
+            if not pending:
+                logger.debug("Page %d is already stored. Skipping.", page_num + 1)
                 continue
 
-            print(f"Text extracted from page {page_num + 1}: {text[:100]}...")
-
-            chunks = split_into_chunks(text)
-            print(f"Text split into {len(chunks)} chunks.")
-
-            context = get_page_context(reader, page_num)
-            print(f"Context for page {page_num + 1} obtained.")
-
-            contextual_chunks_task = asyncio.gather(*[get_contextual_chunk(context=context, chunk=chunk) for chunk in chunks])
+            chunk_ids = [delta.chunk_id((page_num, chunk_num)) for chunk_num in pending]
+            chunks = [chunks[chunk_num] for chunk_num in pending]
+            with stage_timer("context"):
+                if CONTEXT_BATCHING_ENABLED and len(pending) > 1:
+                    # Chunks of the page share one context so they are contextualized in a single batch
+                    contexts = [get_page_context(page_texts, page_num)] * len(pending)
+                else:
+                    # Each chunk gets its own context window, trimmed to the token budget around it
+                    contexts = [get_page_context(page_texts, page_num, *spans[chunk_num]) for chunk_num in pending]
+
+            contextual_chunks_task = asyncio.gather(*[get_contextual_chunk(context=context, chunk=chunk, usage=progress) for context, chunk in zip(contexts, chunks)])
             embeddings_task = asyncio.gather(*[get_embeddings(chunk=chunk) for chunk in chunks])
 
-            tasks.append((contextual_chunks_task, embeddings_task, page_num, chunks, document_id, document_name))
-
-        for contextual_chunks_task, embeddings_task, page_num, chunks, document_id, document_name in tasks:
-            print(f"Awaiting contextual chunks and embeddings for page {page_num + 1}.")
-            contextual_chunks = await contextual_chunks_task
-            embeddings = await embeddings_task
-
-            print(f"Contextual chunks received for page {page_num + 1}.")
-            print(f"Embeddings received for page {page_num + 1}.")
-
-            vector_store_items = [
-                VectorStoreItem(
-                    id=str(uuid4()),
-                    original_text=chunk,
-                    contextual_text=contextual_chunk,
-                    document_id=str(document_id),
-                    page_number=str(page_num),
-                    vector_embeddings=embedding,
-                    document_name=document_name
-                )
-                for chunk, contextual_chunk, embedding in zip(chunks, contextual_chunks, embeddings)
-            ]
-
-            print(f"Generated {len(vector_store_items)} vector store items for page {page_num + 1}. Uploading to MongoDB.")
-
-            for item in vector_store_items:
-                await upload_item_to_mongodb(item)
-                print(f"Uploaded item {item.id} to MongoDB.")
+            tasks.append((contextual_chunks_task, embeddings_task, page_num, chunks, chunk_ids))
+
+        async with create_bulk_writer() as writer:
+            for contextual_chunks_task, embeddings_task, page_num, chunks, chunk_ids in tasks:
+                contextual_chunks = await contextual_chunks_task
+                embeddings = await embeddings_task
+
+                vector_store_items = [
+                    VectorStoreItem(
+                        id=chunk_id,
+                        original_text=chunk,
+                        contextual_text=contextual_chunk,
+                        document_id=document_id,
+                        page_number=str(page_num),
+                        vector_embeddings=embedding,
+                        document_name=document_name
+                    )
+                    for chunk_id, chunk, contextual_chunk, embedding in zip(chunk_ids, chunks, contextual_chunks, embeddings)
+                ]
+
+                logger.debug("Queued %d vector store items for page %d.", len(vector_store_items), page_num + 1)
+
+                for item in vector_store_items:
+                    await writer.add(item)
+                progress["completed"] += len(vector_store_items)
+
+        logger.info(
+            "Uploaded %d items to MongoDB in %d batches.", writer.inserted_count, writer.batch_count,
+            extra={"document_name": document_name, "skipped": skipped_count, "prompt_tokens": progress["prompt_tokens"]}
+        )
+        return writer.inserted_count + skipped_count
 
     except Exception as e:
-        print(f"Error processing PDF: {str(e)}")
+        logger.error("Error processing PDF: %s", e)
         raise Exception(f"Error processing PDF: {str(e)}")
 
-def split_into_chunks(text, chunk_size=5000):
-    print(f"Splitting text into chunks of size {chunk_size}.")
-    chunks = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
-    print(f"Generated {len(chunks)} chunks.")
-    return chunks
-
-def get_page_context(reader, page_num, window=2):
-    print(f"Generating context for page {page_num} with window size {window}.")
+def get_text_units(text):
+    """
+    Splits text into (start, end, ends_paragraph) spans that each end at a sentence or paragraph boundary.
+    """
+    units = []
+    start = 0
+    for match in BOUNDARY_PATTERN.finditer(text):
+        if match.end() > start:
+            units.append((start, match.end(), PARAGRAPH_PATTERN.search(match.group()) is not None))
+            start = match.end()
+    if start < len(text):
+        units.append((start, len(text), True))
+    return units
+
+
+def split_long_unit(text, start, end, max_tokens):
+    # A single sentence over the budget is cut into equal pieces of about max_tokens each
+    tokens = count_tokens(text[start:end])
+    pieces = -(-tokens // max_tokens)
+    piece_chars = -(-(end - start) // pieces)
+    return [(piece_start, min(piece_start + piece_chars, end), False) for piece_start in range(start, end, piece_chars)]
+
+
+def split_into_chunk_spans(text, max_tokens=PDF_CHUNK_MAX_TOKENS, overlap_tokens=PDF_CHUNK_OVERLAP_TOKENS):
+    """
+    Packs sentences into chunks of at most `max_tokens` tokens and returns their (start, end)
+    character spans. A chunk that overflows is cut at its last paragraph break if that keeps at
+    least half of it, and each chunk repeats up to `overlap_tokens` tokens of trailing sentences
+    from the previous one.
+    """
+    units = []
+    for start, end, ends_paragraph in get_text_units(text):
+        if count_tokens(text[start:end]) > max_tokens:
+            units.extend(split_long_unit(text, start, end, max_tokens))
+        else:
+            units.append((start, end, ends_paragraph))
+    unit_tokens = [count_tokens(text[start:end]) for start, end, _ in units]
+
+    spans = []
+    first = 0
+    while first < len(units):
+        last = first
+        tokens = unit_tokens[first]
+        while last + 1 < len(units) and tokens + unit_tokens[last + 1] <= max_tokens:
+            last += 1
+            tokens += unit_tokens[last]
+
+        if last + 1 < len(units):
+            # Prefer ending on a paragraph break in the second half of the chunk
+            paragraph_ends = [i for i in range(first, last) if units[i][2] and sum(unit_tokens[first:i + 1]) >= max_tokens // 2]
+            if paragraph_ends:
+                last = paragraph_ends[-1]
+
+        spans.append((units[first][0], units[last][1]))
+        if last + 1 >= len(units):
+            break
+
+        # Step back over trailing sentences for the overlap, always moving forward by at least one
+        next_first = last + 1
+        overlap = 0
+        while next_first - 1 > first and overlap + unit_tokens[next_first - 1] <= overlap_tokens:
+            next_first -= 1
+            overlap += unit_tokens[next_first]
+        first = next_first
+
+    return spans
+
+
+def split_into_chunks(text, max_tokens=PDF_CHUNK_MAX_TOKENS, overlap_tokens=PDF_CHUNK_OVERLAP_TOKENS):
+    return [text[start:end] for start, end in split_into_chunk_spans(text, max_tokens, overlap_tokens)]
+
+
+def get_page_context(page_texts, page_num, chunk_start=0, chunk_end=None, window=2, max_tokens=PDF_CONTEXT_MAX_TOKENS):
+    """
+    Builds the context for the chunk at [chunk_start, chunk_end) of page `page_num` from the
+    pages within `window` of it, trimmed to `max_tokens` tokens centered on the chunk.
+    """
+    page_text = page_texts[page_num]
+    if chunk_end is None:
+        chunk_end = len(page_text)
     start = max(0, page_num - window)
-    end = min(len(reader.pages), page_num + window + 1)
-    context = "".join(reader.pages[i].extract_text() for i in range(start, end))
-    print(f"Context for page {page_num} generated.")
-    return context
+    end = min(len(page_texts), page_num + window + 1)
+
+    before = "".join(page_texts[start:page_num]) + page_text[:chunk_start]
+    chunk = page_text[chunk_start:chunk_end]
+    after = page_text[chunk_end:] + "".join(page_texts[page_num + 1:end])
+
+    # The chunk itself is always kept, the rest of the budget is split evenly around it
+    remaining = max(0, max_tokens - count_tokens(chunk))
+    before_tokens = count_tokens(before)
+    after_tokens = count_tokens(after)
+    take_before = min(before_tokens, max(remaining // 2, remaining - after_tokens))
+    take_after = min(after_tokens, remaining - take_before)
+
+    return take_last_tokens(before, take_before) + chunk + take_first_tokens(after, take_after)
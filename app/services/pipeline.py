@@ -0,0 +1,59 @@
+import asyncio
+
+DONE = object()
+
+
+async def iterate_in_thread(iterator):
+    """
+    Async wrapper around a blocking iterator, each `next` runs on a worker thread. Once
+    exhausted, closed with `aclose` or cancelled, it waits for a `next` still running on its
+    thread and closes `iterator`, so a generator's cleanup runs before the caller closes
+    the file it reads rather than whenever it is collected.
+    """
+    pending = None
+    try:
+        while True:
+            # Shielded, the thread can't be interrupted and is waited for below
+            pending = asyncio.ensure_future(asyncio.to_thread(next, iterator, DONE))
+            item = await asyncio.shield(pending)
+            if item is DONE:
+                return
+            yield item
+    finally:
+        if pending is not None and not pending.done():
+            await asyncio.gather(pending, return_exceptions=True)
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+async def run_bounded_pipeline(source, handle, workers: int, queue_size: int):
+    """
+    Feeds the items of the async iterable `source` to `workers` concurrent `handle` calls
+    through a queue of at most `queue_size` items. The producer waits while the queue is
+    full, so memory and in-flight work stay constant however long `source` is. The first
+    error cancels the rest of the pipeline and is re-raised.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+
+    async def produce():
+        async for item in source:
+            await queue.put(item)
+        for _ in range(workers):
+            await queue.put(DONE)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is DONE:
+                return
+            await handle(item)
+
+    tasks = [asyncio.create_task(produce())] + [asyncio.create_task(consume()) for _ in range(workers)]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
@@ -0,0 +1,86 @@
+import asyncio
+import random
+import time
+from app.services.logs import get_logger
+from app.services.metrics import OPENAI_REQUESTS, OPENAI_RETRIES
+
+logger = get_logger(__name__)
+
+
+class TokenBucket:
+    """
+    Refills `capacity_per_minute` units evenly over a minute. Waiters are served in order.
+    """
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        # A single request larger than the bucket would never fit, let it drain the bucket instead
+        amount = min(float(amount), self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """
+    Shared gate for calls to a rate-limited API: caps in-flight requests, spends
+    requests/tokens per minute from token buckets and retries transient failures
+    with exponential backoff plus jitter.
+    """
+
+    def __init__(self, name, max_concurrency, requests_per_minute, tokens_per_minute,
+                 is_retryable, get_retry_after=None, max_retries=6, base_delay=0.5, max_delay=30.0):
+        self.name = name
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.is_retryable = is_retryable
+        self.get_retry_after = get_retry_after
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def retry_delay(self, error, attempt: int) -> float:
+        retry_after = self.get_retry_after(error) if self.get_retry_after else None
+        if retry_after is not None:
+            return min(self.max_delay, retry_after) + random.uniform(0, self.base_delay)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def run(self, request_fn, estimated_tokens: int = 1):
+        """
+        Awaits `request_fn()` once capacity is available, retrying it on retryable errors.
+        """
+        attempt = 0
+        while True:
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(estimated_tokens)
+            async with self.semaphore:
+                try:
+                    result = await request_fn()
+                    OPENAI_REQUESTS.inc(api=self.name, outcome="success")
+                    return result
+                except Exception as e:
+                    OPENAI_REQUESTS.inc(api=self.name, outcome="error")
+                    if attempt >= self.max_retries or not self.is_retryable(e):
+                        raise
+                    delay = self.retry_delay(e, attempt)
+            attempt += 1
+            OPENAI_RETRIES.inc(api=self.name)
+            logger.warning("%s: retrying after error (%d/%d) in %.2fs", self.name, attempt, self.max_retries, delay, extra={"api": self.name, "attempt": attempt, "delay": round(delay, 3)})
+            await asyncio.sleep(delay)
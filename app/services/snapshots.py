@@ -0,0 +1,247 @@
+"""
+Columnar snapshots of the vector store, to seed another deployment or restore one without
+contextualizing and embedding the documents again.
+
+A snapshot is a directory holding:
+    items.parquet or items.arrow  the id, document and text fields of every item, as strings
+    embeddings.f32                the embeddings as one little-endian float32 matrix, row i
+                                  belonging to row i of the items file
+    manifest.json                 the item count, dimensions, embedding checksum and the
+                                  document manifests, written last so a snapshot without it
+                                  is incomplete
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from app.services.mongo_helpers import (
+    iter_vector_store_items, replace_vector_store_items, get_document_manifests_with_name_or_id, replace_document_manifests,
+    record_index_change,
+)
+from app.services.embedding_codec import encode_embedding_fields
+from app.services.vector_index import vector_index
+from app.services.logs import get_logger
+from app.config import SNAPSHOTS_DIR, SNAPSHOT_FORMAT, SNAPSHOT_BATCH_SIZE, EMBEDDING_STORAGE_FORMAT
+
+logger = get_logger(__name__)
+
+SNAPSHOT_FORMATS = ["parquet", "arrow"]
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EMBEDDINGS_FILE = "embeddings.f32"
+ITEM_COLUMNS = ["id", "document_id", "document_name", "page_number", "original_text", "contextual_text"]
+
+# The export or import running or last run for each snapshot id, reported by /api/snapshots
+snapshot_operations = {}
+snapshot_tasks = set()
+
+
+def items_file_name(snapshot_format: str) -> str:
+    if snapshot_format not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unknown snapshot format '{snapshot_format}', expected one of {', '.join(SNAPSHOT_FORMATS)}")
+    return f"items.{snapshot_format}"
+
+
+def open_items_writer(path: str, snapshot_format: str):
+    # pyarrow is only needed by snapshots, it isn't imported with the app
+    import pyarrow as pa
+    schema = pa.schema([(column, pa.string()) for column in ITEM_COLUMNS])
+    if snapshot_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(path, schema, compression="zstd"), schema
+    return pa.ipc.new_file(path, schema), schema
+
+
+def iter_item_batches(path: str, snapshot_format: str, batch_size: int):
+    import pyarrow as pa
+    if snapshot_format == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=ITEM_COLUMNS):
+            yield batch.to_pylist()
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index).to_pylist()
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 ** 2), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_snapshot(directory: str, input_str: str = None, snapshot_format: str = SNAPSHOT_FORMAT, batch_size: int = SNAPSHOT_BATCH_SIZE, progress: dict = None) -> dict:
+    """
+    Writes every item, or the items of one document_name or document_id, to a snapshot in
+    `directory`, reading and writing `batch_size` items at a time. Returns the manifest.
+    """
+    items_file = items_file_name(snapshot_format)
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        raise ValueError(f"{directory} already holds a snapshot")
+    if progress is None:
+        progress = {"completed": 0}
+
+    import pyarrow as pa
+    started = time.time()
+    writer, schema = open_items_writer(os.path.join(directory, items_file), snapshot_format)
+    digest = hashlib.sha256()
+    dimensions = None
+    try:
+        with open(os.path.join(directory, EMBEDDINGS_FILE), "wb") as embeddings_file:
+            for items in iter_vector_store_items(input_str, batch_size):
+                vectors = np.stack([item["vector_embeddings"] for item in items]).astype("<f4", copy=False)
+                if dimensions is None:
+                    dimensions = vectors.shape[1]
+                elif vectors.shape[1] != dimensions:
+                    raise ValueError(f"Items have embeddings of {vectors.shape[1]} and {dimensions} dimensions")
+
+                columns = {column: [None if item.get(column) is None else str(item[column]) for item in items] for column in ITEM_COLUMNS}
+                writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+                data = vectors.tobytes()
+                embeddings_file.write(data)
+                digest.update(data)
+                progress["completed"] += len(items)
+    finally:
+        writer.close()
+
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": started,
+        "input_str": input_str,
+        "format": snapshot_format,
+        "items_file": items_file,
+        "embeddings_file": EMBEDDINGS_FILE,
+        "count": progress["completed"],
+        "dimensions": dimensions or 0,
+        "embeddings_sha256": digest.hexdigest(),
+        "documents": get_document_manifests_with_name_or_id(input_str),
+    }
+    # Written under another name and renamed, the manifest only appears once the snapshot is complete
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, default=str)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+    logger.info("Exported %d items to snapshot %s in %.1fs.", manifest["count"], directory, time.time() - started, extra={"format": snapshot_format})
+    return manifest
+
+
+def read_snapshot_manifest(directory: str):
+    path = os.path.join(directory, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def import_snapshot(directory: str, batch_size: int = SNAPSHOT_BATCH_SIZE, progress: dict = None) -> int:
+    """
+    Loads a snapshot into the vector store in unordered bulk writes of `batch_size` items,
+    stored in EMBEDDING_STORAGE_FORMAT, and restores its document manifests. Items are
+    upserted by id, so an interrupted import can be run again; stored items that aren't in
+    the snapshot are kept. Returns the number of items written.
+    """
+    manifest = read_snapshot_manifest(directory)
+    if manifest is None:
+        raise ValueError(f"{directory} doesn't hold a complete snapshot")
+    if manifest["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"Snapshot version {manifest['version']} isn't supported, expected {SNAPSHOT_VERSION}")
+
+    count, dimensions = manifest["count"], manifest["dimensions"]
+    embeddings_path = os.path.join(directory, manifest["embeddings_file"])
+    if os.path.getsize(embeddings_path) != count * dimensions * 4:
+        raise ValueError(f"{manifest['embeddings_file']} doesn't hold {count} embeddings of {dimensions} dimensions")
+    if hash_file(embeddings_path) != manifest["embeddings_sha256"]:
+        raise ValueError(f"{manifest['embeddings_file']} doesn't match the snapshot's checksum")
+    if progress is None:
+        progress = {"completed": 0}
+    progress["total"] = count
+
+    started = time.time()
+    written = 0
+    offset = 0
+    if count:
+        embeddings = np.memmap(embeddings_path, dtype="<f4", mode="r", shape=(count, dimensions))
+        items_path = os.path.join(directory, manifest["items_file"])
+        for items in iter_item_batches(items_path, manifest["format"], batch_size):
+            if offset + len(items) > count:
+                raise ValueError(f"{manifest['items_file']} holds more than {count} items")
+            vectors = np.array(embeddings[offset:offset + len(items)])
+            documents = [dict(item, **encode_embedding_fields(vector, EMBEDDING_STORAGE_FORMAT)) for item, vector in zip(items, vectors)]
+            written += replace_vector_store_items(documents)
+            vector_index.add_items([dict(item, vector_embeddings=vector) for item, vector in zip(items, vectors)])
+            record_index_change(ids=[item["id"] for item in items])
+            offset += len(items)
+            progress["completed"] = offset
+        del embeddings
+    if offset != count:
+        raise ValueError(f"{manifest['items_file']} holds {offset} items, expected {count}")
+
+    replace_document_manifests(manifest["documents"])
+    logger.info("Imported %d items from snapshot %s in %.1fs.", written, directory, time.time() - started, extra={"storage_format": EMBEDDING_STORAGE_FORMAT})
+    return written
+
+
+def snapshot_path(snapshot_id: str) -> str:
+    # Snapshot ids name directories of SNAPSHOTS_DIR and nothing else
+    if not snapshot_id or os.path.basename(snapshot_id) != snapshot_id or snapshot_id in (".", ".."):
+        raise ValueError(f"Invalid snapshot id '{snapshot_id}'")
+    return os.path.join(SNAPSHOTS_DIR, snapshot_id)
+
+
+def is_snapshot_busy(snapshot_id: str) -> bool:
+    operation = snapshot_operations.get(snapshot_id)
+    return operation is not None and operation["status"] == "running"
+
+
+def start_snapshot_operation(snapshot_id: str, operation: str, fn, *args):
+    """
+    Runs `fn(*args, progress=...)` in a thread in the background and records its progress
+    and outcome under `snapshot_id`.
+    """
+    status = snapshot_operations[snapshot_id] = {
+        "operation": operation, "status": "running", "progress": {"completed": 0}, "started_at": time.time()
+    }
+
+    async def run():
+        try:
+            status["result"] = await asyncio.to_thread(fn, *args, progress=status["progress"])
+            status["status"] = "completed"
+        except Exception as e:
+            logger.error("Snapshot %s %s failed: %s", snapshot_id, operation, e)
+            status["status"] = "failed"
+            status["error"] = str(e)
+        finally:
+            status["finished_at"] = time.time()
+
+    task = asyncio.create_task(run())
+    snapshot_tasks.add(task)
+    task.add_done_callback(snapshot_tasks.discard)
+
+
+def get_snapshot_status(snapshot_id: str):
+    manifest = read_snapshot_manifest(snapshot_path(snapshot_id))
+    operation = snapshot_operations.get(snapshot_id)
+    if manifest is None and operation is None:
+        return None
+    status = {"snapshot_id": snapshot_id, "complete": manifest is not None}
+    if manifest is not None:
+        status.update({key: value for key, value in manifest.items() if key != "documents"})
+        status["document_count"] = len(manifest["documents"])
+    if operation is not None:
+        status["last_operation"] = {key: value for key, value in operation.items() if key != "result"}
+    return status
+
+
+def list_snapshots() -> list:
+    if not os.path.isdir(SNAPSHOTS_DIR):
+        return []
+    snapshot_ids = set(snapshot_operations) | {name for name in os.listdir(SNAPSHOTS_DIR) if os.path.isdir(os.path.join(SNAPSHOTS_DIR, name))}
+    statuses = [get_snapshot_status(snapshot_id) for snapshot_id in snapshot_ids]
+    return sorted((status for status in statuses if status), key=lambda status: status.get("created_at") or 0, reverse=True)
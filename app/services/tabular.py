@@ -0,0 +1,109 @@
+import asyncio
+from app.services.ai_helpers import get_contextual_chunk, get_embeddings
+from app.config import ROWS_PER_CHUNK
+
+GRANULARITIES = ("row", "chunk", "hybrid")
+
+
+def check_granularity(granularity: str, rows_per_chunk=None):
+    """
+    Validates `granularity` and returns the number of data rows per chunk to use with it.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}', expected one of {', '.join(GRANULARITIES)}")
+    return rows_per_chunk or ROWS_PER_CHUNK[granularity]
+
+
+def format_row(row) -> str:
+    return ", ".join(map(str, row))
+
+
+def format_chunk(header, rows) -> str:
+    return "\n".join(format_row(row) for row in [header] + rows)
+
+
+def get_tabular_item_texts(header, rows, granularity) -> list:
+    """
+    The original texts of the tuples `build_tabular_items` returns for a chunk of `rows`.
+    """
+    if granularity == "row":
+        return [str(row) for row in [header] + rows]
+    if granularity == "chunk":
+        return [format_chunk(header, rows)]
+    return [format_row(row) for row in rows]
+
+
+def render_column(column, formatter):
+    # Missing cells render as "nan", like the float NaN pandas reads them as
+    missing = column.isna()
+    rendered = column.astype(str) if formatter is str else column.map(formatter)
+    return rendered.where(~missing, "nan")
+
+
+def render_tabular_block(header, rows, granularity, rows_per_chunk) -> list:
+    """
+    `get_tabular_item_texts` for a block of consecutive chunks of `rows_per_chunk` rows, with
+    each column rendered at once instead of cell by cell. Returns (item_texts, chunk_text) per
+    chunk; chunk_text is the text contextualized for chunk and hybrid items, None for row items.
+    """
+    import pandas as pd  # Only XLSX ingestion renders blocks, keeps pandas out of app startup
+    frame = pd.DataFrame(rows, columns=range(len(header)), dtype=object)
+    if granularity == "row":
+        header_text = str(header)
+        columns = [render_column(frame[column], repr) for column in frame.columns]
+    else:
+        header_text = format_row(header)
+        columns = [render_column(frame[column], str) for column in frame.columns]
+    lines = columns[0].str.cat(columns[1:], sep=", ") if len(columns) > 1 else columns[0]
+    if granularity == "row":
+        lines = "[" + lines + "]"
+    lines = lines.tolist()
+
+    chunks = []
+    for start in range(0, len(lines), rows_per_chunk):
+        chunk_lines = lines[start:start + rows_per_chunk]
+        if granularity == "row":
+            chunks.append(([header_text] + chunk_lines, None))
+            continue
+        chunk_text = "\n".join([header_text] + chunk_lines)
+        chunks.append(([chunk_text] if granularity == "chunk" else chunk_lines, chunk_text))
+    return chunks
+
+
+async def build_tabular_items(context, header, rows, granularity, usage=None):
+    """
+    Contextualizes and embeds one chunk of a table.
+
+    Returns (original_text, contextual_text, embedding) tuples in row order:
+      row    - one per row, header included, with its own context and embedding
+      chunk  - a single tuple for the whole chunk
+      hybrid - one per data row, sharing a single context for the chunk
+    `usage` accumulates the prompt tokens of the contextualization calls.
+    """
+    chunk_text = None if granularity == "row" else format_chunk(header, rows)
+    return await build_tabular_items_from_texts(context, get_tabular_item_texts(header, rows, granularity), chunk_text, granularity, usage)
+
+
+async def build_tabular_items_from_texts(context, texts, chunk_text, granularity, usage=None):
+    """
+    `build_tabular_items` for a chunk already rendered to its item texts and chunk text.
+    """
+    if granularity == "row":
+        contextual_chunks, embeddings = await asyncio.gather(
+            asyncio.gather(*[get_contextual_chunk(context=context, chunk=text, usage=usage) for text in texts]),
+            asyncio.gather(*[get_embeddings(chunk=text) for text in texts])
+        )
+        return list(zip(texts, contextual_chunks, embeddings))
+
+    if granularity == "chunk":
+        contextual_chunk, embedding = await asyncio.gather(
+            get_contextual_chunk(context=context, chunk=chunk_text, usage=usage),
+            get_embeddings(chunk=chunk_text)
+        )
+        return [(chunk_text, contextual_chunk, embedding)]
+
+    contextual_chunk, embeddings = await asyncio.gather(
+        get_contextual_chunk(context=context, chunk=chunk_text, usage=usage),
+        asyncio.gather(*[get_embeddings(chunk=text) for text in texts])
+    )
+    return [(text, contextual_chunk, embedding) for text, embedding in zip(texts, embeddings)]
@@ -0,0 +1,64 @@
+import threading
+from app.config import TOKENIZER_ENCODING
+from app.services.logs import get_logger
+
+logger = get_logger(__name__)
+
+CHARS_PER_TOKEN = 4
+
+# Loaded on first use or by load_encoding when the app starts, tiktoken may download its
+# encoding file. None until then, and after falling back to CHARS_PER_TOKEN.
+encoding = None
+encoding_loaded = False
+encoding_lock = threading.Lock()
+
+
+def load_encoding():
+    global encoding, encoding_loaded
+    with encoding_lock:
+        if encoding_loaded:
+            return encoding
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            # Without tiktoken (or its encoding files) fall back to ~4 characters per token
+            logger.warning("Could not load the %s tokenizer, counting %d characters per token: %s", TOKENIZER_ENCODING, CHARS_PER_TOKEN, e)
+            encoding = None
+        encoding_loaded = True
+        return encoding
+
+
+def get_tokenizer_name() -> str:
+    """
+    Names the tokenizer actually in use, chunks cut with the fallback differ from tiktoken's.
+    """
+    return TOKENIZER_ENCODING if load_encoding() is not None else f"chars{CHARS_PER_TOKEN}"
+
+
+def count_tokens(text: str) -> int:
+    text = str(text)
+    encoding = load_encoding()
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def take_first_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = load_encoding()
+    if encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[:max_tokens])
+
+
+def take_last_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    encoding = load_encoding()
+    if encoding is None:
+        return text[-max_tokens * CHARS_PER_TOKEN:]
+    tokens = encoding.encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else encoding.decode(tokens[-max_tokens:])
@@ -0,0 +1,65 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from app.services.metrics import STAGE_SECONDS
+from app.config import TRACE_MAX_SPANS
+
+# The trace of the upload being processed, tasks created while it is set inherit it
+current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    """
+    Stage timings of one upload. Every span adds to the per-stage totals, the first
+    `max_spans` are also kept individually with their start offset.
+    """
+
+    def __init__(self, trace_id: str, max_spans: int = TRACE_MAX_SPANS):
+        self.trace_id = trace_id
+        self.max_spans = max_spans
+        self.started_at = time.time()
+        self.spans = []
+        self.dropped_spans = 0
+        self.stages = {}  # stage -> {"count", "seconds"}
+        self.lock = threading.Lock()  # Parsing records from worker threads
+
+    def record(self, stage: str, started_at: float, duration: float, attributes: dict):
+        with self.lock:
+            totals = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+            totals["count"] += 1
+            totals["seconds"] += duration
+            if len(self.spans) < self.max_spans:
+                self.spans.append({"stage": stage, "offset": started_at - self.started_at, "duration": duration, **attributes})
+            else:
+                self.dropped_spans += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "duration": time.time() - self.started_at,
+            "stages": self.stages,
+            "spans": self.spans,
+            "dropped_spans": self.dropped_spans,
+        }
+
+
+def record_stage(stage: str, duration: float, started_at: float = None, **attributes):
+    STAGE_SECONDS.observe(duration, stage=stage)
+    trace = current_trace.get()
+    if trace is not None:
+        trace.record(stage, started_at if started_at is not None else time.time() - duration, duration, attributes)
+
+
+@contextmanager
+def stage_timer(stage: str, **attributes):
+    """
+    Times the block into the stage histogram and, when an upload is traced, its trace.
+    Awaiting inside the block is fine, the wait counts towards the stage.
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start, started_at, **attributes)
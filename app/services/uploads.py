@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import zipfile
+from app.config import UPLOAD_MAX_BYTES, BATCH_UPLOAD_MAX_BYTES
+
+BLOCK_SIZE = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        super().__init__(f"Uploads are limited to {max_bytes} bytes")
+
+
+def spool_upload(source, file_path: str, max_bytes: int = UPLOAD_MAX_BYTES):
+    """
+    Copies an upload to `file_path` block by block, hashing it on the way, so the file is
+    never held in memory and never read a second time to be hashed. Returns its sha256 hex
+    digest and size. Stops as soon as the upload exceeds `max_bytes`, removing the partial
+    file, and raises UploadTooLarge.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_path, "wb") as destination:
+            for block in iter(lambda: source.read(BLOCK_SIZE), b""):
+                size += len(block)
+                if max_bytes and size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(block)
+                destination.write(block)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return digest.hexdigest(), size
+
+
+def spool_archive_member(archive: zipfile.ZipFile, member: zipfile.ZipInfo, file_path: str, max_bytes: int = UPLOAD_MAX_BYTES):
+    """
+    `spool_upload` for a file inside a zip archive. The declared size is checked first, the
+    limit still applies while decompressing since it can't be trusted.
+    """
+    if max_bytes and member.file_size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+    with archive.open(member) as source:
+        return spool_upload(source, file_path, max_bytes)
+
+
+def get_archive_members(archive: zipfile.ZipFile) -> list:
+    """
+    The files of a zip archive, skipping directories and the metadata files macOS adds.
+    """
+    return [
+        member for member in archive.infolist()
+        if not member.is_dir()
+        and not member.filename.startswith("__MACOSX/")
+        and not os.path.basename(member.filename).startswith(".")
+    ]
+
+
+def get_request_limit(path: str):
+    """
+    The most bytes a request to `path` may send, None when its body isn't limited here.
+    """
+    if path.startswith("/api/upload-batch"):
+        return BATCH_UPLOAD_MAX_BYTES
+    if path.startswith("/api/upload"):
+        return UPLOAD_MAX_BYTES
+    return None
+
+
+def exceeds_upload_limit(content_length, max_bytes: int = UPLOAD_MAX_BYTES) -> bool:
+    """
+    Whether a request's Content-Length, or the bytes of its body received so far, show its
+    file can't fit the limit. The body also holds multipart boundaries and form fields, so a
+    small allowance is made for them.
+    """
+    if not max_bytes or content_length is None:
+        return False
+    try:
+        return int(content_length) > max_bytes + BLOCK_SIZE
+    except ValueError:
+        return False
+
+
+async def send_upload_too_large(send, max_bytes: int):
+    body = json.dumps({"detail": str(UploadTooLarge(max_bytes))}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class UploadLimitMiddleware:
+    """
+    ASGI middleware rejecting upload requests over their `get_request_limit` with 413.
+
+    A Content-Length over the limit is rejected before the body is read. The form parser
+    doesn't limit the size of file parts, so a body sent without one (chunked) is counted
+    as the app receives it, and the request is aborted once it passes the limit, before
+    the parser has written more than that to disk. Whatever the app answers to the aborted
+    request is replaced by the 413.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = get_request_limit(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if not max_bytes:
+            await self.app(scope, receive, send)
+            return
+        if exceeds_upload_limit(dict(scope["headers"]).get(b"content-length"), max_bytes):
+            await send_upload_too_large(send, max_bytes)
+            return
+
+        state = {"received": 0, "exceeded": False, "response_started": False}
+
+        async def limited_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if exceeds_upload_limit(state["received"], max_bytes):
+                    state["exceeded"] = True
+                    raise UploadTooLarge(max_bytes)
+            return message
+
+        async def guarded_send(message):
+            if state["exceeded"]:
+                return
+            if message["type"] == "http.response.start":
+                state["response_started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            if not state["exceeded"]:
+                raise
+        if state["exceeded"] and not state["response_started"]:
+            await send_upload_too_large(send, max_bytes)
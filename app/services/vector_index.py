@@ -0,0 +1,316 @@
+import os
+import tempfile
+import threading
+import numpy as np
+from app.services.logs import get_logger
+from app.config import (
+    VECTOR_INDEX_DIR, VECTOR_INDEX_DIMENSIONS, VECTOR_INDEX_BLOCK_ROWS, VECTOR_INDEX_COMPACT_RATIO, VECTOR_INDEX_COMPACT_MIN_ROWS,
+)
+
+logger = get_logger(__name__)
+
+# A search whose candidates are fewer than 1 in this many rows gathers them instead of
+# scanning every block with the others masked out
+SPARSE_CANDIDATES_FACTOR = 8
+
+
+class IndexData:
+    """
+    Unit-normalized float32 vectors in a memory-mapped file, plus per-row item ids,
+    document codes and a liveness mask. Removed rows are only masked out, and adding an
+    item that is already indexed masks out its old row; `removed` counts those dead rows
+    until the index is compacted into a new IndexData.
+
+    Rows below `count` are never written again, so a search can score a snapshot of them
+    without the lock while rows are added or masked out.
+
+    The file is created in `directory` under a name of its own and unlinked once mapped, so
+    every process (uvicorn workers each build their index) has a private file that is
+    freed with its mapping.
+    """
+
+    def __init__(self, directory: str, dimensions: int, capacity: int = 1024):
+        fd, path = tempfile.mkstemp(prefix="vectors-", suffix=".f32", dir=directory)
+        self.file = os.fdopen(fd, "r+b")
+        self.dimensions = dimensions
+        self.capacity = 0
+        self.count = 0
+        self.removed = 0
+        self.matrix = None
+        self.ids = []  # row -> item id
+        self.rows = {}  # item id -> row
+        self.documents = []  # code -> (document_id, document_name)
+        self.document_codes_by_key = {}
+        self.document_codes = np.zeros(0, dtype=np.int32)
+        self.alive = np.zeros(0, dtype=bool)
+
+        self._grow(capacity)
+        try:
+            os.unlink(path)
+        except OSError:
+            # Platforms that can't unlink an open file keep it until the next start
+            logger.warning("Could not unlink vector index file %s", path)
+
+    def _grow(self, capacity: int):
+        # The previous mapping stays valid, the file only grows
+        self.file.truncate(capacity * self.dimensions * 4)
+        self.matrix = np.memmap(self.file, dtype=np.float32, mode="r+", shape=(capacity, self.dimensions))
+        self.document_codes = np.concatenate([self.document_codes, np.zeros(capacity - self.capacity, dtype=np.int32)])
+        self.alive = np.concatenate([self.alive, np.zeros(capacity - self.capacity, dtype=bool)])
+        self.capacity = capacity
+
+    def _document_code(self, document_id: str, document_name: str) -> int:
+        key = (document_id, document_name)
+        code = self.document_codes_by_key.get(key)
+        if code is None:
+            code = self.document_codes_by_key[key] = len(self.documents)
+            self.documents.append(key)
+        return code
+
+    def add(self, items):
+        items = [item for item in items if len(item["vector_embeddings"]) == self.dimensions]
+        if not items:
+            return
+        vectors = np.asarray([item["vector_embeddings"] for item in items], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.append(vectors / norms, [item["id"] for item in items], [(item["document_id"], item["document_name"]) for item in items])
+
+    def append(self, vectors: np.ndarray, ids: list, document_keys: list):
+        # `vectors` are already normalized, `document_keys` are (document_id, document_name)
+        self.remove_ids(ids)
+
+        start, end = self.count, self.count + len(ids)
+        if end > self.capacity:
+            self._grow(max(end, self.capacity * 2))
+        self.matrix[start:end] = vectors
+
+        for row, (item_id, document_key) in enumerate(zip(ids, document_keys), start):
+            self.ids.append(item_id)
+            self.rows[item_id] = row
+            self.document_codes[row] = self._document_code(*document_key)
+        self.alive[start:end] = True
+        self.count = end
+
+    def document_mask(self, document_name=None, document_id=None):
+        codes = [
+            code for code, (doc_id, doc_name) in enumerate(self.documents)
+            if (document_name is None or doc_name == document_name) and (document_id is None or doc_id == document_id)
+        ]
+        return np.isin(self.document_codes[:self.count], codes)
+
+    def remove(self, document_name=None, document_id=None) -> int:
+        mask = self.document_mask(document_name, document_id) & self.alive[:self.count]
+        removed_rows = np.flatnonzero(mask)
+        self.alive[removed_rows] = False
+        for row in removed_rows:
+            self.rows.pop(self.ids[row], None)
+        self.removed += len(removed_rows)
+        return len(removed_rows)
+
+    def remove_ids(self, ids) -> int:
+        removed_rows = [row for row in (self.rows.pop(item_id, None) for item_id in ids) if row is not None]
+        self.alive[removed_rows] = False
+        self.removed += len(removed_rows)
+        return len(removed_rows)
+
+    def snapshot(self, document_name=None, document_id=None):
+        """
+        Returns (matrix, ids, mask): the rows searchable now, `mask` marking the live rows of
+        the requested document. Taken under the index lock, scored with `search_rows` without it.
+        """
+        mask = self.alive[:self.count].copy()
+        if document_name is not None or document_id is not None:
+            mask &= self.document_mask(document_name, document_id)
+        return self.matrix, self.ids, mask
+
+
+def search_rows(matrix, ids, mask, queries: np.ndarray, top_k: int, block_rows=VECTOR_INDEX_BLOCK_ROWS):
+    """
+    Cosine top-k among the rows of `matrix` set in `mask` for each row of `queries`
+    (unit-normalized, shape m x dimensions). Returns one list of (item id, score) per query,
+    best first.
+    """
+    count = len(mask)
+    candidate_count = int(np.count_nonzero(mask))
+    if candidate_count == 0:
+        return [[] for _ in range(len(queries))]
+
+    # A filter matching a few documents gathers their rows, otherwise every block is scored
+    # and the rows outside the mask are discarded, reading the file sequentially
+    sparse = candidate_count * SPARSE_CANDIDATES_FACTOR < count
+    candidate_rows = np.flatnonzero(mask) if sparse else None
+    total = candidate_count if sparse else count
+
+    best_rows, best_scores = [], []
+    for block_start in range(0, total, block_rows):
+        block_end = min(block_start + block_rows, total)
+        if sparse:
+            rows = candidate_rows[block_start:block_end]
+            scores = matrix[rows] @ queries.T
+        else:
+            rows = np.arange(block_start, block_end)
+            scores = np.asarray(matrix[block_start:block_end]) @ queries.T
+            scores[~mask[block_start:block_end]] = -np.inf
+
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1, axis=0)[:k]
+        best_rows.append(rows[top])
+        best_scores.append(np.take_along_axis(scores, top, axis=0))
+
+    results = []
+    rows = np.concatenate(best_rows)
+    scores = np.concatenate(best_scores)
+    for query_num in range(len(queries)):
+        order = np.argsort(-scores[:, query_num])[:top_k]
+        results.append([
+            (ids[rows[i, query_num]], float(scores[i, query_num]))
+            for i in order if np.isfinite(scores[i, query_num])
+        ])
+    return results
+
+
+class VectorIndex:
+    """
+    Thread-safe wrapper around IndexData. `rebuild` loads every item from MongoDB into a new
+    file; items added or removed while it runs are replayed before it is swapped in. Every
+    process has its own index, IndexSync applies the writes of the other processes to it.
+
+    Once removed or replaced rows reach VECTOR_INDEX_COMPACT_RATIO of the index (and at least
+    VECTOR_INDEX_COMPACT_MIN_ROWS), the live rows are copied to a new file in a background
+    thread the same way, so updating documents doesn't grow the file without bound.
+
+    Search is an exact scan: every candidate row is read once per search, about 6 KB at 1536
+    dimensions, so its latency is bound by memory bandwidth and grows linearly with the
+    index, in the order of 0.5 ms per thousand rows. That is milliseconds for tens of
+    thousands of chunks and a second or more at a few million; millisecond latency at that
+    size needs an approximate index (IVF, HNSW), which this one doesn't attempt.
+    """
+
+    def __init__(self, directory: str, dimensions: int):
+        self.directory = directory
+        self.dimensions = dimensions
+        self.lock = threading.Lock()
+        self.data = None
+        self.pending = None
+        self.compacting = False
+        self.ready = False
+
+    def rebuild(self, load_batches):
+        os.makedirs(self.directory, exist_ok=True)
+        data = IndexData(self.directory, self.dimensions)
+        with self.lock:
+            self.pending = []
+
+        try:
+            for batch in load_batches():
+                data.add(batch)
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+
+        self._swap(data)
+        logger.info("Vector index rebuilt with %d vectors from %d documents.", data.count, len(data.documents))
+
+    def compact(self):
+        """
+        Copies the live rows to a new file and swaps it in. Searches and updates go on
+        meanwhile, updates are replayed on the copy.
+        """
+        with self.lock:
+            if self.data is None or self.pending is not None:
+                return
+            old = self.data
+            matrix, ids, documents = old.matrix, old.ids, old.documents
+            count = old.count
+            rows = np.flatnonzero(old.alive[:count])
+            document_codes = old.document_codes[rows]
+            self.pending = []
+
+        try:
+            data = IndexData(self.directory, self.dimensions, capacity=max(len(rows), 1024))
+            for start in range(0, len(rows), VECTOR_INDEX_BLOCK_ROWS):
+                block = rows[start:start + VECTOR_INDEX_BLOCK_ROWS]
+                codes = document_codes[start:start + VECTOR_INDEX_BLOCK_ROWS]
+                data.append(np.asarray(matrix[block]), [ids[row] for row in block], [documents[code] for code in codes])
+        except Exception:
+            with self.lock:
+                self.pending = None
+            raise
+
+        self._swap(data)
+        logger.info("Vector index compacted from %d to %d rows.", count, len(rows))
+
+    def _swap(self, data: IndexData):
+        with self.lock:
+            for operation, args in self.pending:
+                if operation == "add":
+                    data.add(*args)
+                elif operation == "remove_ids":
+                    data.remove_ids(*args)
+                else:
+                    data.remove(*args)
+            self.pending = None
+            self.data = data
+            self.ready = True
+
+    def _compact_if_needed(self):
+        # Called with the lock held
+        data = self.data
+        if data is None or self.pending is not None or self.compacting:
+            return
+        if data.removed < VECTOR_INDEX_COMPACT_MIN_ROWS or data.removed < data.count * VECTOR_INDEX_COMPACT_RATIO:
+            return
+        self.compacting = True
+        threading.Thread(target=self._run_compaction, name="vector-index-compaction", daemon=True).start()
+
+    def _run_compaction(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error("Vector index compaction failed: %s", e)
+        finally:
+            with self.lock:
+                self.compacting = False
+
+    def add_items(self, items):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(("add", (items,)))
+            if self.data is not None:
+                self.data.add(items)
+                self._compact_if_needed()
+
+    def remove_document(self, input_str: str):
+        # input_str is a document_name or a document_id, like delete_all_items_with_name_or_id
+        with self.lock:
+            for args in ((input_str, None), (None, input_str)):
+                if self.pending is not None:
+                    self.pending.append(("remove", args))
+                if self.data is not None:
+                    self.data.remove(*args)
+            self._compact_if_needed()
+
+    def remove_items(self, ids):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(("remove_ids", (ids,)))
+            if self.data is not None:
+                self.data.remove_ids(ids)
+                self._compact_if_needed()
+
+    def search(self, query_vectors, top_k=10, document_name=None, document_id=None):
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dimensions)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        queries = queries / norms
+        # Only the snapshot is taken under the lock, writers aren't held up by the scan
+        with self.lock:
+            if self.data is None:
+                return [[] for _ in range(len(queries))]
+            matrix, ids, mask = self.data.snapshot(document_name, document_id)
+        return search_rows(matrix, ids, mask, queries, top_k)
+
+
+vector_index = VectorIndex(VECTOR_INDEX_DIR, VECTOR_INDEX_DIMENSIONS)
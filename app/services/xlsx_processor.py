@@ -1,104 +1,212 @@
+import time
 import pandas as pd
 from uuid import uuid4
 import asyncio
-from app.services.mongo_helpers import upload_item_to_mongodb
+from openpyxl import load_workbook
+from app.services.mongo_helpers import create_bulk_writer
+from app.services.chunk_delta import ChunkDelta
 from app.models.vectorStoreItem import VectorStoreItem
-from app.services.ai_helpers import get_contextual_chunk, get_embeddings, get_sheet_description
+from app.services.ai_helpers import get_sheet_description
+from app.services.pipeline import iterate_in_thread, run_bounded_pipeline
+from app.services.tabular import build_tabular_items_from_texts, check_granularity, render_tabular_block
+from app.services.logs import get_logger
+from app.services.tracing import stage_timer, record_stage
+from app.config import XLSX_GRANULARITY, XLSX_READ_BLOCK_ROWS, INGESTION_CHUNK_WORKERS, INGESTION_QUEUE_SIZE
 
-CHUNK_SIZE=10
+logger = get_logger(__name__)
 
-async def process_chunk(context, chunk_text, document_id, sheet_name, chunk_num, document_name, progress):
-    try:
-        # Process contextual chunk and embeddings in parallel
-        contextual_chunk, embedding = await asyncio.gather(
-            get_contextual_chunk(context=context, chunk=chunk_text),
-            get_embeddings(chunk=chunk_text)
-        )
-
-        # Create and upload VectorStoreItem
-        vector_store_item = VectorStoreItem(
-            id=str(uuid4()),
-            original_text=chunk_text,
-            contextual_text=contextual_chunk,
-            document_id=str(document_id),
-            page_number=f"{sheet_name}_{chunk_num}",
-            vector_embeddings=embedding,
-            document_name=document_name
-        )
-        await upload_item_to_mongodb(vector_store_item)
-
-        # Update progress and print
-        progress["completed"] += 1
-        print(f"Completed {progress['completed']} out of {progress['total']} tasks.")
+# Rows of each sheet shown to the model to describe it
+PREVIEW_ROWS = 5
 
-    except Exception as e:
-        print(f"Error processing chunk {sheet_name}_{chunk_num}: {e}")
 
+def get_sheet_header(values) -> list:
+    """
+    Column names for a sheet's first row, named the way pandas names them: blank cells
+    become "Unnamed: <index>" and repeated names get a ".<n>" suffix.
+    """
+    header = []
+    seen = {}
+    for index, value in enumerate(values):
+        name = f"Unnamed: {index}" if value is None else value
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        header.append(f"{name}.{count}" if count else name)
+    return header
 
-async def process_xlsx(file_stream, document_name=""):
+
+def iter_xlsx_blocks(file_stream, block_rows):
+    """
+    Reads the workbook in read-only mode and yields (sheet_name, header, rows) with up to
+    `block_rows` data rows each, sheet by sheet. Only one block is held in memory at a time.
+    Rows are padded or cut to the header's width and empty rows are dropped.
+    """
+    file_stream.seek(0)
+    workbook = load_workbook(file_stream, read_only=True, data_only=True)
     try:
-        # Load the Excel file
-        xls = pd.ExcelFile(file_stream)
-        document_id = uuid4()
-
-        tasks = []
-        progress = {"completed": 0, "total": 0}  # Track progress
-
-        # Iterate through each sheet in the Excel file
-        for sheet_name in xls.sheet_names:
-            print(f"Processing sheet: {sheet_name}")
-            sheet_df = xls.parse(sheet_name)
-
-            # Extract header and rows
-            header = sheet_df.columns.tolist()
-            rows = sheet_df.values.tolist()
-            total_rows = len(rows)
-
-            # Divide rows into chunks of 25 rows each
-            chunks = [rows[i:i + CHUNK_SIZE] for i in range(0, total_rows, CHUNK_SIZE)]
-
-            # Generate context for the sheet
-            context = get_context(sheet_name, sheet_df)
-
-            # Create tasks for each chunk
-            for chunk_num, chunk in enumerate(chunks):
-                # Combine the header and chunk into a single piece of text
-                chunk_with_header = [header] + chunk
-                chunk_text = "\n".join([", ".join(map(str, row)) for row in chunk_with_header])
-
-                # Add a task for processing the chunk
-                tasks.append(process_chunk(
-                    context=context,
-                    chunk_text=chunk_text,
-                    document_id=document_id,
-                    sheet_name=sheet_name,
-                    chunk_num=chunk_num,
-                    document_name=document_name,
-                    progress=progress
-                ))
-
-        # Update total number of tasks
-        progress["total"] = len(tasks)
-
-        # Run all tasks concurrently
-        await asyncio.gather(*tasks)
-
-        print("All tasks completed.")
+        for worksheet in workbook.worksheets:
+            started = time.perf_counter()
+            values = worksheet.iter_rows(values_only=True)
+            first_row = next(values, None)
+            if not first_row:
+                continue
+            header = get_sheet_header(first_row)
+            width = len(header)
+
+            rows = []
+            for row in values:
+                if all(value is None for value in row):
+                    continue
+                row = list(row[:width])
+                row.extend([None] * (width - len(row)))
+                rows.append(row)
+                if len(rows) >= block_rows:
+                    record_stage("parse", time.perf_counter() - started)
+                    yield worksheet.title, header, rows
+                    rows = []
+                    started = time.perf_counter()
+            if rows:
+                record_stage("parse", time.perf_counter() - started)
+                yield worksheet.title, header, rows
+    finally:
+        # Read-only workbooks keep the archive open until closed
+        workbook.close()
+
+
+def iter_xlsx_chunks(file_stream, rows_per_chunk, granularity):
+    """
+    Yields (sheet_name, chunk_num, header, preview_rows, item_texts, chunk_text) for every
+    chunk of every sheet, rendering the chunks of a block together. `preview_rows` holds the
+    first rows of the sheet on its first chunk and is None on the others.
+    """
+    block_rows = max(1, XLSX_READ_BLOCK_ROWS // rows_per_chunk) * rows_per_chunk
+    chunk_nums = {}
+    for sheet_name, header, rows in iter_xlsx_blocks(file_stream, block_rows):
+        chunk_num = chunk_nums.get(sheet_name, 0)
+        preview_rows = rows[:PREVIEW_ROWS] if chunk_num == 0 else None
+        with stage_timer("parse"):
+            chunks = render_tabular_block(header, rows, granularity, rows_per_chunk)
+        for item_texts, chunk_text in chunks:
+            yield sheet_name, chunk_num, header, preview_rows, item_texts, chunk_text
+            chunk_num += 1
+            preview_rows = None
+        chunk_nums[sheet_name] = chunk_num
+
+
+def plan_xlsx_delta(file_stream, rows_per_chunk, granularity, delta):
+    # Diffing by content needs every item's text up front, the file is read again afterwards
+    delta.plan(
+        ((sheet_name, chunk_num, item_num), text)
+        for sheet_name, chunk_num, _, _, item_texts, _ in iter_xlsx_chunks(file_stream, rows_per_chunk, granularity)
+        for item_num, text in enumerate(item_texts)
+    )
+    file_stream.seek(0)
+
+
+async def process_xlsx(file_stream, document_name="", progress=None, granularity=None, rows_per_chunk=None, document_id=None, delta=None):
+    """
+    Streams every sheet through the chunk pipeline. An item's position is its sheet, its chunk
+    and its number in that chunk; chunks whose items `delta` reports as stored are skipped.
+    Returns the number of items stored for the document.
+    """
+    granularity = granularity or XLSX_GRANULARITY
+    rows_per_chunk = check_granularity(granularity, rows_per_chunk)
+    try:
+        document_id = str(document_id or uuid4())
+        delta = delta or ChunkDelta({}, document_id)
+        if delta.by_content:
+            await asyncio.to_thread(plan_xlsx_delta, file_stream, rows_per_chunk, granularity, delta)
+        skipped = {"count": 0}
+        if progress is None:
+            progress = {"completed": 0, "total": 0}  # Track progress
+
+        # Each sheet's first rows are kept when its first chunk is read. Its context is requested
+        # by the first of its chunks that isn't stored and awaited by the others, so sheets
+        # whose chunks are all stored need none.
+        previews = {}
+        contexts = {}
+
+        def get_sheet_context(sheet_name):
+            if sheet_name not in contexts:
+                contexts[sheet_name] = asyncio.ensure_future(get_context(sheet_name, *previews[sheet_name]))
+            return contexts[sheet_name]
+
+        chunks = iterate_in_thread(iter_xlsx_chunks(file_stream, rows_per_chunk, granularity))
+
+        async def all_chunks():
+            async for chunk in chunks:
+                sheet_name, _, header, preview_rows, _, _ = chunk
+                if preview_rows is not None:
+                    logger.info("Processing sheet: %s", sheet_name)
+                    previews[sheet_name] = (header, preview_rows)
+                progress["total"] += 1
+                yield chunk
+
+        async with create_bulk_writer() as writer:
+
+            async def handle_chunk(chunk):
+                sheet_name, chunk_num = chunk[:2]
+                try:
+                    await process_chunk(chunk)
+                except Exception as e:
+                    # Fail the document, a retry resumes from the chunks that were stored
+                    logger.error("Error processing chunk %s_%d: %s", sheet_name, chunk_num, e)
+                    raise
+
+            async def process_chunk(chunk):
+                sheet_name, chunk_num, _, _, item_texts, chunk_text = chunk
+                page_number = f"{sheet_name}_{chunk_num}"
+                positions = [(sheet_name, chunk_num, item_num) for item_num in range(len(item_texts))]
+                if all([delta.is_stored(position, page_number) for position in positions]):
+                    progress["completed"] += 1
+                    skipped["count"] += len(positions)
+                    return
+                item_ids = [delta.chunk_id(position) for position in positions]
+
+                # Contextualize and embed the chunk at the requested granularity
+                context = await get_sheet_context(sheet_name)
+                items = await build_tabular_items_from_texts(context, item_texts, chunk_text, granularity, usage=progress)
+
+                for item_id, (original_text, contextual_chunk, embedding) in zip(item_ids, items):
+                    await writer.add(VectorStoreItem(
+                        id=item_id,
+                        original_text=original_text,
+                        contextual_text=contextual_chunk,
+                        document_id=document_id,
+                        page_number=page_number,
+                        vector_embeddings=embedding,
+                        document_name=document_name
+                    ))
+
+                progress["completed"] += 1
+                logger.debug("Completed %d out of %d chunks.", progress["completed"], progress["total"])
+
+            try:
+                await run_bounded_pipeline(all_chunks(), handle_chunk, workers=INGESTION_CHUNK_WORKERS, queue_size=INGESTION_QUEUE_SIZE)
+            finally:
+                # Contexts still pending when an ingestion is aborted
+                for context in contexts.values():
+                    context.cancel()
+                await asyncio.gather(*contexts.values(), return_exceptions=True)
+                # Closes the workbook reader now, the job closes the file once this returns
+                await chunks.aclose()
+
+        logger.info("All chunks completed.", extra={"document_name": document_name, "skipped": skipped["count"]})
+        return writer.inserted_count + skipped["count"]
 
     except Exception as e:
         raise Exception(f"Error processing XLSX: {str(e)}")
 
 
-def get_context(sheet_name, sheet_df):
+async def get_context(sheet_name, header, preview_rows):
     """
-    Generates a description of the sheet by extracting the first 5 rows and column names.
+    Generates a description of the sheet from its column names and first rows.
     """
-    # Extract the first 5 rows from the DataFrame
-    first_5_rows = sheet_df.head(5)
-    
-    # Combine headers and first 5 rows into a single DataFrame
-    first_5_rows_with_headers = pd.concat([pd.DataFrame([sheet_df.columns], columns=sheet_df.columns), first_5_rows])
-    first_5_row_with_col_names_str_format = first_5_rows_with_headers.to_string(index=False)
-    
-    # Get context by passing the string format to `get_sheet_description`
-    return get_sheet_description(first_5_row=first_5_row_with_col_names_str_format)
+    with stage_timer("context"):
+        sheet_df = pd.DataFrame(preview_rows, columns=header)
+
+        # Combine headers and first rows into a single DataFrame
+        first_rows_with_headers = pd.concat([pd.DataFrame([sheet_df.columns], columns=sheet_df.columns), sheet_df])
+        first_5_row_with_col_names_str_format = first_rows_with_headers.to_string(index=False)
+
+        # Get context by passing the string format to `get_sheet_description`
+        return await get_sheet_description(first_5_row=first_5_row_with_col_names_str_format)
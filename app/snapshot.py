@@ -0,0 +1,37 @@
+"""
+Exports the vector store, or one document's chunks, to a columnar snapshot and loads
+snapshots back into MongoDB.
+
+    python -m app.snapshot export ./snapshots/2026-10-17 --format parquet
+    python -m app.snapshot export ./snapshots/report --document report.pdf
+    python -m app.snapshot import ./snapshots/2026-10-17
+
+Running apps add the imported items to their vector index as they are written, through
+the index change log.
+"""
+import argparse
+from app.services import mongo_helpers
+from app.services.snapshots import SNAPSHOT_FORMATS, export_snapshot, import_snapshot
+from app.config import SNAPSHOT_FORMAT, SNAPSHOT_BATCH_SIZE
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export or import columnar snapshots of the vector store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write a snapshot to a new directory")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--format", choices=SNAPSHOT_FORMATS, default=SNAPSHOT_FORMAT)
+    export_parser.add_argument("--document", help="Only export this document_name or document_id")
+    import_parser = subparsers.add_parser("import", help="Load a snapshot into the vector store")
+    import_parser.add_argument("directory")
+    for subparser in (export_parser, import_parser):
+        subparser.add_argument("--batch-size", type=int, default=SNAPSHOT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    mongo_helpers.connect_mongo()
+    if args.command == "export":
+        manifest = export_snapshot(args.directory, args.document, args.format, batch_size=args.batch_size)
+        print(f"Exported {manifest['count']} items of {len(manifest['documents'])} documents to {args.directory}.")
+    else:
+        imported = import_snapshot(args.directory, batch_size=args.batch_size)
+        print(f"Import complete, wrote {imported} items.")
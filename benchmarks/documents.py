@@ -0,0 +1,154 @@
+"""
+Synthetic documents for the ingestion benchmarks. Content is generated from a seed, so
+every run ingests the same bytes.
+"""
+import csv
+import io
+import random
+
+WORDS = (
+    "allergen audit batch calibration certificate cleaning contamination control corrective "
+    "critical deviation documentation facility haccp hazard hygiene inspection label limit "
+    "lot monitoring pathogen plan procedure product quality record recall release requirement "
+    "sanitation shelf specification storage supplier temperature traceability validation "
+    "verification water"
+).split()
+
+PRODUCTS = ["Yogurt", "Cheddar", "Granola", "Salsa", "Hummus", "Sourdough", "Kombucha", "Pesto"]
+SITES = ["Plant A", "Plant B", "Plant C", "Co-packer"]
+
+
+def make_sentence(rng: random.Random) -> str:
+    words = rng.choices(WORDS, k=rng.randint(8, 20))
+    return " ".join(words).capitalize() + "."
+
+
+def make_paragraphs(rng: random.Random, words: int) -> list:
+    paragraphs = []
+    count = 0
+    while count < words:
+        sentences = [make_sentence(rng) for _ in range(rng.randint(3, 7))]
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        count += len(paragraph.split())
+    return paragraphs
+
+
+def escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def wrap_line(paragraph: str, width: int = 95) -> list:
+    lines, line = [], ""
+    for word in paragraph.split():
+        if line and len(line) + len(word) + 1 > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines
+
+
+def make_pdf(pages: int, words_per_page: int = 450, seed: int = 0) -> bytes:
+    """
+    A text-only PDF with `pages` pages of about `words_per_page` words each, written
+    directly so that no PDF library is needed to generate it.
+    """
+    rng = random.Random(seed)
+    objects = []  # object number - 1 -> body
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog = add(b"")
+    pages_object = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+
+    page_objects = []
+    for page_num in range(pages):
+        lines = [f"Section {page_num + 1}"]
+        for paragraph in make_paragraphs(rng, words_per_page):
+            lines.extend(wrap_line(paragraph))
+            lines.append("")
+        commands = ["BT", "/F1 9 Tf", "11 TL", "40 770 Td"]
+        commands.extend(f"({escape_pdf_text(line)}) Tj T*" for line in lines[:68])
+        commands.append("ET")
+        stream = "\n".join(commands).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_objects.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_object, font, content)
+        ))
+
+    objects[catalog - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_object
+    kids = b" ".join(b"%d 0 R" % number for number in page_objects)
+    objects[pages_object - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_objects))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    output.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+    output.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+    return output.getvalue()
+
+
+TABLE_HEADER = ["lot", "product", "site", "produced_on", "temperature_c", "ph", "result", "notes"]
+
+
+def make_table_rows(rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    for row_num in range(rows):
+        yield [
+            f"L{seed:02d}-{row_num:07d}",
+            rng.choice(PRODUCTS),
+            rng.choice(SITES),
+            f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            f"{rng.uniform(1, 8):.1f}",
+            f"{rng.uniform(3.5, 6.8):.2f}",
+            rng.choice(["pass", "pass", "pass", "hold", "fail"]),
+            make_sentence(rng),
+        ]
+
+
+def make_csv(rows: int, seed: int = 0) -> bytes:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(TABLE_HEADER)
+    writer.writerows(make_table_rows(rows, seed))
+    return output.getvalue().encode("utf-8")
+
+
+def make_xlsx(rows: int, sheets: int = 2, seed: int = 0) -> bytes:
+    import pandas as pd
+
+    output = io.BytesIO()
+    rows_per_sheet = -(-rows // sheets)
+    with pd.ExcelWriter(output) as writer:
+        for sheet_num in range(sheets):
+            sheet_rows = min(rows_per_sheet, rows - sheet_num * rows_per_sheet)
+            if sheet_rows <= 0:
+                break
+            frame = pd.DataFrame(make_table_rows(sheet_rows, seed * 100 + sheet_num), columns=TABLE_HEADER)
+            frame.to_excel(writer, sheet_name=f"Results {sheet_num + 1}", index=False)
+    return output.getvalue()
+
+
+def make_document(file_type: str, size: int, seed: int = 0) -> bytes:
+    """
+    `size` is a number of pages for PDFs and of rows for CSV and XLSX files.
+    """
+    if file_type == "pdf":
+        return make_pdf(size, seed=seed)
+    if file_type == "csv":
+        return make_csv(size, seed=seed)
+    if file_type == "xlsx":
+        return make_xlsx(size, seed=seed)
+    raise ValueError(f"Unknown file type: {file_type}")
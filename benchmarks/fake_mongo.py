@@ -0,0 +1,285 @@
+"""
+An in-memory stand-in for the pymongo collections the ingestion path uses. It implements
+the subset of the collection API and query language the app relies on, with an optional
+per-call latency to model round trips.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+
+def get_field(document: dict, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+COMPARISONS = {
+    "$in": lambda value, operand: value in operand,
+    "$nin": lambda value, operand: value not in operand,
+    "$ne": lambda value, operand: value != operand,
+    "$exists": lambda value, operand: (value is not None) == bool(operand),
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+}
+
+
+def matches(document: dict, query: dict) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, branch) for branch in condition):
+                return False
+        elif field == "$and":
+            if not all(matches(document, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            value = get_field(document, field)
+            for operator, operand in condition.items():
+                if operator not in COMPARISONS:
+                    raise NotImplementedError(f"Unsupported query operator {operator}")
+                if not COMPARISONS[operator](value, operand):
+                    return False
+        elif get_field(document, field) != condition:
+            return False
+    return True
+
+
+def project(document: dict, projection: dict) -> dict:
+    if not projection:
+        return dict(document)
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        result = {field: document[field] for field in included if field in document}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    return {field: value for field, value in document.items() if projection.get(field, 1)}
+
+
+class FakeCursor:
+    def __init__(self, documents: list):
+        self.documents = documents
+        self.limit_count = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, field_direction in reversed(keys):
+            self.documents.sort(key=lambda document: (get_field(document, field) is not None, get_field(document, field)), reverse=field_direction < 0)
+        return self
+
+    def limit(self, count: int):
+        self.limit_count = count
+        return self
+
+    def __iter__(self):
+        documents = self.documents[:self.limit_count] if self.limit_count else self.documents
+        return iter(documents)
+
+
+class FakeCollection:
+    """
+    Documents are kept in insertion order under a lock, so the collection can be shared
+    by the app's writer threads. Documents are copied shallowly on the way in and out, like
+    BSON round trips would, minus the nested values. Equality and `$in` queries on an
+    indexed field only look at the matching documents, the others scan the collection.
+    """
+
+    def __init__(self, name: str = "", latency_ms: float = 0.0, indexed_fields=("id",)):
+        self.name = name
+        self.latency = latency_ms / 1000
+        self.lock = threading.Lock()
+        self.documents = {}  # _id -> document
+        self.indexes = {field: {} for field in indexed_fields}  # field -> value -> set of _id
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _index(self, document: dict, add: bool):
+        for field, index in self.indexes.items():
+            value = get_field(document, field)
+            try:
+                ids = index.setdefault(value, set()) if add else index.get(value, set())
+            except TypeError:
+                continue  # Unhashable values are only found by scanning
+            if add:
+                ids.add(document["_id"])
+            else:
+                ids.discard(document["_id"])
+
+    def _candidates(self, query: dict):
+        for field, condition in query.items():
+            if field not in self.indexes:
+                continue
+            if isinstance(condition, dict) and set(condition) == {"$in"}:
+                values = condition["$in"]
+            elif not isinstance(condition, (dict, list)):
+                values = [condition]
+            else:
+                continue
+            ids = set()
+            for value in values:
+                ids.update(self.indexes[field].get(value, ()))
+            return [self.documents[_id] for _id in ids]
+        return self.documents.values()
+
+    def _matching(self, query):
+        query = query or {}
+        return [document for document in self._candidates(query) if matches(document, query)]
+
+    def _store(self, document: dict):
+        previous = self.documents.get(document["_id"])
+        if previous is not None:
+            self._index(previous, add=False)
+        self.documents[document["_id"]] = document
+        self._index(document, add=True)
+
+    def _insert(self, document: dict):
+        document = dict(document)
+        document.setdefault("_id", ObjectId())
+        self._store(document)
+        return document["_id"]
+
+    def _apply_update(self, document: dict, update: dict):
+        for operator, fields in update.items():
+            if operator == "$set":
+                for field, value in fields.items():
+                    document[field] = value
+            elif operator == "$unset":
+                for field in fields:
+                    document.pop(field, None)
+            elif operator == "$inc":
+                for field, amount in fields.items():
+                    document[field] = document.get(field, 0) + amount
+            elif operator == "$currentDate":
+                # Naive UTC, like pymongo returns dates by default
+                for field in fields:
+                    document[field] = datetime.now(timezone.utc).replace(tzinfo=None)
+            else:
+                raise NotImplementedError(f"Unsupported update operator {operator}")
+
+    def _replace(self, query: dict, replacement: dict, upsert: bool):
+        # Returns (matched, upserted_id)
+        found = self._matching(query)
+        if found:
+            replacement = dict(replacement)
+            replacement["_id"] = found[0]["_id"]
+            self._store(replacement)
+            return 1, None
+        if upsert:
+            return 0, self._insert(replacement)
+        return 0, None
+
+    def _update(self, query: dict, update: dict, upsert: bool, many: bool = False):
+        found = self._matching(query)
+        if not many:
+            found = found[:1]
+        for document in found:
+            self._index(document, add=False)
+            self._apply_update(document, update)
+            self._index(document, add=True)
+        if found or not upsert:
+            return len(found), None
+        document = {field: value for field, value in query.items() if not field.startswith("$") and not isinstance(value, dict)}
+        self._apply_update(document, update)
+        return 0, self._insert(document)
+
+    def create_index(self, keys, **kwargs):
+        with self.lock:
+            for field, _ in keys[:1]:
+                if field not in self.indexes:
+                    self.indexes[field] = {}
+                    for document in self.documents.values():
+                        self._index(document, add=True)
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    def insert_one(self, document: dict) -> InsertOneResult:
+        self._wait()
+        with self.lock:
+            return InsertOneResult(self._insert(document), True)
+
+    def insert_many(self, documents: list, ordered: bool = True) -> InsertManyResult:
+        self._wait()
+        with self.lock:
+            return InsertManyResult([self._insert(document) for document in documents], True)
+
+    def bulk_write(self, requests: list, ordered: bool = True) -> BulkWriteResult:
+        self._wait()
+        counts = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []}
+        with self.lock:
+            for index, request in enumerate(requests):
+                if isinstance(request, ReplaceOne):
+                    matched, upserted_id = self._replace(request._filter, request._doc, request._upsert)
+                elif isinstance(request, UpdateOne):
+                    matched, upserted_id = self._update(request._filter, request._doc, request._upsert)
+                else:
+                    raise NotImplementedError(f"Unsupported bulk request {type(request).__name__}")
+                counts["nMatched"] += matched
+                counts["nModified"] += matched
+                if upserted_id is not None:
+                    counts["nUpserted"] += 1
+                    counts["upserted"].append({"index": index, "_id": upserted_id})
+        return BulkWriteResult(counts, True)
+
+    def replace_one(self, query: dict, replacement: dict, upsert: bool = False) -> UpdateResult:
+        self._wait()
+        with self.lock:
+            matched, upserted_id = self._replace(query, replacement, upsert)
+        return UpdateResult({"n": matched or int(upserted_id is not None), "nModified": matched, "upserted": upserted_id}, True)
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        self._wait()
+        with self.lock:
+            matched, upserted_id = self._update(query, update, upsert)
+        return UpdateResult({"n": matched or int(upserted_id is not None), "nModified": matched, "upserted": upserted_id}, True)
+
+    def update_many(self, query: dict, update: dict, upsert: bool = False) -> UpdateResult:
+        self._wait()
+        with self.lock:
+            matched, upserted_id = self._update(query, update, upsert, many=True)
+        return UpdateResult({"n": matched or int(upserted_id is not None), "nModified": matched, "upserted": upserted_id}, True)
+
+    def delete_many(self, query: dict) -> DeleteResult:
+        self._wait()
+        with self.lock:
+            found = self._matching(query)
+            for document in found:
+                self._index(document, add=False)
+                del self.documents[document["_id"]]
+        return DeleteResult({"n": len(found)}, True)
+
+    def find(self, query: dict = None, projection: dict = None, **kwargs) -> FakeCursor:
+        self._wait()
+        with self.lock:
+            return FakeCursor([project(document, projection) for document in self._matching(query)])
+
+    def find_one(self, query: dict = None, projection: dict = None):
+        return next(iter(self.find(query, projection).limit(1)), None)
+
+    def distinct(self, field: str, query: dict = None) -> list:
+        values = []
+        for document in self.find(query):
+            value = get_field(document, field)
+            if value not in values:
+                values.append(value)
+        return values
+
+    def count_documents(self, query: dict) -> int:
+        with self.lock:
+            return len(self._matching(query))
+
+    def estimated_document_count(self) -> int:
+        return len(self.documents)
+
+    def drop(self):
+        with self.lock:
+            self.documents = {}
+            self.indexes = {field: {} for field in self.indexes}
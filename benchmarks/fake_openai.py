@@ -0,0 +1,284 @@
+"""
+A local stand-in for the OpenAI chat completions, embeddings and models APIs. Answers are
+deterministic and shaped like the real ones; latency, rate limits and errors are
+configurable so the app's scheduling and retries are exercised too.
+
+FakeOpenAIProcess runs it in a subprocess, so encoding its responses doesn't compete with
+the benchmarked process for the GIL or count towards its RSS:
+
+    python -m benchmarks.fake_openai --port 8099 --chat-latency-ms 300
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+CHUNK_ID_PATTERN = re.compile(r'<chunk id="(\d+)">')
+
+MODELS = ["gpt-4o-mini", "text-embedding-ada-002"]
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def make_embedding(text: str, dimensions: int, encoding_format: str = "float"):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions, dtype=np.float32)
+    vector /= np.linalg.norm(vector)
+    if encoding_format == "base64":
+        return base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+    return vector.tolist()
+
+
+class FakeOpenAI:
+    """
+    `latency_ms` maps "chat" and "embeddings" to the time each request takes, with up to
+    `jitter` of it added at random. `requests_per_minute`, when set, is enforced per API
+    over a sliding minute with 429 responses; `error_rate` is the share of requests
+    answered with a 500.
+    """
+
+    def __init__(self, latency_ms=None, jitter=0.2, requests_per_minute=0, error_rate=0.0, dimensions=1536, seed=0):
+        self.latency_ms = {"chat": 300.0, "embeddings": 100.0, **(latency_ms or {})}
+        self.jitter = jitter
+        self.requests_per_minute = requests_per_minute
+        self.error_rate = error_rate
+        self.dimensions = dimensions
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_times = {"chat": deque(), "embeddings": deque()}
+        self.stats = {}  # (api, status) -> count
+        self.server = None
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self, host: str = "127.0.0.1", port: int = 0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.respond(*fake.handle_get(self.path))
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("content-length", 0)))
+                self.respond(*fake.handle(self.path, json.loads(body or b"{}")))
+
+            def respond(self, status, headers, payload):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("content-type", "application/json")
+                self.send_header("content-length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-openai", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+
+    def _count(self, api: str, status: int):
+        with self.lock:
+            self.stats[(api, status)] = self.stats.get((api, status), 0) + 1
+
+    def _check_rate_limit(self, api: str):
+        # Seconds until a request slot frees up, None when the request is allowed
+        if not self.requests_per_minute:
+            return None
+        now = time.monotonic()
+        with self.lock:
+            times = self.request_times[api]
+            while times and times[0] <= now - 60:
+                times.popleft()
+            if len(times) >= self.requests_per_minute:
+                return times[0] + 60 - now
+            times.append(now)
+        return None
+
+    def handle_get(self, path: str):
+        if path.endswith("/models"):
+            self._count("models", 200)
+            return 200, {}, {"object": "list", "data": [{"id": model, "object": "model", "created": 0, "owned_by": "benchmark"} for model in MODELS]}
+        if path == "/_stats":
+            # Not part of the OpenAI API, read by FakeOpenAIProcess
+            with self.lock:
+                return 200, {}, {"stats": [[api, status, count] for (api, status), count in self.stats.items()]}
+        return 404, {}, {"error": {"message": f"Unknown path {path}", "type": "invalid_request_error"}}
+
+    def handle(self, path: str, request: dict):
+        if path == "/_stats/reset":
+            self.reset_stats()
+            return 200, {}, {}
+        if path.endswith("/chat/completions"):
+            api, respond = "chat", self.chat_completion
+        elif path.endswith("/embeddings"):
+            api, respond = "embeddings", self.embeddings
+        else:
+            return 404, {}, {"error": {"message": f"Unknown path {path}", "type": "invalid_request_error"}}
+
+        retry_after = self._check_rate_limit(api)
+        if retry_after is not None:
+            self._count(api, 429)
+            return 429, {"retry-after": f"{retry_after:.3f}"}, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+
+        latency = self.latency_ms[api] / 1000
+        with self.lock:
+            latency *= 1 + self.random.random() * self.jitter
+            failed = self.random.random() < self.error_rate
+        time.sleep(latency)
+
+        if failed:
+            self._count(api, 500)
+            return 500, {}, {"error": {"message": "Injected server error", "type": "server_error"}}
+        self._count(api, 200)
+        return 200, {}, respond(request)
+
+    def chat_completion(self, request: dict) -> dict:
+        prompt = "".join(message.get("content") or "" for message in request.get("messages", []))
+        chunk_ids = CHUNK_ID_PATTERN.findall(prompt)
+        if chunk_ids:
+            content = json.dumps({"contexts": [{"id": int(chunk_id), "context": f"Synthetic context for chunk {chunk_id}."} for chunk_id in chunk_ids]})
+        else:
+            content = "Synthetic context situating this chunk within a food safety document."
+
+        prompt_tokens = estimate_tokens(prompt)
+        completion_tokens = estimate_tokens(content)
+        return {
+            "id": f"chatcmpl-{hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", ""),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def embeddings(self, request: dict) -> dict:
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        prompt_tokens = sum(estimate_tokens(text) for text in inputs)
+        return {
+            "object": "list",
+            "model": request.get("model", ""),
+            "data": [{"object": "embedding", "index": i, "embedding": make_embedding(text, self.dimensions, request.get("encoding_format", "float"))} for i, text in enumerate(inputs)],
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+
+class FakeOpenAIProcess:
+    """
+    Runs FakeOpenAI in a child process, with the same `base_url`, `stats`, `reset_stats`
+    and `stop` as the in-process server. Takes the FakeOpenAI arguments.
+    """
+
+    def __init__(self, latency_ms=None, jitter=0.2, requests_per_minute=0, error_rate=0.0, dimensions=1536, seed=0):
+        latency_ms = latency_ms or {}
+        self.arguments = [
+            "--chat-latency-ms", str(latency_ms.get("chat", 300.0)),
+            "--embedding-latency-ms", str(latency_ms.get("embeddings", 100.0)),
+            "--jitter", str(jitter),
+            "--rpm", str(requests_per_minute),
+            "--error-rate", str(error_rate),
+            "--dimensions", str(dimensions),
+            "--seed", str(seed),
+        ]
+        self.process = None
+        self.base_url = None
+
+    def start(self, host: str = "127.0.0.1", port: int = 0):
+        # Started from the repository root so the child imports this module as the parent does
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fake_openai", "--host", host, "--port", str(port), *self.arguments],
+            cwd=root, stdout=subprocess.PIPE, text=True
+        )
+        # The child prints its base URL once it is listening
+        line = self.process.stdout.readline().strip()
+        if not line:
+            self.stop()
+            raise RuntimeError("The fake OpenAI server did not start")
+        self.base_url = line
+        return self
+
+    def _admin_url(self, path: str) -> str:
+        return self.base_url.rsplit("/v1", 1)[0] + path
+
+    @property
+    def stats(self) -> dict:
+        with urllib.request.urlopen(self._admin_url("/_stats")) as response:
+            return {(api, status): count for api, status, count in json.load(response)["stats"]}
+
+    def reset_stats(self):
+        request = urllib.request.Request(self._admin_url("/_stats/reset"), data=b"{}", method="POST")
+        with urllib.request.urlopen(request):
+            pass
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the fake OpenAI API until interrupted.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=100.0)
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    fake = FakeOpenAI(
+        latency_ms={"chat": args.chat_latency_ms, "embeddings": args.embedding_latency_ms},
+        jitter=args.jitter, requests_per_minute=args.rpm, error_rate=args.error_rate,
+        dimensions=args.dimensions, seed=args.seed,
+    ).start(args.host, args.port)
+    print(fake.base_url, flush=True)
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
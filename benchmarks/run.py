@@ -0,0 +1,373 @@
+"""
+Offline ingestion benchmarks. Synthetic documents go through the real `process_pdf`,
+`process_csv` and `process_xlsx` against a local stand-in for the OpenAI API and an
+in-memory stand-in for MongoDB (or a real server with --mongo-uri), so throughput can be
+measured without API credits or a live cluster.
+
+Each scenario is `type:size` or `type:sizexcount`, where size is pages for PDFs and rows
+for CSV and XLSX files, and count the number of documents ingested, `--concurrency` at a
+time. For each scenario it reports docs/sec, chunks/sec, the peak RSS of this process (PDF
+extraction workers and the fake OpenAI server are separate processes and not counted) and
+how long the event loop was blocked.
+
+    python -m benchmarks.run --preset quick
+    python -m benchmarks.run --scenarios pdf:100x4,csv:50000 --save-baseline main
+    python -m benchmarks.run --preset standard --compare main
+
+App settings are read from the environment as usual. The OpenAI request and token limits
+default to values high enough that only the fake server's own --rpm limit applies, and
+the AI cache is off so every chunk reaches the API.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.documents import make_document
+from benchmarks.fake_mongo import FakeCollection
+from benchmarks.fake_openai import FakeOpenAIProcess
+
+PRESETS = {
+    "quick": "pdf:10x2,csv:1000x2,xlsx:1000x2",
+    "standard": "pdf:10x8,pdf:100x2,csv:1000x8,csv:50000,xlsx:1000x8,xlsx:50000",
+    "full": "pdf:10x20,pdf:100x4,pdf:1000,csv:1000x20,csv:50000x2,csv:500000,xlsx:1000x20,xlsx:50000x2,xlsx:500000",
+}
+
+# The app's collections, set on mongo_helpers instead of connecting with connect_mongo
+COLLECTIONS = ("vector_store", "jobs", "documents", "index_changes")
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# Higher is better for throughputs, lower for the rest. Loop blocking is reported but not
+# compared: it comes from the pandas and Mongo writer threads holding the GIL, and varies
+# several-fold between runs of the same code on a machine with few CPUs
+COMPARED_METRICS = {
+    "docs_per_sec": "higher",
+    "chunks_per_sec": "higher",
+    "peak_rss_mb": "lower",
+}
+
+# App settings for the benchmark unless set in the environment
+APP_ENVIRONMENT = {
+    "OPENAI_CHAT_REQUESTS_PER_MINUTE": "1000000",
+    "OPENAI_CHAT_TOKENS_PER_MINUTE": "1000000000",
+    "OPENAI_EMBEDDING_REQUESTS_PER_MINUTE": "1000000",
+    "OPENAI_EMBEDDING_TOKENS_PER_MINUTE": "1000000000",
+    "AI_CACHE_ENABLED": "false",
+    "INGESTION_TRACING_ENABLED": "false",
+    "LOG_LEVEL": "WARNING",
+    # The fake OpenAI server accepts any key, checker/config.py isn't needed
+    "OPENAI_API_KEY": "benchmark",
+}
+
+
+def parse_scenarios(text: str) -> list:
+    scenarios = []
+    for entry in filter(None, (part.strip() for part in text.split(","))):
+        file_type, _, size = entry.partition(":")
+        size, _, count = size.partition("x")
+        if file_type not in ("pdf", "csv", "xlsx") or not size.isdigit() or (count and not count.isdigit()):
+            raise ValueError(f"Invalid scenario '{entry}', expected type:size or type:sizexcount")
+        scenarios.append({"name": entry, "file_type": file_type, "size": int(size), "count": int(count or 1)})
+    return scenarios
+
+
+def read_rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # Peak rather than current RSS, in KB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class RssSampler:
+    """
+    Samples the RSS of this process on a thread, keeping the peak.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.peak = read_rss_bytes()
+        self.thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self.thread.start()
+        return self
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, read_rss_bytes())
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, read_rss_bytes())
+
+
+class LoopMonitor:
+    """
+    Measures event loop blocking: a task sleeps for `interval` over and over, and any wake-up
+    later than `threshold` past its deadline counts as time the loop was blocked.
+    """
+
+    def __init__(self, interval: float = 0.01, threshold: float = 0.005):
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0.0
+        self.max_lag = 0.0
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            deadline = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - deadline
+            self.max_lag = max(self.max_lag, lag)
+            if lag > self.threshold:
+                self.blocked += lag
+
+    async def __aenter__(self):
+        self.task = asyncio.create_task(self._run())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+def setup_app(args, fake_openai: FakeOpenAIProcess, workdir: str):
+    """
+    Points the app at the stand-ins. Has to run before the app is imported, its clients
+    and settings are created at import time.
+    """
+    for name, value in APP_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    os.environ["OPENAI_BASE_URL"] = fake_openai.base_url
+    os.environ["VECTOR_INDEX_DIR"] = os.path.join(workdir, "vector-index")
+    os.environ["INGESTION_JOBS_DIR"] = os.path.join(workdir, "ingestion-jobs")
+    os.environ["AI_CACHE_PATH"] = os.path.join(workdir, "ai-cache.sqlite3")
+
+    from app.services import mongo_helpers
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        db = MongoClient(args.mongo_uri)[args.mongo_database]
+        collections = {name: db[f"benchmark_{name}"] for name in COLLECTIONS}
+        for collection in collections.values():
+            collection.drop()
+    else:
+        collections = {name: FakeCollection(name, latency_ms=args.mongo_latency_ms) for name in COLLECTIONS}
+    mongo_helpers.collection = collections["vector_store"]
+    mongo_helpers.jobs_collection = collections["jobs"]
+    mongo_helpers.documents_collection = collections["documents"]
+    mongo_helpers.index_changes_collection = collections["index_changes"]
+    mongo_helpers.change_origin = "benchmark"
+    return collections
+
+
+async def run_scenario(scenario: dict, args, fake_openai: FakeOpenAIProcess, collections: dict, workdir: str) -> dict:
+    from app.services.ingestion import get_processor
+    from app.services.vector_index import vector_index
+
+    paths = []
+    for i in range(scenario["count"]):
+        path = os.path.join(workdir, f"{scenario['file_type']}-{scenario['size']}-{i}.{scenario['file_type']}")
+        if not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(make_document(scenario["file_type"], scenario["size"], seed=i))
+        paths.append(path)
+
+    # Every scenario starts from an empty store and index
+    for collection in collections.values():
+        collection.drop()
+    await asyncio.to_thread(vector_index.rebuild, lambda: [])
+    fake_openai.reset_stats()
+    gc.collect()
+
+    process = get_processor(scenario["file_type"])
+    slots = asyncio.Semaphore(args.concurrency)
+    progress = {"completed": 0, "total": 0}
+
+    async def ingest(path):
+        async with slots:
+            with open(path, "rb") as file_stream:
+                return await process(file_stream, document_name=os.path.basename(path), progress=progress)
+
+    with RssSampler() as rss:
+        async with LoopMonitor() as loop_monitor:
+            start = time.perf_counter()
+            chunks = sum(await asyncio.gather(*[ingest(path) for path in paths]))
+            elapsed = time.perf_counter() - start
+
+    return {
+        "documents": len(paths),
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "docs_per_sec": round(len(paths) / elapsed, 4),
+        "chunks_per_sec": round(chunks / elapsed, 2),
+        "peak_rss_mb": round(rss.peak / 1024 ** 2, 1),
+        "loop_blocked_ms": round(loop_monitor.blocked * 1000, 1),
+        "loop_max_lag_ms": round(loop_monitor.max_lag * 1000, 1),
+        "prompt_tokens": progress.get("prompt_tokens", 0),
+        "openai_responses": {f"{api}:{status}": count for (api, status), count in sorted(fake_openai.stats.items())},
+    }
+
+
+async def warm_up(file_types: set, workdir: str):
+    """
+    Ingests a small document of each type, untimed, so the first scenario doesn't pay for
+    importing the processors, starting the PDF extraction pool and opening connections.
+    """
+    from app.services.ingestion import get_processor
+    for file_type in sorted(file_types):
+        path = os.path.join(workdir, f"warm-up.{file_type}")
+        with open(path, "wb") as f:
+            f.write(make_document(file_type, 10))
+        with open(path, "rb") as file_stream:
+            await get_processor(file_type)(file_stream, document_name=os.path.basename(path))
+
+
+async def run_scenarios(scenarios: list, args, fake_openai: FakeOpenAIProcess, collections: dict, workdir: str) -> dict:
+    # One event loop for every scenario, the app's schedulers and batchers are bound to it
+    await warm_up({scenario["file_type"] for scenario in scenarios}, workdir)
+    print(f"{'scenario':<18} {'docs':>5} {'chunks':>9} {'seconds':>9} {'docs/s':>9} {'chunks/s':>11} {'rss MB':>9} {'blocked ms':>10} {'max lag':>8}")
+    results = {}
+    for scenario in scenarios:
+        results[scenario["name"]] = await run_scenario(scenario, args, fake_openai, collections, workdir)
+        print(format_row(scenario["name"], results[scenario["name"]]), flush=True)
+    return results
+
+
+def compare_results(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns a line for every metric of a scenario in both runs that got worse than the
+    baseline by more than `tolerance`, a fraction of the baseline value.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        for metric, better in COMPARED_METRICS.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (better == "higher" and change < -tolerance) or (better == "lower" and change > tolerance):
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def format_row(name: str, result: dict) -> str:
+    return (
+        f"{name:<18} {result['documents']:>5} {result['chunks']:>9} {result['seconds']:>9.2f} {result['docs_per_sec']:>9.3f} "
+        f"{result['chunks_per_sec']:>11.1f} {result['peak_rss_mb']:>9.1f} {result['loop_blocked_ms']:>10.1f} {result['loop_max_lag_ms']:>8.1f}"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline ingestion benchmarks against local stand-ins for OpenAI and MongoDB.")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="quick")
+    parser.add_argument("--scenarios", help="Comma-separated type:size[xcount] entries, overrides --preset")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("INGESTION_WORKERS", "2")), help="Documents ingested at the same time")
+    parser.add_argument("--chat-latency-ms", type=float, default=300.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=100.0)
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute the fake OpenAI API allows per API, 0 for no limit")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of OpenAI requests answered with a 500")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.0, help="Latency of every call to the in-memory MongoDB")
+    parser.add_argument("--mongo-uri", help="Use this MongoDB server instead of the in-memory stand-in")
+    parser.add_argument("--mongo-database", default="ingestion_benchmark")
+    parser.add_argument("--workdir", help="Where documents are generated, a temporary directory by default")
+    parser.add_argument("--save-baseline", metavar="NAME", help=f"Save the results to {BASELINES_DIR}/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare the results to a saved baseline, exiting with 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed change against the baseline, as a fraction")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    scenarios = parse_scenarios(args.scenarios or PRESETS[args.preset])
+
+    fake_openai = FakeOpenAIProcess(
+        latency_ms={"chat": args.chat_latency_ms, "embeddings": args.embedding_latency_ms},
+        requests_per_minute=args.rpm,
+        error_rate=args.error_rate,
+    ).start()
+    temporary = None
+    if args.workdir:
+        workdir = args.workdir
+        os.makedirs(workdir, exist_ok=True)
+    else:
+        temporary = tempfile.TemporaryDirectory(prefix="ingestion-benchmark-")
+        workdir = temporary.name
+
+    try:
+        collections = setup_app(args, fake_openai, workdir)
+        results = asyncio.run(run_scenarios(scenarios, args, fake_openai, collections, workdir))
+        from app.services.tokenizer import get_tokenizer_name
+    finally:
+        fake_openai.stop()
+        if temporary is not None:
+            temporary.cleanup()
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {
+            "concurrency": args.concurrency,
+            "chat_latency_ms": args.chat_latency_ms,
+            "embedding_latency_ms": args.embedding_latency_ms,
+            "rpm": args.rpm,
+            "error_rate": args.error_rate,
+            "mongo": "server" if args.mongo_uri else "memory",
+            "mongo_latency_ms": args.mongo_latency_ms,
+            # Chunk sizes depend on it, tiktoken falls back to counting characters offline
+            "tokenizer": get_tokenizer_name(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        path = os.path.join(BASELINES_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {path}")
+
+    if args.compare:
+        with open(os.path.join(BASELINES_DIR, f"{args.compare}.json")) as f:
+            baseline = json.load(f)
+        if baseline.get("settings") != report["settings"]:
+            print(f"Warning: baseline settings differ: {baseline.get('settings')}")
+        regressions = compare_results(results, baseline, args.tolerance)
+        if regressions:
+            print(f"{len(regressions)} regressions against baseline '{args.compare}':")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"No regressions against baseline '{args.compare}'.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
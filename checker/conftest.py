@@ -0,0 +1,2 @@
+# upload_test.py is the sync script itself, it connects to MongoDB and S3 when imported
+collect_ignore = ["upload_test.py"]
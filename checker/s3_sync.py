@@ -0,0 +1,132 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+SUPPORTED_EXTENSIONS = (".pdf", ".xlsx", ".csv")
+
+
+class S3SyncEngine:
+    """
+    Incremental S3 -> API sync. Each object's ETag and LastModified are remembered in a
+    state file next to the download cache, so unchanged objects are skipped, modified ones
+    are uploaded again in update mode and downloads are reused between cycles.
+
+    The S3 client, the source of ingested document names and the upload call are passed in,
+    so the engine can run against moto or MinIO. `upload_file(path, document_name, update)`
+    returns whether the API accepted the file.
+    """
+
+    def __init__(self, s3, bucket_name, directory_path, get_ingested_names, upload_file,
+                 delete_missing_documents=None, workers=4):
+        self.s3 = s3
+        self.bucket_name = bucket_name
+        self.directory_path = directory_path
+        self.get_ingested_names = get_ingested_names
+        self.upload_file = upload_file
+        self.delete_missing_documents = delete_missing_documents
+        self.workers = workers
+        self.state_path = os.path.join(directory_path, ".sync-state.json")
+        self.state_lock = threading.Lock()
+        os.makedirs(directory_path, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_state(self):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(temp_path, self.state_path)
+
+    def _set_state(self, key, **fields):
+        with self.state_lock:
+            self.state.setdefault(key, {}).update(fields)
+            self._save_state()
+
+    def list_objects(self):
+        """
+        Returns {document_name: object} for every supported object, following pagination.
+        """
+        objects = {}
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name):
+            for obj in page.get("Contents", []):
+                if obj["Key"].lower().endswith(SUPPORTED_EXTENSIONS):
+                    objects[os.path.basename(obj["Key"])] = {
+                        "key": obj["Key"],
+                        "etag": obj["ETag"].strip('"'),
+                        "last_modified": obj["LastModified"].isoformat(),
+                    }
+        return objects
+
+    def _download(self, document_name, obj):
+        local_file_path = os.path.join(self.directory_path, document_name)
+        cached = self.state.get(obj["key"], {})
+        if cached.get("downloaded_etag") != obj["etag"] or not os.path.exists(local_file_path):
+            print(f"Downloading {obj['key']} from S3...")
+            self.s3.download_file(self.bucket_name, obj["key"], local_file_path)
+            self._set_state(obj["key"], downloaded_etag=obj["etag"])
+        return local_file_path
+
+    def _sync_object(self, document_name, obj, modified):
+        if modified:
+            print(f"{obj['key']} changed in S3, updating {document_name}")
+
+        local_file_path = self._download(document_name, obj)
+        if self.upload_file(local_file_path, document_name, modified):
+            self._set_state(obj["key"], etag=obj["etag"], last_modified=obj["last_modified"], document_name=document_name)
+            return True
+        return False
+
+    def _prune_cache(self, objects):
+        keys = {obj["key"] for obj in objects.values()}
+        with self.state_lock:
+            for key in [key for key in self.state if key not in keys]:
+                document_name = self.state.pop(key).get("document_name") or os.path.basename(key)
+                local_file_path = os.path.join(self.directory_path, document_name)
+                if os.path.isfile(local_file_path):
+                    os.remove(local_file_path)
+            self._save_state()
+
+    def run_cycle(self):
+        """
+        Runs one sync cycle and returns counts of the actions taken.
+        """
+        objects = self.list_objects()
+        ingested_names = self.get_ingested_names()
+        print(f"Fetched {len(objects)} objects from S3 and {len(ingested_names)} ingested documents.")
+
+        if self.delete_missing_documents is not None:
+            self.delete_missing_documents(ingested_names, set(objects.keys()))
+        self._prune_cache(objects)
+
+        to_sync = []
+        for document_name, obj in objects.items():
+            known = self.state.get(obj["key"], {})
+            if document_name not in ingested_names:
+                to_sync.append((document_name, obj, False))
+            elif "etag" not in known:
+                # Ingested before change tracking, take the current version as the baseline
+                self._set_state(obj["key"], etag=obj["etag"], last_modified=obj["last_modified"], document_name=document_name)
+            elif known["etag"] != obj["etag"]:
+                to_sync.append((document_name, obj, True))
+
+        results = {"unchanged": len(objects) - len(to_sync), "synced": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._sync_object, *item): item[0] for item in to_sync}
+            for future in as_completed(futures):
+                try:
+                    synced = future.result()
+                except Exception as e:
+                    print(f"Error processing {futures[future]}: {e}")
+                    synced = False
+                results["synced" if synced else "failed"] += 1
+
+        print(f"Sync results: {results}")
+        return results
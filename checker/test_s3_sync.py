@@ -0,0 +1,135 @@
+"""
+Tests S3SyncEngine against moto's in-memory S3.
+
+    pip install -r requirements-dev.txt
+    python -m pytest checker
+"""
+import os
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from s3_sync import S3SyncEngine
+
+# moto 5 mocks every service with mock_aws, earlier versions had one decorator per service
+mock_aws = getattr(moto, "mock_aws", None) or moto.mock_s3
+
+BUCKET_NAME = "test-docs"
+
+
+class FakeApi:
+    """
+    Stands in for the API: remembers what was uploaded and deleted, and which documents
+    are ingested.
+    """
+
+    def __init__(self):
+        self.ingested = set()
+        self.uploads = []  # (document_name, update, content)
+        self.deleted = []
+
+    def get_ingested_names(self):
+        return set(self.ingested)
+
+    def upload_file(self, path, document_name, update):
+        with open(path, "rb") as f:
+            self.uploads.append((document_name, update, f.read()))
+        self.ingested.add(document_name)
+        return True
+
+    def delete_missing_documents(self, ingested_names, s3_names):
+        for document_name in ingested_names - s3_names:
+            self.deleted.append(document_name)
+            self.ingested.discard(document_name)
+
+
+@pytest.fixture
+def s3():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET_NAME)
+        yield client
+
+
+@pytest.fixture
+def api():
+    return FakeApi()
+
+
+def make_engine(s3, api, directory):
+    return S3SyncEngine(
+        s3, BUCKET_NAME, str(directory),
+        get_ingested_names=api.get_ingested_names,
+        upload_file=api.upload_file,
+        delete_missing_documents=api.delete_missing_documents,
+        workers=2,
+    )
+
+
+def test_list_objects_follows_pagination(s3, api, tmp_path):
+    # list_objects_v2 returns at most 1000 keys per page
+    for i in range(1005):
+        s3.put_object(Bucket=BUCKET_NAME, Key=f"docs/file-{i:04d}.csv", Body=b"a,b\n1,2\n")
+    s3.put_object(Bucket=BUCKET_NAME, Key="docs/notes.txt", Body=b"skipped")
+
+    objects = make_engine(s3, api, tmp_path).list_objects()
+
+    assert len(objects) == 1005
+    assert "file-1004.csv" in objects
+    assert "notes.txt" not in objects
+
+
+def test_unchanged_objects_are_skipped(s3, api, tmp_path):
+    s3.put_object(Bucket=BUCKET_NAME, Key="a.csv", Body=b"a\n1\n")
+    s3.put_object(Bucket=BUCKET_NAME, Key="b.pdf", Body=b"%PDF-1.4")
+    engine = make_engine(s3, api, tmp_path)
+
+    assert engine.run_cycle() == {"unchanged": 0, "synced": 2, "failed": 0}
+    assert sorted((name, update) for name, update, _ in api.uploads) == [("a.csv", False), ("b.pdf", False)]
+
+    assert engine.run_cycle() == {"unchanged": 2, "synced": 0, "failed": 0}
+    assert len(api.uploads) == 2
+
+    # The state survives a restart of the checker
+    assert make_engine(s3, api, tmp_path).run_cycle() == {"unchanged": 2, "synced": 0, "failed": 0}
+
+
+def test_changed_etag_is_synced_in_update_mode(s3, api, tmp_path):
+    s3.put_object(Bucket=BUCKET_NAME, Key="a.csv", Body=b"a\n1\n")
+    s3.put_object(Bucket=BUCKET_NAME, Key="b.csv", Body=b"b\n1\n")
+    engine = make_engine(s3, api, tmp_path)
+    engine.run_cycle()
+
+    s3.put_object(Bucket=BUCKET_NAME, Key="a.csv", Body=b"a\n2\n")
+    assert engine.run_cycle() == {"unchanged": 1, "synced": 1, "failed": 0}
+    assert api.uploads[-1] == ("a.csv", True, b"a\n2\n")
+    with open(os.path.join(tmp_path, "a.csv"), "rb") as f:
+        assert f.read() == b"a\n2\n"
+
+
+def test_failed_upload_is_retried(s3, api, tmp_path):
+    s3.put_object(Bucket=BUCKET_NAME, Key="a.csv", Body=b"a\n1\n")
+    engine = make_engine(s3, api, tmp_path)
+    engine.upload_file = lambda path, document_name, update: False
+    assert engine.run_cycle() == {"unchanged": 0, "synced": 0, "failed": 1}
+
+    engine.upload_file = api.upload_file
+    assert engine.run_cycle() == {"unchanged": 0, "synced": 1, "failed": 0}
+
+
+def test_removed_objects_are_deleted_and_pruned_from_the_cache(s3, api, tmp_path):
+    s3.put_object(Bucket=BUCKET_NAME, Key="docs/a.csv", Body=b"a\n1\n")
+    s3.put_object(Bucket=BUCKET_NAME, Key="docs/b.csv", Body=b"b\n1\n")
+    engine = make_engine(s3, api, tmp_path)
+    engine.run_cycle()
+    assert os.path.exists(os.path.join(tmp_path, "b.csv"))
+
+    s3.delete_object(Bucket=BUCKET_NAME, Key="docs/b.csv")
+    assert engine.run_cycle() == {"unchanged": 1, "synced": 0, "failed": 0}
+
+    assert api.deleted == ["b.csv"]
+    assert not os.path.exists(os.path.join(tmp_path, "b.csv"))
+    assert os.path.exists(os.path.join(tmp_path, "a.csv"))
+    assert set(engine.state) == {"docs/a.csv"}
+    assert set(make_engine(s3, api, tmp_path).state) == {"docs/a.csv"}
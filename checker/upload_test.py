@@ -3,29 +3,36 @@ import requests
 import time
 import boto3
 from pymongo import MongoClient
-from config import MONGO_DB_DATABASE_NAME, MONGO_DB_URI, MONGO_DB_COLLECTION_NAME
+from config import MONGO_DB_DATABASE_NAME, MONGO_DB_URI
 from functools import lru_cache
+from s3_sync import S3SyncEngine
 
 # Initialize MongoDB and S3 clients
 print("Initializing MongoDB and S3 clients...")
 try:
     client = MongoClient(MONGO_DB_URI)
     db = client[MONGO_DB_DATABASE_NAME]
-    collection = db[MONGO_DB_COLLECTION_NAME]
+    # Per-document manifests kept by the API, one record per document
+    documents_collection = db[os.getenv("DOCUMENTS_COLLECTION_NAME", "documents")]
     print("MongoDB connection established.")
 except Exception as e:
     print(f"Error initializing MongoDB client: {e}")
     raise
 
 try:
-    s3 = boto3.client('s3')
-    bucket_name = 'niagara-docs-folder'
+    # S3_ENDPOINT_URL points the sync at MinIO or a moto server instead of AWS
+    s3 = boto3.client('s3', endpoint_url=os.getenv("S3_ENDPOINT_URL") or None)
+    bucket_name = os.getenv("S3_BUCKET_NAME", 'niagara-docs-folder')
     print("S3 client initialized.")
 except Exception as e:
     print(f"Error initializing S3 client: {e}")
     raise
 
-# Ensure local directory exists
+api_url = os.getenv("FASTAPI_URL", "http://localhost:8888")
+sync_workers = int(os.getenv("SYNC_WORKERS", "4"))
+sync_interval_seconds = float(os.getenv("SYNC_INTERVAL_SECONDS", "10"))
+
+# Downloads are kept here between cycles, next to the sync state file
 directory_path = "./niagara-docs-folder"
 os.makedirs(directory_path, exist_ok=True)
 print(f"Local directory {directory_path} is ready.")
@@ -35,7 +42,8 @@ print(f"Local directory {directory_path} is ready.")
 def get_mongo_document_names():
     print("Fetching MongoDB document names...")
     try:
-        mongo_docs = set(item["document_name"] for item in collection.find({}, {"document_name": 1}))
+        # Failed ingestions are uploaded again, which resumes them
+        mongo_docs = set(documents_collection.distinct("document_name", {"status": {"$ne": "failed"}}))
         print(f"Fetched {len(mongo_docs)} document names from MongoDB.")
         return mongo_docs
     except Exception as e:
@@ -48,107 +56,73 @@ def refresh_mongo_document_names():
     get_mongo_document_names.cache_clear()
     return get_mongo_document_names()
 
-# Get mapping of base filenames to full S3 keys
-def get_s3_document_names():
-    print("Fetching S3 document names...")
-    try:
-        response = s3.list_objects_v2(Bucket=bucket_name)
-        if 'Contents' in response:
-            s3_docs = {
-                os.path.basename(obj['Key']): obj['Key']
-                for obj in response['Contents'] if (obj['Key'].endswith(".xlsx") or obj['Key'].endswith(".pdf"))
-            }
-            print(f"Fetched {len(s3_docs)} document names from S3.")
-            return s3_docs
-        else:
-            print("No documents found in S3 bucket.")
-            return {}
-    except Exception as e:
-        print(f"Error fetching S3 document names: {e}")
-        return {}
-
-# Bulk delete MongoDB documents missing in S3
+# Delete documents missing in S3 through the API, which also drops them from its search index
 def delete_mongo_documents_not_in_s3(mongo_docs, s3_doc_names_set):
     print("Checking for MongoDB documents to delete...")
-    documents_to_delete = [{"document_name": doc_name} for doc_name in mongo_docs - s3_doc_names_set]
-    if documents_to_delete:
+    documents_to_delete = sorted(mongo_docs - s3_doc_names_set)
+    if not documents_to_delete:
+        print("No MongoDB documents to delete.")
+        return
+
+    url = f"{api_url}/api/delete-document/"
+    for document_name in documents_to_delete:
         try:
-            delete_count = collection.delete_many({"$or": documents_to_delete}).deleted_count
-            print(f"Deleted {delete_count} MongoDB entries for documents not found in S3.")
+            response = requests.post(url, json={"input_str": document_name})
+            if response.status_code == 200:
+                print(f"Deleted {document_name}: {response.json().get('message')}")
+            else:
+                print(f"Failed to delete {document_name}: HTTP {response.status_code} - {response.text}")
         except Exception as e:
-            print(f"Error deleting MongoDB documents: {e}")
-    else:
-        print("No MongoDB documents to delete.")
+            print(f"Error deleting {document_name} through FastAPI: {e}")
 
-# Download missing S3 documents and upload to FastAPI
-def upload_to_fastapi(file_path, filename):
-    url = "http://localhost:8888/api/upload-file/"
+MIME_TYPES = {
+    ".xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    ".pdf": "application/pdf",
+    ".csv": "text/csv",
+}
+
+# Upload a downloaded S3 document to FastAPI, returns whether the API accepted it.
+# A changed document is uploaded in update mode, which only re-embeds its changed chunks.
+def upload_to_fastapi(file_path, filename, update=False):
+    url = f"{api_url}/api/upload-file/"
     print(f"Uploading {filename} to FastAPI...")
     try:
-        if filename.endswith(".xlsx"):
-            mime_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        elif filename.endswith(".pdf"):
-            mime_type = "application/pdf"
-        else:
+        mime_type = MIME_TYPES.get(os.path.splitext(filename)[1].lower())
+        if mime_type is None:
             print(f"Unsupported file type for {filename}. Skipping upload.")
-            return
+            return False
 
         with open(file_path, "rb") as file:
             files = {"file": (filename, file, mime_type)}
-            response = requests.post(url, files=files)
-            if response.status_code == 200:
-                print(f"Uploaded {filename} successfully.")
-            else:
-                print(f"Failed to upload {filename}: HTTP {response.status_code} - {response.text}")
+            response = requests.post(url, files=files, data={"update": "true" if update else "false"})
+            if response.status_code in (200, 202):
+                print(f"Uploaded {filename} successfully: {response.json().get('job_id')}")
+                return True
+            print(f"Failed to upload {filename}: HTTP {response.status_code} - {response.text}")
     except Exception as e:
         print(f"Error uploading {filename} to FastAPI: {e}")
+    return False
 
-def download_and_upload_missing_s3_documents(mongo_docs, s3_docs):
-    print("Checking for missing S3 documents to download and upload...")
-    for doc_name in s3_docs.keys() - mongo_docs:
-        local_file_path = os.path.join(directory_path, doc_name)
-        s3_key = s3_docs[doc_name]  # Get the full S3 key
-        try:
-            # Download file from S3 if it doesn't exist locally
-            if not os.path.exists(local_file_path):
-                print(f"Downloading {doc_name} from S3...")
-                s3.download_file(bucket_name, s3_key, local_file_path)
-            # Upload to FastAPI
-            upload_to_fastapi(local_file_path, doc_name)
-        except Exception as e:
-            print(f"Error processing {doc_name}: {e}")
-
-# Cleanup function to clear local directory files
-def clear_local_directory():
-    print("Clearing local directory...")
-    for filename in os.listdir(directory_path):
-        file_path = os.path.join(directory_path, filename)
-        try:
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                print(f"Cleared local file: {filename}")
-        except Exception as e:
-            print(f"Error deleting file {filename}: {e}")
+sync_engine = S3SyncEngine(
+    s3,
+    bucket_name,
+    directory_path,
+    get_ingested_names=refresh_mongo_document_names,
+    upload_file=upload_to_fastapi,
+    delete_missing_documents=delete_mongo_documents_not_in_s3,
+    workers=sync_workers,
+)
 
-# Main loop with optimized MongoDB calls
+# Main loop, each cycle only touches objects that are new or changed in S3
 def main_sync_loop():
     while True:
         print("Starting MongoDB-S3-FastAPI sync cycle...\n")
         try:
-            # Step 0: Clear local directory
-            clear_local_directory()
-            # Refresh cached MongoDB document names every 5 minutes
-            mongo_docs = refresh_mongo_document_names()
-            s3_docs = get_s3_document_names()
-            s3_doc_names_set = set(s3_docs.keys())
-            # Delete MongoDB entries not in S3
-            delete_mongo_documents_not_in_s3(mongo_docs, s3_doc_names_set)
-            # Download and upload missing S3 documents
-            download_and_upload_missing_s3_documents(mongo_docs, s3_docs)
+            sync_engine.run_cycle()
         except Exception as e:
             print(f"Error during sync cycle: {e}")
-        print("Sync cycle complete. Waiting 10 seconds before next cycle.\n")
-        time.sleep(10)
+        print(f"Sync cycle complete. Waiting {sync_interval_seconds:g} seconds before next cycle.\n")
+        time.sleep(sync_interval_seconds)
 
 
 if __name__ == "__main__":
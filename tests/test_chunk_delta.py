@@ -0,0 +1,109 @@
+from uuid import uuid4
+from app.services.chunk_delta import ChunkDelta, hash_chunk_text
+from app.services.chunk_ids import make_chunk_id
+
+
+def store(document_id, chunks):
+    # chunks: (position, text, page_number), as get_stored_chunks would return them
+    return {make_chunk_id(document_id, *position): (hash_chunk_text(text), page_number) for position, text, page_number in chunks}
+
+
+def plan(delta, chunks):
+    delta.plan((position, text) for position, text, _ in chunks)
+    return {position: delta.is_stored(position, page_number) for position, _, page_number in chunks}
+
+
+def test_resume_skips_chunks_stored_at_their_position():
+    document_id = str(uuid4())
+    delta = ChunkDelta(store(document_id, [((0, 0), "a", "0")]), document_id)
+
+    assert delta.is_stored((0, 0), "0")
+    assert not delta.is_stored((0, 1), "0")
+    assert delta.chunk_id((0, 1)) == make_chunk_id(document_id, 0, 1)
+    assert delta.moved == {}
+    assert delta.vanished_ids() == []
+
+
+def test_unchanged_document_keeps_every_chunk():
+    old_id, new_id = str(uuid4()), str(uuid4())
+    chunks = [((0, 0), "a", "0"), ((0, 1), "b", "0"), ((1, 0), "c", "1")]
+    stored = store(old_id, chunks)
+    delta = ChunkDelta(stored, new_id, by_content=True)
+
+    assert plan(delta, chunks) == {(0, 0): True, (0, 1): True, (1, 0): True}
+    assert {delta.chunk_id(position) for position, _, _ in chunks} == set(stored)
+    assert delta.moved == {}
+    assert delta.vanished_ids() == []
+
+
+def test_moved_chunks_keep_their_ids_and_record_their_new_page():
+    old_id, new_id = str(uuid4()), str(uuid4())
+    delta = ChunkDelta(store(old_id, [((0,), "a", "0"), ((1,), "b", "1")]), new_id, by_content=True)
+
+    # A chunk inserted in front shifts the others by one page
+    stored = plan(delta, [((0,), "new", "0"), ((1,), "a", "1"), ((2,), "b", "2")])
+
+    assert stored == {(0,): False, (1,): True, (2,): True}
+    assert delta.chunk_id((0,)) == make_chunk_id(new_id, 0)
+    assert delta.chunk_id((1,)) == make_chunk_id(old_id, 0)
+    assert delta.chunk_id((2,)) == make_chunk_id(old_id, 1)
+    assert delta.moved == {make_chunk_id(old_id, 0): "1", make_chunk_id(old_id, 1): "2"}
+    assert delta.vanished_ids() == []
+
+
+def test_duplicate_chunks_each_claim_a_different_stored_chunk():
+    old_id, new_id = str(uuid4()), str(uuid4())
+    stored = store(old_id, [((0,), "x", "0"), ((1,), "x", "1")])
+    delta = ChunkDelta(stored, new_id, by_content=True)
+
+    assert plan(delta, [((0,), "x", "0"), ((1,), "x", "1"), ((2,), "x", "2")]) == {(0,): True, (1,): True, (2,): False}
+    ids = [delta.chunk_id((position,)) for position in range(3)]
+    assert set(ids[:2]) == set(stored)
+    assert ids[2] == make_chunk_id(new_id, 2)
+    assert delta.vanished_ids() == []
+
+
+def test_fewer_duplicates_leave_the_extra_stored_chunk_vanished():
+    old_id, new_id = str(uuid4()), str(uuid4())
+    stored = store(old_id, [((0,), "x", "0"), ((1,), "x", "1")])
+    delta = ChunkDelta(stored, new_id, by_content=True)
+
+    assert plan(delta, [((0,), "x", "0")]) == {(0,): True}
+    assert len(delta.vanished_ids()) == 1
+    assert {delta.chunk_id((0,)), *delta.vanished_ids()} == set(stored)
+
+
+def test_vanished_and_changed_chunks():
+    old_id, new_id = str(uuid4()), str(uuid4())
+    delta = ChunkDelta(store(old_id, [((0,), "a", "0"), ((1,), "b", "1"), ((2,), "c", "2")]), new_id, by_content=True)
+
+    # "b" is gone and "c" changed, both stored chunks vanish and the new text gets a new id
+    assert plan(delta, [((0,), "a", "0"), ((1,), "c2", "1")]) == {(0,): True, (1,): False}
+    assert sorted(delta.vanished_ids()) == sorted([make_chunk_id(old_id, 1), make_chunk_id(old_id, 2)])
+    assert delta.chunk_id((1,)) == make_chunk_id(new_id, 1)
+
+
+def test_chunks_at_their_own_position_are_matched_first():
+    document_id = str(uuid4())
+    delta = ChunkDelta(store(document_id, [((0,), "x", "0"), ((1,), "x", "1")]), document_id, by_content=True)
+
+    # (1,) keeps its own id even though (0,) came first with the same text as before
+    assert plan(delta, [((0,), "y", "0"), ((1,), "x", "1"), ((2,), "x", "2")]) == {(0,): False, (1,): True, (2,): True}
+    assert delta.chunk_id((1,)) == make_chunk_id(document_id, 1)
+    assert delta.chunk_id((2,)) == make_chunk_id(document_id, 0)
+    assert delta.chunk_id((0,)) not in delta.stored_chunks
+    assert delta.moved == {make_chunk_id(document_id, 0): "2"}
+    assert delta.vanished_ids() == []
+
+
+def test_new_chunks_never_take_the_id_of_a_stored_chunk():
+    document_id = str(uuid4())
+    stored = store(document_id, [((0,), "x", "0"), ((1,), "z", "1")])
+    delta = ChunkDelta(stored, document_id, by_content=True)
+
+    # (0,)'s positional id is kept by (1,), the new "y" chunk needs another one
+    assert plan(delta, [((0,), "y", "0"), ((1,), "x", "1")]) == {(0,): False, (1,): True}
+    assert delta.chunk_id((1,)) == make_chunk_id(document_id, 0)
+    assert delta.chunk_id((0,)) not in stored
+    # (1,)'s positional id belongs to the vanished "z" chunk, which is deleted afterwards
+    assert delta.vanished_ids() == [make_chunk_id(document_id, 1)]
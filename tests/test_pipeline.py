@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import pytest
+from app.services.pipeline import iterate_in_thread, run_bounded_pipeline
+
+
+def numbers(events, count=100, release=None):
+    try:
+        for number in range(count):
+            if release is not None and number == 1:
+                release.wait()
+            yield number
+    finally:
+        events.append("closed")
+
+
+def test_closing_early_closes_the_iterator():
+    events = []
+
+    async def main():
+        chunks = iterate_in_thread(numbers(events))
+        assert [await anext(chunks), await anext(chunks)] == [0, 1]
+        await chunks.aclose()
+        events.append("aclosed")
+
+    asyncio.run(main())
+    assert events == ["closed", "aclosed"]
+
+
+def test_cancelling_waits_for_the_running_next_before_closing():
+    events = []
+    release = threading.Event()
+
+    async def consume(chunks):
+        async for _ in chunks:
+            pass
+
+    async def main():
+        chunks = iterate_in_thread(numbers(events, release=release))
+        task = asyncio.create_task(consume(chunks))
+        await asyncio.sleep(0.05)
+        # The second `next` is blocked on its thread
+        task.cancel()
+        asyncio.get_running_loop().call_later(0.05, release.set)
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        events.append("cancelled")
+
+    asyncio.run(main())
+    assert events == ["closed", "cancelled"]
+
+
+def test_failing_pipeline_leaves_the_source_to_be_closed():
+    events = []
+
+    async def handle(number):
+        if number == 3:
+            raise ValueError("failed")
+
+    async def main():
+        chunks = iterate_in_thread(numbers(events))
+        try:
+            with pytest.raises(ValueError):
+                await run_bounded_pipeline(chunks, handle, workers=2, queue_size=2)
+        finally:
+            await chunks.aclose()
+        events.append("returned")
+
+    asyncio.run(main())
+    assert events == ["closed", "returned"]
@@ -0,0 +1,65 @@
+import asyncio
+import json
+from app.services.uploads import BLOCK_SIZE, UploadLimitMiddleware
+
+
+def run_request(app, path, chunks, content_length=None):
+    """
+    Sends a POST with its body in `chunks` through UploadLimitMiddleware, returning the
+    status, the response body and how many chunks the app received.
+    """
+    headers = [] if content_length is None else [(b"content-length", str(content_length).encode())]
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1} for i, chunk in enumerate(chunks)]
+    sent = []
+    received = []
+
+    async def receive():
+        message = messages.pop(0)
+        received.append(message)
+        return message
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(UploadLimitMiddleware(app)(scope, receive, send))
+    body = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return sent[0]["status"], body, len(received)
+
+
+async def read_body_app(scope, receive, send):
+    # Reads the whole body, then answers 200, or 400 when reading fails like the form parser
+    try:
+        while True:
+            message = await receive()
+            if not message.get("more_body"):
+                break
+        status = 200
+    except Exception:
+        status = 400
+    await send({"type": "http.response.start", "status": status, "headers": []})
+    await send({"type": "http.response.body", "body": b"done"})
+
+
+def test_content_length_over_the_limit_is_rejected_before_reading(monkeypatch):
+    monkeypatch.setattr("app.services.uploads.UPLOAD_MAX_BYTES", 100)
+    status, body, received = run_request(read_body_app, "/api/upload-file/", [b"x"], content_length=100 + BLOCK_SIZE + 1)
+    assert status == 413
+    assert json.loads(body) == {"detail": "Uploads are limited to 100 bytes"}
+    assert received == 0
+
+
+def test_chunked_body_is_aborted_once_it_passes_the_limit(monkeypatch):
+    monkeypatch.setattr("app.services.uploads.UPLOAD_MAX_BYTES", 100)
+    chunks = [b"x" * (BLOCK_SIZE // 2)] * 10
+    status, body, received = run_request(read_body_app, "/api/upload-file/", chunks)
+    # The app's own answer to the aborted read is replaced
+    assert status == 413
+    assert b"limited to 100 bytes" in body
+    assert received == 3
+
+
+def test_bodies_within_the_limit_and_other_paths_pass(monkeypatch):
+    monkeypatch.setattr("app.services.uploads.UPLOAD_MAX_BYTES", 100)
+    assert run_request(read_body_app, "/api/upload-file/", [b"x" * 50, b"x" * 50])[:2] == (200, b"done")
+    assert run_request(read_body_app, "/api/search", [b"x" * BLOCK_SIZE] * 3)[:2] == (200, b"done")
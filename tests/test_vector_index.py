@@ -0,0 +1,169 @@
+import time
+import numpy as np
+import pytest
+from app.services import vector_index as vector_index_module
+from app.services.vector_index import IndexData, VectorIndex, search_rows
+
+DIMENSIONS = 8
+
+
+def make_items(count, document_name="a.pdf", document_id="doc-a", start=0, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, DIMENSIONS))
+    return [
+        {"id": f"{document_id}-{start + i}", "document_id": document_id, "document_name": document_name, "vector_embeddings": vector.tolist()}
+        for i, vector in enumerate(vectors)
+    ]
+
+
+def brute_force(items, query, top_k):
+    vectors = np.asarray([item["vector_embeddings"] for item in items], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = np.asarray(query, dtype=np.float32) / np.linalg.norm(query)
+    scores = vectors @ query
+    return [(items[i]["id"], float(scores[i])) for i in np.argsort(-scores)[:top_k]]
+
+
+def assert_same_matches(matches, expected):
+    assert [item_id for item_id, _ in matches] == [item_id for item_id, _ in expected]
+    assert [score for _, score in matches] == pytest.approx([score for _, score in expected], abs=1e-5)
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = VectorIndex(str(tmp_path), DIMENSIONS)
+    index.rebuild(lambda: [])
+    return index
+
+
+@pytest.mark.parametrize("kept_every", [1, 2, 50])
+def test_search_rows_matches_brute_force(tmp_path, kept_every):
+    # Every row, half of them (scanned and masked) or one in 50 (gathered)
+    items = make_items(500)
+    data = IndexData(str(tmp_path), DIMENSIONS)
+    data.add(items)
+    matrix, ids, mask = data.snapshot()
+    mask[np.arange(len(mask)) % kept_every != 0] = False
+    queries = np.random.default_rng(1).normal(size=(3, DIMENSIONS)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    results = search_rows(matrix, ids, mask, queries, top_k=7, block_rows=64)
+
+    candidates = items[::kept_every]
+    for query, matches in zip(queries, results):
+        assert_same_matches(matches, brute_force(candidates, query, 7))
+
+
+def test_search_returns_fewer_matches_than_top_k_when_few_rows_are_live(index):
+    index.add_items(make_items(3))
+    assert len(index.search([1.0] * DIMENSIONS, top_k=10)[0]) == 3
+
+
+def test_search_filters_by_document(index):
+    items_a, items_b = make_items(40), make_items(40, "b.pdf", "doc-b", seed=1)
+    index.add_items(items_a + items_b)
+    query = items_b[0]["vector_embeddings"]
+
+    assert_same_matches(index.search(query, top_k=5, document_name="b.pdf")[0], brute_force(items_b, query, 5))
+    assert_same_matches(index.search(query, top_k=5, document_id="doc-a")[0], brute_force(items_a, query, 5))
+    assert index.search(query, top_k=5, document_name="c.pdf")[0] == []
+
+
+def test_adding_an_indexed_item_replaces_its_vector(index):
+    items = make_items(20)
+    index.add_items(items)
+    replaced = dict(items[3], vector_embeddings=[-value for value in items[3]["vector_embeddings"]])
+    index.add_items([replaced])
+
+    matches = index.search(replaced["vector_embeddings"], top_k=21)[0]
+    assert len(matches) == 20
+    assert matches[0] == (replaced["id"], pytest.approx(1.0))
+    assert index.data.removed == 1
+
+
+def test_remove_document_by_name_or_id_and_remove_items(index):
+    items_a, items_b = make_items(10), make_items(10, "b.pdf", "doc-b", seed=1)
+    index.add_items(items_a + items_b)
+
+    index.remove_document("a.pdf")
+    index.remove_items([items_b[0]["id"]])
+    ids = {item_id for item_id, _ in index.search([1.0] * DIMENSIONS, top_k=100)[0]}
+    assert ids == {item["id"] for item in items_b[1:]}
+
+    index.remove_document("doc-b")
+    assert index.search([1.0] * DIMENSIONS, top_k=100)[0] == []
+
+
+def test_snapshot_is_unaffected_by_later_changes(index):
+    items = make_items(10)
+    index.add_items(items)
+    matrix, ids, mask = index.data.snapshot()
+
+    index.remove_items([items[0]["id"]])
+    index.add_items(make_items(2000, start=10, seed=1))
+
+    query = np.asarray([items[0]["vector_embeddings"]], dtype=np.float32)
+    query /= np.linalg.norm(query)
+    matches = search_rows(matrix, ids, mask, query, top_k=20)[0]
+    assert_same_matches(matches, brute_force(items, query[0], 20))
+
+
+def test_changes_during_rebuild_are_replayed(tmp_path):
+    index = VectorIndex(str(tmp_path), DIMENSIONS)
+    stored, added = make_items(100), make_items(5, "b.pdf", "doc-b", seed=1)
+
+    def load_batches():
+        yield stored[:50]
+        # Written and deleted while the rebuild is loading the collection
+        index.add_items(added)
+        index.remove_items([stored[0]["id"], stored[60]["id"]])
+        index.remove_document("doc-b")
+        index.add_items(added[:1])
+        yield stored[50:]
+
+    index.rebuild(load_batches)
+
+    assert index.ready and index.pending is None
+    ids = {item_id for item_id, _ in index.search([1.0] * DIMENSIONS, top_k=100)[0]}
+    assert ids == {item["id"] for item in stored + added[:1]} - {stored[0]["id"], stored[60]["id"]}
+
+
+def test_compact_drops_dead_rows_and_replays_changes(index, monkeypatch):
+    items = make_items(300)
+    index.add_items(items)
+    index.remove_items([item["id"] for item in items[:100]])
+    added = make_items(5, "b.pdf", "doc-b", seed=1)
+
+    class IndexDataWithChanges(IndexData):
+        # Items are written and deleted while the live rows are being copied
+        def append(self, *args):
+            super().append(*args)
+            if not getattr(self, "changed", False):
+                self.changed = True
+                index.add_items(added)
+                index.remove_items([items[150]["id"]])
+
+    monkeypatch.setattr(vector_index_module, "IndexData", IndexDataWithChanges)
+    index.compact()
+
+    # The live rows were copied, the removal made meanwhile masks one of them
+    assert index.data.count == 200 + 5
+    assert index.data.removed == 1
+    expected = items[100:150] + items[151:] + added
+    query = items[200]["vector_embeddings"]
+    assert_same_matches(index.search(query, top_k=20)[0], brute_force(expected, query, 20))
+
+
+def test_compaction_runs_once_enough_rows_are_dead(index, monkeypatch):
+    monkeypatch.setattr(vector_index_module, "VECTOR_INDEX_COMPACT_MIN_ROWS", 10)
+    items = make_items(100)
+    index.add_items(items)
+    index.remove_items([item["id"] for item in items[:30]])
+
+    deadline = time.time() + 5
+    while (index.compacting or index.data.removed) and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert index.data.removed == 0
+    assert index.data.count == 70
+    query = items[50]["vector_embeddings"]
+    assert_same_matches(index.search(query, top_k=10)[0], brute_force(items[30:], query, 10))